@@ -1,11 +1,20 @@
 import streamlit as st
-from google import genai
-from google.genai import types
-import PIL.Image
-from io import BytesIO
+import functools
 import json
 import os
+import threading
 import time
+import uuid
+from streamlit.errors import StreamlitAPIException
+from archviz.timing import RerunTimer, TimingReport
+from archviz.prompt_context import PromptContextIndex
+from archviz.prompt_cache import PromptCache
+from archviz.prompt_engine import improve_prompt, stream_prompt
+from archviz.recipes import RecipeComposer, format_options
+from archviz.jobs import JobRegistry, STATUS_LABELS, DONE, ERROR, QUEUED
+
+# Las importaciones pesadas (google.genai, PIL) se hacen tras el login, ver más abajo
+timer = RerunTimer()
 
 # ==========================================
 # 1. CONFIGURACIÓN VISUAL (ESTILO TÉCNICO)
@@ -100,56 +109,159 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- FUNCIONES DE UTILIDAD ---
-def upscale_image(image, target_width=3840): 
-    w_percent = (target_width / float(image.size[0]))
-    h_size = int((float(image.size[1]) * float(w_percent)))
-    img_resized = image.resize((target_width, h_size), PIL.Image.Resampling.LANCZOS)
-    return img_resized
-
-# TRADUCTOR PARA VEO 3.1
-def pil_to_veo_image(pil_img):
-    buf = BytesIO()
-    pil_img.convert("RGB").save(buf, format="JPEG")
-    return types.Image(
-        image_bytes=buf.getvalue(),
-        mime_type="image/jpeg"
+# --- TIEMPOS DEL PROCESO (arranque y reruns) ---
+@st.cache_resource
+def get_timing_report():
+    return TimingReport()
+
+# --- BIBLIOTECA JSON ---
+# Compilada una vez por proceso y compartida (solo lectura) por todas las sesiones
+@st.cache_resource
+def get_json_library():
+    from archviz.library import JsonLibrary
+    library = JsonLibrary(os.path.join(APP_DIR, "data"))
+    library.reload()
+    return library
+
+# Índice de relevancia: se construye una vez por versión de la biblioteca
+@st.cache_resource(max_entries=2)
+def get_context_index(_data, version):
+    return PromptContextIndex(_data)
+
+# Compositor local de recetas: una vez por versión de la biblioteca
+@st.cache_resource(max_entries=2)
+def get_recipe_composer(_data, version):
+    return RecipeComposer(_data)
+
+# Caché de prompts compartida por todas las sesiones del proceso
+@st.cache_resource
+def get_prompt_cache():
+    return PromptCache()
+
+# Presupuesto de RAM del proceso para imágenes y blobs de todas las sesiones (vuelca a disco al llenarse)
+@st.cache_resource
+def get_memory_budget():
+    from archviz.memory import MemoryBudget, DEFAULT_BUDGET_MB
+    return MemoryBudget(max_bytes=int(os.environ.get("ARCHVIZ_MEMORY_BUDGET_MB", DEFAULT_BUDGET_MB)) * 1024 * 1024)
+
+# session_id propio -> id de sesión de Streamlit, para saber qué sesiones siguen abiertas
+@st.cache_resource
+def get_session_map():
+    return {}
+
+def liberar_sesiones_cerradas():
+    # Las sesiones cerradas dejan de contar en el consumo de RAM por sesión
+    from streamlit import runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    if ctx is None or not runtime.exists():
+        return  # sin servidor (AppTest, modo bare): no hay sesiones que consultar
+    rt = runtime.get_instance()
+    sesiones = get_session_map()
+    sesiones[st.session_state.session_id] = ctx.session_id
+    for owner, sid in list(sesiones.items()):
+        if not rt.is_active_session(sid):
+            sesiones.pop(owner, None)
+    get_memory_budget().release_inactive(lambda owner: owner in sesiones)
+
+# Referencias decodificadas una vez por contenido y compartidas entre sesiones
+@st.cache_resource
+def get_reference_store():
+    from archviz.media import ReferenceStore
+    return ReferenceStore(get_memory_budget())
+
+# Historial en disco: PNG codificado una vez por contenido; en sesión solo metadatos
+MAX_HISTORIAL = 50
+
+@st.cache_resource
+def get_history_store():
+    from archviz.history import HISTORY_MAX_DAYS, HISTORY_MAX_GB, HistoryStore
+    store = HistoryStore(
+        budget=get_memory_budget(),
+        max_bytes=int(os.environ.get("ARCHVIZ_HISTORY_MAX_GB", HISTORY_MAX_GB)) * 1024 ** 3,
+        max_age_days=int(os.environ.get("ARCHVIZ_HISTORY_MAX_DAYS", HISTORY_MAX_DAYS))
     )
+    store.enforce_retention()
+    return store
 
-# --- CARGADOR DE DATOS JSON ---
-@st.cache_data
-def load_json_data(folder_path="data"):
-    data_context = {}
-    if not os.path.exists(folder_path):
-        return None, "⚠️ Carpeta 'data' no encontrada."
-    
-    files = [f for f in os.listdir(folder_path) if f.endswith('.json')]
-    if not files:
-        return None, "⚠️ Carpeta 'data' vacía."
+# Videos generados: carpeta con retención, servidos solo a través de la sesión
+# (st.video / descarga), detrás de la contraseña. ARCHVIZ_PUBLIC_VIDEOS=1 los sirve
+# por URL estática desde disco (menos memoria), pero esas URLs no piden contraseña.
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
-    try:
-        for filename in files:
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                category_name = filename.replace('.json', '')
-                data_context[category_name] = json.load(f)
-        return data_context, f"✅ Biblioteca ArchViz cargada ({len(files)} archivos)."
-    except Exception as e:
-        return None, f"Error leyendo JSONs: {e}"
+@st.cache_resource
+def get_media_store():
+    from archviz.config import DEFAULT_CACHE_DIR
+    from archviz.media_store import MediaStore
+    publicos = os.environ.get("ARCHVIZ_PUBLIC_VIDEOS", "") not in ("", "0")
+    static_root = os.path.join(APP_DIR, "static")
+    # Privados: fuera de static/, para que ninguna URL estática los alcance
+    defecto = os.path.join(static_root, "videos") if publicos else os.path.join(DEFAULT_CACHE_DIR, "videos")
+    root = os.environ.get("ARCHVIZ_MEDIA_DIR", defecto)
+    url_prefix = None
+    if publicos and os.path.dirname(os.path.abspath(root)) == static_root:
+        url_prefix = f"app/static/{os.path.basename(root)}"
+    store = MediaStore(
+        root,
+        url_prefix=url_prefix,
+        max_bytes=int(os.environ.get("ARCHVIZ_MEDIA_MAX_GB", "5")) * 1024 ** 3,
+        max_age_days=int(os.environ.get("ARCHVIZ_MEDIA_MAX_DAYS", "7"))
+    )
+    store.enforce_retention()
+    return store
+
+# Registro de renders en segundo plano (máx. renders simultáneos por cuota de API)
+MAX_VIDEO_JOBS = 2
+MAX_IMAGE_JOBS = 4
+MAX_UPSCALE_JOBS = 1  # cada reescalado ya usa todos los núcleos
+MAX_PROMPT_JOBS = 4
+
+@st.cache_resource
+def get_job_registry():
+    return JobRegistry(limits={"video": MAX_VIDEO_JOBS, "image": MAX_IMAGE_JOBS, "upscale": MAX_UPSCALE_JOBS,
+                               "prompt": MAX_PROMPT_JOBS})
+
+@st.cache_resource
+def get_upscale_engine():
+    from archviz.upscale import UPSCALE_MAX_DAYS, UPSCALE_MAX_GB, UpscaleEngine
+    engine = UpscaleEngine(
+        max_bytes=int(os.environ.get("ARCHVIZ_UPSCALE_MAX_GB", UPSCALE_MAX_GB)) * 1024 ** 3,
+        max_age_days=int(os.environ.get("ARCHVIZ_UPSCALE_MAX_DAYS", UPSCALE_MAX_DAYS))
+    )
+    engine.files.enforce_retention()
+    return engine
+
+# Resultados de renders idénticos (opcional): huella de la petición -> historial / video en disco
+@st.cache_resource
+def get_render_cache():
+    from archviz.render_cache import RenderCache
+    return RenderCache()
+
+# Cliente GenAI único por proceso: reutiliza su pool de conexiones HTTP entre reruns y sesiones
+@st.cache_resource
+def get_client():
+    from google import genai
+    return genai.Client(api_key=st.secrets["GOOGLE_API_KEY"])
 
 # --- ESTADOS DE SESIÓN ---
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:10]
 if "referencias" not in st.session_state:
     st.session_state.referencias = [] 
+if "ref_hashes" not in st.session_state:
+    st.session_state.ref_hashes = {}
 if "historial" not in st.session_state:
     st.session_state.historial = []
 if "prompt_mejorado" not in st.session_state:
     st.session_state.prompt_mejorado = ""
 if "prompt_final" not in st.session_state:
     st.session_state.prompt_final = ""
-if "json_data" not in st.session_state:
-    data, msg = load_json_data()
-    st.session_state.json_data = data
-    st.session_state.json_msg = msg
+if "context_stats" not in st.session_state:
+    st.session_state.context_stats = None
+if "jobs" not in st.session_state:
+    st.session_state.jobs = []
+if "tiempos_fragmento" not in st.session_state:
+    st.session_state.tiempos_fragmento = {}
 
 # --- SEGURIDAD ---
 PASSWORD_ACCESO = st.secrets["PASSWORD_ACCESO"]
@@ -167,8 +279,141 @@ def check_password():
         return False
     return True
 
+def agregar_a_historial(registro):
+    st.session_state.historial.insert(0, registro)
+    if len(st.session_state.historial) > MAX_HISTORIAL:
+        st.session_state.historial.pop()
+
+def agregar_resultados(job):
+    # Bocetos: guardan lo necesario para el 4K final. Finales: ocupan el sitio de su boceto
+    for registro in job.result:
+        if job.meta.get("draft"):
+            registro = dict(registro, draft=job.meta["draft"])
+        ids = [item["id"] for item in st.session_state.historial]
+        if job.meta.get("replace") in ids:
+            st.session_state.historial[ids.index(job.meta["replace"])] = registro
+        else:
+            agregar_a_historial(registro)
+
+# --- FRAGMENTOS: cada zona se vuelve a ejecutar sola al tocar sus widgets ---
+# Lo que una zona necesita de otra viaja por session_state (refs_sel, modelo_nombre, prompt_final)
+FRAGMENTOS = ["referencias", "prompt", "render", "historial"]
+
+def fragmento(nombre):
+    # Cada ejecución (dentro de un rerun completo o sola) se registra como "fragment:<nombre>"
+    def decorar(fn):
+        @functools.wraps(fn)
+        def medido(*args, **kwargs):
+            t = RerunTimer()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                get_timing_report().record(t, kind=f"fragment:{nombre}")
+                st.session_state.tiempos_fragmento[nombre] = round(t.total_ms(), 1)
+        return st.fragment(medido)
+    return decorar
+
+def rerun_fragmento():
+    # Solo el fragmento actual; si el clic llegó en un rerun completo, Streamlit no lo permite
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def referencias_activas():
+    # Referencias elegidas en la galería, en el orden de selección
+    refs = st.session_state.referencias
+    activas = []
+    for sel in st.session_state.get("refs_sel") or []:
+        idx = int(sel.split(" - ")[0])
+        if idx < len(refs) and sel == f"{idx} - {refs[idx]['name']}":
+            activas.append(refs[idx]["ref"])
+    return activas
+
+# --- MARCAS DE COLOR ("Improve edit") ---
+def preparar_edicion(refs, prompt_render, activo, limpia):
+    # Nano Banana: las zonas pintadas se miden en local y se añaden a la instrucción
+    if not (activo and refs):
+        return prompt_render, [ref.as_part() for ref in refs]
+    from archviz.masks import mentions_color, prepare_edit
+    prompt_edit, partes, resumen = prepare_edit(refs, prompt_render, clean=limpia)
+    zonas = sum(r["regions"] for r in resumen)
+    if zonas:
+        st.toast(f"{zonas} zona(s) marcada(s) localizada(s) en {sum(r['ms'] for r in resumen):.0f} ms", icon="🎯")
+    elif resumen:
+        st.toast("El prompt nombra marcas de color, pero no se encontraron trazos de ese color en las referencias.", icon="🎯")
+    elif mentions_color(prompt_render):
+        st.toast("Sin análisis de marcas: el color no aparece como marca (p. ej. \"red marked shape\", \"RED\").", icon="🎯")
+    return prompt_edit, partes
+
+# --- TRABAJOS DE RENDER (corren en hilos del registro: sin llamadas a Streamlit) ---
+# render_cache=None: el resultado no se guarda para reutilizarlo
+def trabajo_imagenes(job, client, history_store, render_cache, fp, model, prompt_render, prompt, refs, ratio, res, n, owner):
+    from archviz.render import render_images
+    registros = [history_store.add_image(img, prompt, owner=owner, model=model, ratio=ratio)
+                 for img in render_images(client, model, prompt_render, refs, ratio, res, n, job)]
+    if render_cache is not None and registros:
+        render_cache.put(fp, {"kind": "image", "model": model, "ratio": ratio,
+                                    "images": [{"hash": r["hash"], "size": r["size"]} for r in registros]})
+    return registros
+
+def trabajo_final(job, client, history_store, ref_store, digest, borrador, prompt, owner):
+    # 4K final de un boceto aprobado: el boceto va delante de las referencias originales
+    from archviz.render import FINAL_MODEL, FINAL_RES, final_prompt, render_images
+    boceto = ref_store.ingest_image(history_store.load(digest), owner=owner)
+    refs = [boceto.as_part()] + [ref.as_part() for ref in borrador["refs"]]
+    return [history_store.add_image(img, prompt, owner=owner, model=FINAL_MODEL, ratio=borrador["ratio"])
+            for img in render_images(client, FINAL_MODEL, final_prompt(borrador["prompt_render"]), refs,
+                                     borrador["ratio"], FINAL_RES, 1, job)]
+
+def trabajo_video(job, client, media_store, api_key, render_cache, fp, video_kwargs):
+    from archviz.render import generate_video
+    video_path = generate_video(client, video_kwargs, media_store, job, api_key)
+    if render_cache is not None and video_path:
+        render_cache.put(fp, {"kind": "video", "path": video_path})
+    return video_path
+
+def resultado_cacheado(fp):
+    # Registros de historial de una petición idéntica ya renderizada (archivos aún en disco), o None
+    history_store = get_history_store()
+
+    def vigente(record):
+        if record.get("kind") == "video":
+            return os.path.exists(record.get("path", ""))
+        return bool(record.get("images")) and all(history_store.exists(i["hash"]) for i in record["images"])
+
+    record = get_render_cache().get(fp, is_valid=vigente)
+    if record is None:
+        return None
+    prompt = st.session_state.prompt_final
+    if record["kind"] == "video":
+        return [registro_video(record["path"], prompt)]
+    return [history_store.entry(i["hash"], i["size"], prompt, model=record.get("model"), ratio=record.get("ratio"))
+            for i in record["images"]]
+
+# Las galerías muestran miniaturas; la imagen completa solo se envía al abrir esta vista
+@st.dialog("🔍 Vista completa", width="large")
+def vista_completa(titulo, imagen):
+    st.image(imagen, caption=titulo, use_container_width=True)
+
+def registro_video(video_path, prompt):
+    return {
+        "id": uuid.uuid4().hex[:10],
+        "type": "video",
+        "file_path": video_path,
+        "prompt": prompt
+    }
+
 if check_password():
-    client = genai.Client(api_key=st.secrets["GOOGLE_API_KEY"])
+    liberar_sesiones_cerradas()
+    with timer.stage("imports"):
+        from archviz.upscale import UPSCALE_TARGETS
+        from archviz.render import (build_video_request, render_fingerprint, render_prompt, veo_ratio_for,
+                                    DRAFT_MODEL, DRAFT_RES, FINAL_MODEL, FINAL_RES, MODEL_MAP, VEO_MODOS)
+    with timer.stage("client"):
+        client = get_client()
+    with timer.stage("library"):
+        json_data, json_version, json_msg = get_json_library().snapshot()
 
     # --- ENCABEZADO ---
     st.title("Ultimate Archviz Generator")
@@ -181,350 +426,645 @@ if check_password():
         * **Improve edit:** Ideal para editar. Usa Paint para pintar áreas y escribe: `Improve edit: <descripción>, Remove RED marked shapes`.
         * **Architectural / Interior Design Recipe:** Usa las fórmulas maestras.
         """)
-        if st.session_state.json_msg and "✅" in st.session_state.json_msg:
-            st.success(st.session_state.json_msg)
+        if json_msg and "✅" in json_msg:
+            st.success(json_msg)
         else:
-            st.warning(st.session_state.json_msg or "Cargando JSONs...")
+            st.warning(json_msg or "Cargando JSONs...")
     st.divider()
 
     # --- CONTROLES SUPERIORES ---
     c_controls_1, c_controls_2, c_controls_3 = st.columns([2, 1, 1])
     with c_controls_1:
-        modelo_nombre = st.selectbox("Motor de Render", [
-            "Nano Banana Pro (Gemini 3 Pro Image)",
-            "Nano Banana (Gemini 2.5 Flash Image)",
-            "Imagen 4.0 (Generativo)",
-            "Veo 3.1 (Video Generativo)" 
-        ])
-        model_map = {
-            "Nano Banana Pro (Gemini 3 Pro Image)": "gemini-3-pro-image-preview",
-            "Nano Banana (Gemini 2.5 Flash Image)": "gemini-2.5-flash-image",
-            "Imagen 4.0 (Generativo)": "imagen-4.0-generate-001",
-            "Veo 3.1 (Video Generativo)": "veo-3.1-generate-preview" 
-        }
+        model_map = MODEL_MAP
+        st.selectbox("Motor de Render", list(model_map), key="modelo_nombre")
     with c_controls_2:
         st.write("") 
         st.write("") 
         if st.button("Recargar JSONs", use_container_width=True):
-            st.cache_data.clear()
+            # Solo se vuelven a leer los archivos modificados; el resto de cachés no se toca
+            library = get_json_library()
+            antes = library.stats["parsed"]
+            library.reload()
+            st.toast(f"JSONs: {library.stats['parsed'] - antes} archivo(s) actualizados")
             st.rerun()
     with c_controls_3:
         pass
         
     # --- ZONA 1: REFERENCIAS Y PORTAPAPELES ---
-    st.subheader("1. Referencias Visuales")
-    
-    uploaded_files = st.file_uploader("Sube o pega tus fotos aquí", 
-                                     type=["png", "jpg", "jpeg"], accept_multiple_files=True)
-    
-    if uploaded_files:
-        for f in uploaded_files:
-            img = PIL.Image.open(f)
-            if not any(d['name'] == f.name for d in st.session_state.referencias):
-                st.session_state.referencias.append({"img": img, "name": f.name})
-
-    refs_activas = []
-    if st.session_state.referencias:
-        col_btn_limpiar, _ = st.columns([1, 4])
-        if col_btn_limpiar.button("🗑️ Limpiar Referencias"):
-            st.session_state.referencias = []
-            st.rerun()
-            
-        cols_refs = st.columns(6) 
-        ref_options = []
+    # Fragmento: subir, limpiar o elegir referencias no vuelve a ejecutar el resto de la página.
+    # La selección queda en session_state["refs_sel"] y el render la lee con referencias_activas()
+    @fragmento("referencias")
+    def seccion_referencias():
+        st.subheader("1. Referencias Visuales")
         
-        # Muestra la galería con IDs
-        for i, ref in enumerate(st.session_state.referencias):
-            with cols_refs[i % 6]:
-                st.image(ref["img"], use_container_width=True)
-                st.caption(f"ID: {i} - {ref['name']}")
-            ref_options.append(f"{i} - {ref['name']}")
-            
-        st.write("")
-        # Selector múltiple estricto: Guarda el orden de los clics
-        selected_refs = st.multiselect(
-            "📌 Selecciona y ORDENA las imágenes (El orden de selección determina cuál es el inicio y cuál es el fin):",
-            options=ref_options,
-            default=None
-        )
+        uploaded_files = st.file_uploader("Sube o pega tus fotos aquí", 
+                                         type=["png", "jpg", "jpeg"], accept_multiple_files=True)
         
-        # Extrae las imágenes en el orden exacto en que fueron elegidas
-        for sel in selected_refs:
-            idx = int(sel.split(" - ")[0])
-            refs_activas.append(st.session_state.referencias[idx]["img"].convert("RGB"))
+        if uploaded_files:
+            ref_store = get_reference_store()
+            for f in uploaded_files:
+                # Duplicados por contenido, no por nombre; cada archivo se procesa una sola vez
+                digest = st.session_state.ref_hashes.get(f.file_id)
+                if digest and any(d["ref"].hash == digest for d in st.session_state.referencias):
+                    continue
+                ref = ref_store.ingest_bytes(f.getvalue(), owner=st.session_state.session_id)
+                st.session_state.ref_hashes[f.file_id] = ref.hash
+                if not any(d["ref"].hash == ref.hash for d in st.session_state.referencias):
+                    st.session_state.referencias.append({"ref": ref, "name": f.name})
+
+        if st.session_state.referencias:
+            col_btn_limpiar, _ = st.columns([1, 4])
+            if col_btn_limpiar.button("🗑️ Limpiar Referencias"):
+                st.session_state.referencias = []
+                st.session_state.pop("refs_sel", None)
+                get_memory_budget().release(st.session_state.session_id)
+                rerun_fragmento()
+                
+            cols_refs = st.columns(6) 
+            ref_options = []
+            
+            # Muestra la galería con IDs
+            for i, ref in enumerate(st.session_state.referencias):
+                with cols_refs[i % 6]:
+                    st.image(ref["ref"].thumbnail(owner=st.session_state.session_id), use_container_width=True)
+                    st.caption(f"ID: {i} - {ref['name']}")
+                    if st.button("🔍", key=f"zoom_ref_{i}"):
+                        vista_completa(ref["name"], ref["ref"].encoded("nano")[0])
+                ref_options.append(f"{i} - {ref['name']}")
+                
+            st.write("")
+            # Selector múltiple estricto: Guarda el orden de los clics
+            st.multiselect(
+                "📌 Selecciona y ORDENA las imágenes (El orden de selección determina cuál es el inicio y cuál es el fin):",
+                options=ref_options,
+                default=None,
+                key="refs_sel"
+            )
+
+    with timer.stage("referencias"):
+        seccion_referencias()
 
     st.divider()
 
     # --- ZONA 2: ULTIMATE PROMPT ENGINE (LADO A LADO) ---
-    st.subheader("2. Generador de Prompt")
+    # Fragmento: escribir el comando o ajustar el prompt final solo vuelve a ejecutar esta zona.
+    # El resultado sale por session_state.prompt_final
+    @fragmento("prompt")
+    def seccion_prompt(client, json_data, json_version):
+        st.subheader("2. Generador de Prompt")
+
+        # Prompt en streaming: trabajo del registro que este fragmento sondea sin bloquearse
+        registry = get_job_registry()
+        job_prompt = registry.get(st.session_state.prompt_job) if st.session_state.get("prompt_job") else None
+        generando = job_prompt is not None and job_prompt.is_active
     
-    col_in, col_out = st.columns(2)
+        col_in, col_out = st.columns(2)
     
-    with col_in:
-        st.markdown("**1. Prompt inicial (Idea)**")
-        cmd_input = st.text_area("Comando:", height=150, label_visibility="collapsed", 
-                                 placeholder="Ej: Improve edit: foto de una sala, Remove RED marked shapes")
-        btn_mejorar = st.button("✨ Procesar Idea", type="primary", use_container_width=True)
-
-    with col_out:
-        st.markdown("**2. Prompt mejorado (Traducción de IA)**")
-        st.info(st.session_state.prompt_mejorado if st.session_state.prompt_mejorado else "La traducción estructurada aparecerá aquí...")
-
-    if btn_mejorar:
-        if cmd_input:
-            with st.spinner("Consultando bases de datos..."):
-                try:
-                    json_context = json.dumps(st.session_state.json_data, indent=2, ensure_ascii=False) if st.session_state.json_data else "No JSON data."
-                    
-                    system_prompt = f"""
-                    You are 'PromptAssistantGEM', an advanced CLI for ArchViz Prompt Engineering.
-                    I have loaded a library of styles/materials in JSON:
-                    {json_context}
-
-                    YOUR RULES BASED ON USER GLOSSARY:
-                    1. 'Improve:': Convert simple input into high-quality detailed prompt using JSON terms.
-                    2. 'Architectural Recipe': Must include Camera Angle, Image Type, Style, Building Type, Inspiration, Focal Point, Materials, Lighting, Mood.
-                    3. 'Interior Design Recipe': Must include Camera Angle, Room Type, Style, Brand, Focal Point, Textures, Lighting.
-                    4. 'Platform:': Optimize terminology for the specified AI.
-                    5. 'Multiple:': If requested, provide options.
-                    6. 'Improve edit:': Translate shape-based commands using colors (Red, Blue, etc.) into strict instructions for image editing.
-                    
-                    TASK: Analyze the USER COMMAND and output ONLY the final optimized prompt text ready for rendering.
-                    
-                    USER COMMAND: {cmd_input}
-                    """
-                    
-                    res = client.models.generate_content(
-                        model="gemini-2.5-flash",
-                        contents=system_prompt
-                    )
-                    
-                    if res.text:
-                        texto_limpio = res.text.strip()
-                        st.session_state.prompt_mejorado = texto_limpio
-                        st.session_state.prompt_final = texto_limpio
-                        st.session_state["fp_area"] = texto_limpio 
-                        st.rerun()
-                    else:
-                        st.error("El modelo devolvió una respuesta vacía.")
+        with col_in:
+            st.markdown("**1. Prompt inicial (Idea)**")
+            cmd_input = st.text_area("Comando:", height=150, label_visibility="collapsed", 
+                                     placeholder="Ej: Improve edit: foto de una sala, Remove RED marked shapes")
+            btn_mejorar = st.button("✨ Procesar Idea", type="primary", use_container_width=True, disabled=generando)
+            modo_stream = st.toggle("Mostrar el texto a medida que se genera", value=True, key="prompt_stream")
+            c_rec1, c_rec2, c_rec3 = st.columns([2, 1, 1])
+            recetas_locales = c_rec1.toggle("⚡ Recetas locales (sin LLM)", value=True, key="recetas_locales",
+                                            help="Architectural / Interior Design Recipe (y Multiple: N) se componen desde la biblioteca al instante.")
+            semilla = c_rec2.number_input("Semilla", min_value=0, value=0, step=1, key="receta_semilla",
+                                          help="0 = automática (mismo comando, misma receta)", disabled=not recetas_locales)
+            pulir_receta = c_rec3.checkbox("Pulir con IA", value=False, key="pulir_receta", disabled=not recetas_locales)
+            zona_cancelar = st.empty()
+
+        with col_out:
+            st.markdown("**2. Prompt mejorado (Traducción de IA)**")
+            zona_mejorado = st.empty()
+            zona_mejorado.info(st.session_state.prompt_mejorado if st.session_state.prompt_mejorado else "La traducción estructurada aparecerá aquí...")
+            ctx = st.session_state.context_stats
+            if ctx:
+                if ctx.get("local"):
+                    st.caption(f"🧩 Receta local en {ctx['elapsed_ms']} ms | {ctx['local']} opción(es), semilla {ctx['seed']} | sin llamada al LLM")
+                elif ctx.get("cache"):
+                    cs = get_prompt_cache().summary()
+                    st.caption(f"⚡ Desde caché ({ctx['cache']}) en {ctx['elapsed_ms']} ms | aciertos {cs['memory_hits'] + cs['disk_hits']}, fallos {cs['misses']} ({cs['hit_rate']}%)")
+                else:
+                    real = f" | prompt real: {ctx['prompt_tokens']} tokens" if ctx.get("prompt_tokens") else ""
+                    st.caption(f"📉 Contexto JSON: ~{ctx['tokens']} tokens (completo ~{ctx['full_tokens']}, ahorro {ctx['saved_pct']}%){real}")
+                    st.caption("Secciones: " + ", ".join(ctx["sections"]))
+                    if ctx.get("ttft_ms") is not None:
+                        st.caption(f"⏱️ Primer token en {ctx['ttft_ms']} ms | respuesta completa en {ctx['elapsed_ms']} ms")
+                if ctx.get("receta_local"):
+                    st.caption(f"🧩 Pulido por IA a partir de {ctx['receta_local']} receta(s) local(es)")
+
+            recetas = st.session_state.get("recetas") or []
+            if len(recetas) > 1:
+                def usar_receta():
+                    texto = recetas[st.session_state.receta_elegida]["prompt"]
+                    st.session_state.prompt_final = texto
+                    st.session_state["fp_area"] = texto
+                st.selectbox("Opción para el render", range(len(recetas)), format_func=lambda i: f"Option {i + 1}",
+                             key="receta_elegida", on_change=usar_receta)
+                st.download_button("📥 Descargar opciones (JSONL)",
+                                   data="\n".join(json.dumps(r, ensure_ascii=False) for r in recetas),
+                                   file_name="recetas.jsonl", mime="application/jsonl", use_container_width=True)
+
+        def aplicar_prompt(texto_limpio, ctx_stats, opciones, pulir):
+            if opciones and pulir:
+                ctx_stats["receta_local"] = len(opciones)
+                st.session_state.recetas = []
+            st.session_state.context_stats = ctx_stats
+            if texto_limpio:
+                st.session_state.prompt_mejorado = texto_limpio
+                # Varias opciones locales: al render va la primera (se cambia con el selector)
+                final = opciones[0]["prompt"] if st.session_state.recetas else texto_limpio
+                st.session_state.prompt_final = final
+                st.session_state["fp_area"] = final
+                rerun_fragmento()
+            else:
+                st.error("El modelo devolvió una respuesta vacía.")
+
+        if generando:
+            zona_mejorado.info((job_prompt.meta["texto"] or "Consultando bases de datos...") + " ▌")
+            # El clic llega en el siguiente sondeo (como mucho un intervalo después) y activa el Event:
+            # stream_prompt cierra la conexión y no guarda nada parcial
+            zona_cancelar.button("⏹️ Detener", key="cancelar_stream", use_container_width=True,
+                                 on_click=job_prompt.meta["cancel"].set)
+        elif job_prompt is not None:
+            st.session_state.prompt_job = None
+            if job_prompt.status == DONE:
+                texto_limpio, ctx_stats = job_prompt.result
+                if ctx_stats.get("cancelled"):
+                    if job_prompt.meta["pulir"]:
+                        st.session_state.recetas = []
+                    st.toast("Generación detenida: se mantiene el prompt anterior.")
+                else:
+                    aplicar_prompt(texto_limpio, ctx_stats, job_prompt.meta["opciones"], job_prompt.meta["pulir"])
+            elif job_prompt.status == ERROR:
+                st.error(f"Error en motor de prompts: {job_prompt.error}")
+
+        if btn_mejorar:
+            if cmd_input:
+                with st.spinner("Consultando bases de datos..."):
+                    try:
+                        t_receta = time.perf_counter()
+                        opciones = []
+                        if recetas_locales:
+                            opciones = get_recipe_composer(json_data, json_version).compose(cmd_input, seed=semilla or None)
+                        st.session_state.recetas = opciones
+                        st.session_state.pop("receta_elegida", None)
+                        comando = cmd_input
+                        if opciones and pulir_receta:
+                            # El LLM solo pule el texto ya compuesto
+                            comando = "Improve: " + format_options(opciones)
+
+                        if opciones and not pulir_receta:
+                            texto_limpio = format_options(opciones)
+                            ctx_stats = {"local": len(opciones), "seed": opciones[0]["seed"],
+                                         "elapsed_ms": round((time.perf_counter() - t_receta) * 1000, 1)}
+                        elif modo_stream:
+                            job = registry.submit(
+                                lambda job, c=comando, idx=get_context_index(json_data, json_version), cache=get_prompt_cache(): stream_prompt(
+                                    client, idx, c, json_version, cache,
+                                    on_text=lambda texto: job.meta.update(texto=texto), cancel=job.meta["cancel"]),
+                                kind="prompt",
+                                label="Procesar idea",
+                                owner=st.session_state.session_id,
+                                meta={"cancel": threading.Event(), "texto": "", "opciones": opciones, "pulir": pulir_receta}
+                            )
+                            st.session_state.prompt_job = job.id
+                            rerun_fragmento()
+                        else:
+                            texto_limpio, ctx_stats = improve_prompt(
+                                client, get_context_index(json_data, json_version), comando,
+                                json_version, get_prompt_cache()
+                            )
+                        aplicar_prompt(texto_limpio, ctx_stats, opciones, pulir_receta)
                         
-                except Exception as e:
-                    st.error(f"Error en motor de prompts: {e}")
-        else:
-            st.warning("Escribe un comando primero.")
+                    except Exception as e:
+                        st.error(f"Error en motor de prompts: {e}")
+            else:
+                st.warning("Escribe un comando primero.")
 
-    st.markdown("**3. Prompt Final (Ajuste Manual)**")
-    final_prompt = st.text_area("Este es el texto que se enviará al Motor de Render:", 
-                              value=st.session_state.prompt_final, 
-                              height=120, 
-                              key="fp_area")
+        st.markdown("**3. Prompt Final (Ajuste Manual)**")
+        final_prompt = st.text_area("Este es el texto que se enviará al Motor de Render:", 
+                                  value=st.session_state.prompt_final, 
+                                  height=120, 
+                                  key="fp_area")
     
-    if final_prompt != st.session_state.prompt_final:
-        st.session_state.prompt_final = final_prompt
+        if final_prompt != st.session_state.prompt_final:
+            st.session_state.prompt_final = final_prompt
+
+        if generando:
+            # Sondeo corto en lugar de esperar bloqueado: dentro de un fragmento, un clic no
+            # interrumpe la ejecución en curso, solo se encola para la siguiente
+            time.sleep(0.25)
+            rerun_fragmento()
+
+    with timer.stage("prompt"):
+        seccion_prompt(client, json_data, json_version)
 
     # --- ZONA 3: AJUSTES Y GENERACIÓN ---
     st.divider()
+
+    # Fragmento: cambiar ajustes no vuelve a ejecutar galería ni historial. Lee el motor, el prompt
+    # y las referencias de session_state; al encolar trabajos relanza la app para mostrar el panel
+    @fragmento("render")
+    def seccion_render(client, model_map):
     
-    st.subheader("⚙️ Ajustes de Salida (Veo 3 / Imagen / Nano Banana)")
-    col_aj1, col_aj2, col_aj3 = st.columns(3)
-    with col_aj1:
-        ratio_opt = st.selectbox("Aspect Ratio", ["16:9", "9:16", "1:1", "4:3", "3:4"])
-    with col_aj2:
-        res_opt = st.selectbox("Resolución (Veo 3 / Nano Banana)", ["1080p", "4K"])
-    with col_aj3:
-        veo_modo = st.selectbox("Comportamiento de Fotos (Solo Veo 3)", [
-            "Frame Inicial (Usa 1ra foto)",
-            "Inicio y Fin (Usa 1ra y 2da foto)",
-            "Referencias de Assets (Estilo/Sujeto)"
-        ])
-
-    st.write("")
+        st.subheader("⚙️ Ajustes de Salida (Veo 3 / Imagen / Nano Banana)")
+        col_aj1, col_aj2, col_aj3 = st.columns(3)
+        with col_aj1:
+            ratio_options = ["16:9", "9:16", "1:1", "4:3", "3:4"]
+            ratio_opt = st.selectbox("Aspect Ratio", ratio_options)
+        with col_aj2:
+            res_opt = st.selectbox("Resolución (Veo 3 / Nano Banana)", ["1080p", "4K"])
+        with col_aj3:
+            veo_modo = st.selectbox("Comportamiento de Fotos (Solo Veo 3)", VEO_MODOS)
     
-    if st.button("🚀 Renderizar (Imagen / Video)", use_container_width=True):
-        if st.session_state.prompt_final:
-            with st.status("Procesando...", expanded=True) as status:
-                try:
-                    prompt_render = f"High quality architectural visualization. {st.session_state.prompt_final}"
-                    img_result = None
-                    video_result_path = None
-
-                    # CASO A: Imagen 3 / 4
-                    if "imagen-" in model_map[modelo_nombre]:
-                        status.update(label=f"Generando imagen con Imagen 4.0 ({ratio_opt})...", state="running")
-                        response = client.models.generate_images(
-                            model=model_map[modelo_nombre],
-                            prompt=prompt_render,
-                            config=types.GenerateImagesConfig(
-                                number_of_images=1,
-                                aspect_ratio=ratio_opt 
-                            )
-                        )
-                        if response and response.generated_images:
-                            img_result = response.generated_images[0].image._pil_image
-
-                    # CASO B: Video con Veo 3.1
-                    elif "veo-" in model_map[modelo_nombre]:
-                        # Regla de seguridad: Veo 3 en 4K solo acepta 16:9 nativo. 
-                        # Forzamos 16:9 si eligió 4K para evitar un 400 INVALID_ARGUMENT
-                        veo_ratio = "16:9" if res_opt == "4K" else ratio_opt
-                        
-                        status.update(label=f"🎬 Iniciando video ({res_opt} | {veo_ratio})...", state="running")
-                        
-                        video_kwargs = {
-                            "model": model_map[modelo_nombre],
-                            "prompt": prompt_render,
-                        }
-                        video_config = {"aspect_ratio": veo_ratio}
-                        
-                        if res_opt == "4K":
-                            video_config["resolution"] = "4k"
-                        
-                        if refs_activas:
-                            if veo_modo == "Frame Inicial (Usa 1ra foto)":
-                                video_kwargs["image"] = pil_to_veo_image(refs_activas[0])
-                                
-                            elif veo_modo == "Inicio y Fin (Usa 1ra y 2da foto)":
-                                video_kwargs["image"] = pil_to_veo_image(refs_activas[0])
-                                if len(refs_activas) > 1:
-                                    video_config["last_frame"] = pil_to_veo_image(refs_activas[1])
+        # --- MODO LOTE: un prompt -> variantes x ratios x motores, en paralelo ---
+        modelo_nombre = st.session_state.modelo_nombre
+        motores_imagen = [m for m in model_map if "veo-" not in model_map[m]]
+        with st.expander("🧪 Modo lote (variantes en paralelo)", expanded=False):
+            lote_activo = st.toggle("Activar modo lote (solo imágenes)")
+            col_l1, col_l2, col_l3 = st.columns([1, 2, 2])
+            with col_l1:
+                lote_variantes = st.number_input("Variantes", min_value=1, max_value=4, value=1)
+            with col_l2:
+                lote_ratios = st.multiselect("Aspect Ratios", ratio_options, default=[ratio_opt])
+            with col_l3:
+                lote_motores = st.multiselect("Motores", motores_imagen,
+                                              default=[modelo_nombre] if modelo_nombre in motores_imagen else motores_imagen[:1])
+            lote_total = lote_variantes * len(lote_ratios) * len(lote_motores)
+            st.caption(f"Se generarán {lote_total} imágenes (máx. {MAX_IMAGE_JOBS} llamadas simultáneas, con reintentos en 429/5xx).")
+
+        st.write("")
+    
+        reutilizar = st.toggle("♻️ Reutilizar renders idénticos", value=os.environ.get("ARCHVIZ_RENDER_CACHE", "0") == "1",
+                               help="Misma petición (modelo, prompt, referencias y ajustes) = mismo resultado guardado, sin nueva llamada facturable.")
+        progresivo = st.toggle("✏️ Boceto primero (Nano Banana en 4K)", value=False, key="progresivo",
+                               help="Primero un boceto rápido en Nano Banana Flash; el 4K final en Nano Banana Pro "
+                                    "solo se genera (y se paga) al aprobarlo en el historial.")
+        c_marcas1, c_marcas2 = st.columns(2)
+        analizar_marcas = c_marcas1.toggle("🎯 Localizar marcas de color (Improve edit)", value=True, key="analizar_marcas",
+                                           help="Si el prompt nombra RED/GREEN/BLUE/YELLOW, mide las zonas pintadas en las referencias "
+                                                "(caja, área y centro) y las añade a la instrucción. Solo Nano Banana.")
+        marcas_limpias = c_marcas2.toggle("Enviar original limpio + máscara", value=False, key="marcas_limpias",
+                                          disabled=not analizar_marcas,
+                                          help="En lugar de la foto pintada: la foto sin trazos y una máscara en blanco y negro de las zonas.")
+
+        if st.button("🚀 Renderizar (Imagen / Video)", use_container_width=True):
+            # Valores capturados aquí: los trabajos corren en otros hilos y no leen session_state
+            refs_activas = referencias_activas()
+            prompt_actual = st.session_state.prompt_final
+            sesion = st.session_state.session_id
+            history_store = get_history_store()
+            render_cache = get_render_cache() if reutilizar else None
+            if st.session_state.prompt_final and lote_activo:
+                if not lote_total:
+                    st.warning("Elige al menos un motor y un aspect ratio para el lote.")
+                else:
+                    prompt_render = render_prompt(st.session_state.prompt_final)
+                    prompt_edit, partes_edit = preparar_edicion(refs_activas, prompt_render, analizar_marcas, marcas_limpias)
+                    registry = get_job_registry()
+                    ref_hashes = [ref.hash for ref in refs_activas]
+                    reutilizados = unidos = 0
+                    for motor in lote_motores:
+                        modelo = model_map[motor]
+                        # Imagen entrega N variantes por llamada; Nano Banana necesita una llamada por variante
+                        llamadas = [lote_variantes] if "imagen-" in modelo else [1] * lote_variantes
+                        # Imagen no recibe referencias: sin zonas marcadas
+                        prompt_motor = prompt_render if "imagen-" in modelo else prompt_edit
+                        for ratio in lote_ratios:
+                            for k, n in enumerate(llamadas):
+                                config = {"ratio": ratio, "n": n} if "imagen-" in modelo else {"ratio": ratio, "res": res_opt}
+                                fp = render_fingerprint(modelo, prompt_motor, ref_hashes, variant=k, **config)
+                                cacheados = resultado_cacheado(fp) if reutilizar else None
+                                if cacheados:
+                                    for registro in cacheados:
+                                        agregar_a_historial(registro)
+                                    reutilizados += 1
+                                    continue
+                                # El PNG y la miniatura se generan en el hilo del trabajo, no en el script
+                                job = registry.submit(
+                                    lambda job, m=modelo, r=ratio, n=n, pm=prompt_motor, fp=fp: trabajo_imagenes(
+                                        job, client, history_store, render_cache, fp, m, pm, prompt_actual, partes_edit, r, res_opt, n, sesion),
+                                    kind="image",
+                                    label=f"{motor} ({ratio})",
+                                    meta={"prompt": prompt_actual},
+                                    key=fp
+                                )
+                                if job.id in st.session_state.jobs:
+                                    unidos += 1
                                 else:
-                                    st.warning("⚠️ Seleccionaste Inicio y Fin, pero solo marcaste 1 foto. Se usará solo como inicio.")
-                                    
-                            elif veo_modo == "Referencias de Assets (Estilo/Sujeto)":
-                                refs_list = []
-                                for r_img in refs_activas:
-                                    refs_list.append(types.VideoGenerationReferenceImage(
-                                        image=pil_to_veo_image(r_img),
-                                        reference_type="asset"
-                                    ))
-                                video_config["reference_images"] = refs_list
-
-                        video_kwargs["config"] = types.GenerateVideosConfig(**video_config)
-
-                        operation = client.models.generate_videos(**video_kwargs)
-                        
-                        while not operation.done:
-                            status.update(label="Procesando video con Veo3... Por favor espera ⏳", state="running")
-                            time.sleep(10)
-                            operation = client.operations.get(operation)
-                            
-                        status.update(label="Descargando el video generado...", state="running")
-                        
-                        if operation.response and operation.response.generated_videos:
-                            generated_video = operation.response.generated_videos[0]
-                            video_path = f"archviz_video_{int(time.time())}.mp4"
-                            
-                            client.files.download(file=generated_video.video)
-                            generated_video.video.save(video_path)
-                            video_result_path = video_path
-
-                    # CASO C: Gemini Nano Banana (Flash/Pro)
-                    else:
-                        status.update(label="Generando imagen con Nano Banana...", state="running")
-                        
-                        image_cfg_kwargs = {"aspect_ratio": ratio_opt}
-                        if res_opt == "4K":
-                            image_cfg_kwargs["image_size"] = "4K"
-                            
-                        nano_config = types.GenerateContentConfig(
-                            response_modalities=["IMAGE"],
-                            image_config=types.ImageConfig(**image_cfg_kwargs)
-                        )
+                                    st.session_state.jobs.append(job.id)
+                    aviso = f" · {reutilizados} reutilizadas" if reutilizados else ""
+                    aviso += f" · {unidos} ya en curso" if unidos else ""
+                    st.toast(f"Lote en marcha: {lote_total} imágenes{aviso}", icon="🧪")
+                    st.rerun()
+            elif st.session_state.prompt_final:
+                with st.status("Procesando...", expanded=True) as status:
+                    try:
+                        prompt_render = render_prompt(st.session_state.prompt_final)
+                        modelo = model_map[modelo_nombre]
+                        ref_hashes = [ref.hash for ref in refs_activas]
+                        registry = get_job_registry()
+
+                        # CASO A: Video con Veo 3.1 (en segundo plano: la sesión queda libre mientras tanto)
+                        if "veo-" in modelo:
+                            veo_ratio = veo_ratio_for(ratio_opt, res_opt)
+                            fp = render_fingerprint(modelo, prompt_render, ref_hashes, ratio=veo_ratio, res=res_opt, veo_modo=veo_modo)
+                            cacheados = resultado_cacheado(fp) if reutilizar else None
+                            if cacheados:
+                                agregar_a_historial(cacheados[0])
+                                status.update(label="♻️ Video idéntico ya generado: recuperado sin nueva llamada.", state="complete")
+                                st.rerun()
+                            status.update(label=f"🎬 Iniciando video ({res_opt} | {veo_ratio})...", state="running")
+
+                            video_kwargs, aviso = build_video_request(modelo, prompt_render, ratio_opt, res_opt, veo_modo, refs_activas)
+                            if aviso:
+                                st.toast(aviso, icon="⚠️")
+                            media_store = get_media_store()
+                            api_key = st.secrets["GOOGLE_API_KEY"]
+                            job = registry.submit(
+                                lambda job, kwargs=video_kwargs: trabajo_video(job, client, media_store, api_key, render_cache, fp, kwargs),
+                                kind="video",
+                                label=f"Veo 3.1 ({res_opt} | {veo_ratio})",
+                                meta={"prompt": prompt_actual},
+                                key=fp
+                            )
+                            if job.id in st.session_state.jobs:
+                                st.toast("Ese video ya se está generando: no se envía otra vez.", icon="♻️")
+                            else:
+                                st.session_state.jobs.append(job.id)
+                            status.update(label="🎬 Video en cola. Puedes seguir editando mientras se renderiza.", state="complete")
+                            st.rerun()
+
+                        # CASO B: Imagen 4 o Nano Banana (Flash/Pro)
+                        res_render = res_opt
+                        borrador = None
+                        if progresivo and res_opt == FINAL_RES and "imagen-" not in modelo:
+                            # Boceto rápido; el 4K final espera a la aprobación
+                            modelo, res_render = DRAFT_MODEL, DRAFT_RES
+                            borrador = {"prompt_render": prompt_render, "ratio": ratio_opt, "refs": list(refs_activas)}
+                        config = {"ratio": ratio_opt, "n": 1} if "imagen-" in modelo else {"ratio": ratio_opt, "res": res_render}
+                        if "imagen-" in modelo:
+                            prompt_motor, partes = prompt_render, [ref.as_part() for ref in refs_activas]
+                        else:
+                            # El borrador guarda el prompt sin medidas: el 4K final parte del boceto aprobado
+                            prompt_motor, partes = preparar_edicion(refs_activas, prompt_render, analizar_marcas, marcas_limpias)
+                        fp = render_fingerprint(modelo, prompt_motor, ref_hashes, **config)
+                        cacheados = resultado_cacheado(fp) if reutilizar else None
+                        if cacheados:
+                            for registro in cacheados:
+                                agregar_a_historial(dict(registro, draft=borrador) if borrador else registro)
+                            status.update(label="♻️ Render idéntico ya generado: recuperado sin nueva llamada.", state="complete")
+                            st.rerun()
 
-                        contenido_solicitud = [prompt_render] + refs_activas
-                        response = client.models.generate_content(
-                            model=model_map[modelo_nombre],
-                            contents=contenido_solicitud,
-                            config=nano_config
+                        job = registry.submit(
+                            lambda job: trabajo_imagenes(
+                                job, client, history_store, render_cache, fp, modelo, prompt_motor, prompt_actual, partes, ratio_opt, res_render, 1, sesion),
+                            kind="image",
+                            label=f"Boceto ({ratio_opt})" if borrador else f"{modelo_nombre} ({ratio_opt})",
+                            meta={"prompt": prompt_actual, "draft": borrador},
+                            key=fp
                         )
-                        
-                        if response and response.parts:
-                            for part in response.parts:
-                                if part.inline_data:
-                                    img_result = PIL.Image.open(BytesIO(part.inline_data.data))
-                                    break
-                    
-                    # PROCESAMIENTO FINAL: Guardar en historial
-                    if img_result or video_result_path:
-                        nuevo_registro = {
-                            "type": "video" if video_result_path else "image",
-                            "img": img_result, 
-                            "file_path": video_result_path, 
-                            "prompt": st.session_state.prompt_final 
-                        }
-                        st.session_state.historial.insert(0, nuevo_registro)
-                        if len(st.session_state.historial) > 10:
-                            st.session_state.historial.pop()
-                        
-                        status.update(label="¡Proceso completo!", state="complete")
+                        # Sin espera bloqueante: dentro del fragmento un segundo clic no interrumpiría
+                        # la espera y llegaría después. El panel de renders recoge el resultado.
+                        if job.id in st.session_state.jobs:
+                            st.toast("Ese render ya está en marcha: se espera al mismo resultado.", icon="♻️")
+                        else:
+                            st.session_state.jobs.append(job.id)
+                        status.update(label="🖼️ Render en cola: aparecerá en el historial al terminar.", state="complete")
                         st.rerun()
-                    else:
-                        st.error("No se generó contenido. Revisa si la respuesta fue bloqueada por filtros de seguridad.")
-                        
-                except Exception as e:
-                    st.error(f"Error crítico durante la generación: {e}")
-        else:
-            st.warning("El campo de prompt final está vacío.")
 
-    # --- HISTORIAL CON BOTONES Y PROMPTS ---
-    if st.session_state.historial:
+                    except Exception as e:
+                        st.error(f"Error crítico durante la generación: {e}")
+            else:
+                st.warning("El campo de prompt final está vacío.")
+
+    with timer.stage("render"):
+        seccion_render(client, model_map)
+
+    # --- RENDERS EN SEGUNDO PLANO ---
+    # Fragmento que se refresca solo: consulta el registro sin bloquear el resto de la app
+    @st.fragment(run_every=5)
+    def panel_renders():
+        registry = get_job_registry()
+        st.markdown("**🎬 Renders en segundo plano**")
+        terminados = False
+        
+        for job_id in list(st.session_state.jobs):
+            job = registry.get(job_id)
+            if job is None:
+                st.session_state.jobs.remove(job_id)
+                continue
+            
+            if job.status == DONE:
+                registry.collect(job_id)
+                if job.kind == "upscale":
+                    st.toast(f"{job.label} listo para descargar", icon="🔍")
+                elif job.result and job.kind == "video":
+                    agregar_a_historial(registro_video(job.result, job.meta.get("prompt", "Prompt no registrado")))
+                elif job.result:
+                    agregar_resultados(job)
+                else:
+                    st.toast(f"{job.label}: sin resultados (¿filtros de seguridad?)", icon="⚠️")
+                st.session_state.jobs.remove(job_id)
+                terminados = True
+                continue
+            
+            c_job, c_btn = st.columns([5, 1])
+            c_job.caption(f"{STATUS_LABELS[job.status]} · {job.label} · {int(job.elapsed)}s · {job.message}")
+            if job.status == QUEUED:
+                if c_btn.button("✖", key=f"cancel_{job_id}"):
+                    registry.cancel(job_id)
+            elif not job.is_active:
+                if c_btn.button("Quitar", key=f"quitar_{job_id}"):
+                    st.session_state.jobs.remove(job_id)
+                    st.rerun()
+        
+        if terminados:
+            st.rerun()
+
+    if st.session_state.jobs:
         st.divider()
+        panel_renders()
+
+    # --- HISTORIAL CON BOTONES Y PROMPTS ---
+    # Fragmento: reescalar, descargar o ampliar no vuelve a ejecutar el resto de la página.
+    # "🔄 Ref" y los reescalados relanzan la app (actualizan la galería y el panel de renders)
+    @fragmento("historial")
+    def seccion_historial(client):
         st.subheader("Historial de Sesión")
-        
+
+        col_up1, col_up2, _ = st.columns(3)
+        with col_up1:
+            upscale_target = st.selectbox("Reescalado (Historial)", list(UPSCALE_TARGETS))
+        with col_up2:
+            st.write("")
+            upscale_rapido = st.checkbox("Codificación PNG rápida", value=True,
+                                         help="Compresión mínima: archivo algo mayor, guardado varias veces más rápido.")
+
+        history_store = get_history_store()
         cols = st.columns(3)
         for i, item in enumerate(st.session_state.historial):
+        
+            is_video = item.get("type") == "video"
+            prompt_txt = item.get("prompt", "Prompt no registrado")
+            video_path = item.get("file_path")
+            item_id = item["id"]
             
-            is_video = False
-            if isinstance(item, dict):
-                is_video = item.get("type") == "video"
-                img = item.get("img")
-                prompt_txt = item.get("prompt", "Prompt no registrado")
-                video_path = item.get("file_path")
-            else:
-                img = item
-                prompt_txt = "Prompt no registrado"
-                
             with cols[i % 3]:
                 # --- SI ES VIDEO ---
                 if is_video:
                     if video_path and os.path.exists(video_path):
-                        st.video(video_path)
-                        st.text_area("Prompt:", value=prompt_txt, height=80, disabled=True, key=f"txt_{i}", label_visibility="collapsed")
-                        
+                        media_store = get_media_store()
+                        video_url = media_store.url_for(video_path)
+                        if video_url:
+                            # Servido desde disco por Streamlit: el MP4 no pasa por la memoria del script
+                            st.markdown(f'<video src="{video_url}" controls preload="metadata" style="width:100%"></video>', unsafe_allow_html=True)
+                        else:
+                            st.video(video_path)
+                        st.text_area("Prompt:", value=prompt_txt, height=80, disabled=True, key=f"txt_{item_id}", label_visibility="collapsed")
+                    
                         c1, c2 = st.columns([1, 1])
-                        with open(video_path, "rb") as f:
-                            c1.download_button("💾 Guardar MP4", f, file_name=f"archviz_vid_{i}.mp4", mime="video/mp4", key=f"dl_{i}")
+                        if video_url:
+                            c1.markdown(f'<a href="{video_url}" download="archviz_vid_{i}.mp4">💾 Guardar MP4</a>', unsafe_allow_html=True)
+                        else:
+                            c1.download_button("💾 Guardar MP4", lambda p=video_path: media_store.read(p), file_name=f"archviz_vid_{i}.mp4", mime="video/mp4", key=f"dl_{item_id}")
                     else:
                         st.error("Archivo de video no encontrado en disco.")
-                
+            
                 # --- SI ES IMAGEN ---
                 else:
-                    if img:
-                        st.image(img, use_container_width=True)
-                        st.text_area("Prompt:", value=prompt_txt, height=80, disabled=True, key=f"txt_{i}", label_visibility="collapsed")
-                        
-                        c1, c2, c3 = st.columns([1, 1, 1])
-                        
-                        buf = BytesIO()
-                        img.save(buf, format="PNG")
-                        c1.download_button("💾", buf.getvalue(), f"archviz_{i}.png", "image/png", key=f"dl_{i}")
-                        
-                        if c2.button("🔍 4K", key=f"up_{i}"):
-                            with st.spinner("Reescalando..."):
-                                img_4k = upscale_image(img)
-                                buf_4k = BytesIO()
-                                img_4k.save(buf_4k, format="PNG", optimize=True)
-                                st.session_state[f"ready_4k_{i}"] = buf_4k.getvalue()
-                                st.rerun()
-                        
-                        if f"ready_4k_{i}" in st.session_state:
-                            c2.download_button("⬇️", st.session_state[f"ready_4k_{i}"], f"4k_{i}.png", "image/png", key=f"dl4k_{i}")
+                    digest = item["hash"]
+                    if history_store.exists(digest):
+                        # Miniatura en pantalla; el PNG completo solo se lee al descargar
+                        st.image(history_store.thumbnail(digest, owner=st.session_state.session_id), use_container_width=True)
+                        st.text_area("Prompt:", value=prompt_txt, height=80, disabled=True, key=f"txt_{item_id}", label_visibility="collapsed")
+                    
+                        c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
+                    
+                        c1.download_button("💾", lambda d=digest: history_store.png_bytes(d), f"archviz_{digest}.png", "image/png", key=f"dl_{item_id}")
+                    
+                        # Reescalado en segundo plano, memoizado por hash + destino
+                        upscale_engine = get_upscale_engine()
+                        up_path = upscale_engine.cached(digest, upscale_target, upscale_rapido)
+                        if up_path:
+                            c2.download_button(f"⬇️ {upscale_target}", lambda p=up_path: upscale_engine.read(p),
+                                               f"{upscale_target.lower()}_{digest}.png", "image/png", key=f"dlup_{item_id}")
+                        elif c2.button(f"🔍 {upscale_target}", key=f"up_{item_id}"):
+                            job = upscale_engine.submit(get_job_registry(), digest, lambda d=digest: history_store.load(d),
+                                                        upscale_target, upscale_rapido)
+                            if job.id not in st.session_state.jobs:
+                                st.session_state.jobs.append(job.id)
+                            st.rerun()
 
-                        if c3.button("🔄 Ref", key=f"ref_{i}"):
+                        if c3.button("🔄 Ref", key=f"ref_{item_id}"):
                             st.session_state.referencias.append({
-                                "img": img,
+                                "ref": get_reference_store().ingest_image(history_store.load(digest), owner=st.session_state.session_id),
                                 "name": f"hist_{int(time.time())}.png"
                             })
                             st.toast("Añadida a Referencias", icon="✅")
                             time.sleep(0.5)
                             st.rerun()
+
+                        if c4.button("🔍", key=f"zoom_{item_id}"):
+                            vista_completa(f"archviz_{digest}.png", history_store.path(digest))
+
+                        # Boceto del modo progresivo: el 4K final solo se genera si se aprueba
+                        borrador = item.get("draft")
+                        if borrador:
+                            job_final = get_job_registry().get(item["final_job"]) if item.get("final_job") else None
+                            if job_final is not None and job_final.is_active:
+                                st.caption(f"⏳ 4K final en Nano Banana Pro · {job_final.message}")
+                            else:
+                                if job_final is not None and job_final.status == ERROR:
+                                    st.caption(f"⚠️ El 4K final falló: {job_final.error}")
+                                st.caption("✏️ Boceto rápido (Nano Banana Flash)")
+                                ca, cb = st.columns(2)
+                                if ca.button("✅ Aprobar 4K", key=f"aprobar_{item_id}", use_container_width=True):
+                                    fp = render_fingerprint(FINAL_MODEL, borrador["prompt_render"],
+                                                            [digest] + [ref.hash for ref in borrador["refs"]],
+                                                            ratio=borrador["ratio"], res=FINAL_RES)
+                                    job = get_job_registry().submit(
+                                        lambda job, d=digest, b=borrador, p=prompt_txt, rs=get_reference_store(),
+                                               o=st.session_state.session_id: trabajo_final(job, client, history_store, rs, d, b, p, o),
+                                        kind="image",
+                                        label=f"4K final ({borrador['ratio']})",
+                                        meta={"prompt": prompt_txt, "replace": item_id},
+                                        key=fp
+                                    )
+                                    item["final_job"] = job.id
+                                    if job.id not in st.session_state.jobs:
+                                        st.session_state.jobs.append(job.id)
+                                    st.rerun()
+                                if cb.button("✖ Descartar", key=f"descartar_{item_id}", use_container_width=True):
+                                    st.session_state.historial.remove(item)
+                                    rerun_fragmento()
+                    else:
+                        st.error("Imagen no encontrada en disco.")
+
+    if st.session_state.historial:
+        st.divider()
+        with timer.stage("historial"):
+            seccion_historial(client)
+
+    # --- DIAGNÓSTICO: TIEMPOS DE ARRANQUE Y RERUN ---
+    with st.expander("⏱️ Tiempos de ejecución", expanded=False):
+        filas = get_timing_report().summary()
+        if filas:
+            tabla = "| Etapa | Último (ms) | Media | p95 | Primera vez | N |\n|---|---|---|---|---|---|\n"
+            tabla += "\n".join(f"| {f['stage']} | {f['last']} | {f['mean']} | {f['p95']} | {f['first']} | {f['n']} |" for f in filas)
+            st.markdown(tabla)
+            st.caption("Reruns completos del proceso (todas las sesiones). 'Primera vez' = arranque en frío.")
+        else:
+            st.caption("Aún no hay reruns registrados.")
+
+        # Reruns parciales: al tocar un widget solo se ejecuta su zona
+        filas = [(nombre, get_timing_report().summary(kind=f"fragment:{nombre}")) for nombre in FRAGMENTOS]
+        filas = [(nombre, f[0]) for nombre, f in filas if f]
+        if filas:
+            tabla = "| Zona (fragmento) | Último (ms) | Media | p95 | Esta sesión | N |\n|---|---|---|---|---|---|\n"
+            tabla += "\n".join(f"| {nombre} | {f['last']} | {f['mean']} | {f['p95']} | {st.session_state.tiempos_fragmento.get(nombre, '—')} | {f['n']} |"
+                                for nombre, f in filas)
+            st.markdown(tabla)
+
+        # Trazas por etapa (API, decodificación, codificación, upscale...) con exportación JSONL.
+        # El trazador es del proceso: solo cambia al pulsar un botón, nunca por el estado de un widget
+        from archviz.timing import default_trace_path, tracer
+        c_traza1, c_traza2 = st.columns(2)
+        if c_traza1.button("⏹️ Desactivar trazas" if tracer.enabled else "▶️ Activar trazas por etapa", key="trace_switch",
+                           help="Afecta a todo el proceso (todas las sesiones)."):
+            tracer.configure(enabled=not tracer.enabled)
+            st.rerun()
+        if c_traza2.button("Dejar de exportar" if tracer.path else "💾 Exportar a JSONL", key="trace_export",
+                           disabled=not tracer.enabled, help="Archivo diario en la carpeta de caché del servidor."):
+            tracer.configure(path="" if tracer.path else default_trace_path())
+            st.rerun()
+        trazas = tracer.enabled
+        filas_spans = tracer.summary()
+        if filas_spans:
+            tabla = "| Span | N | Media (ms) | p95 | Máx | Bytes | Tokens | Errores |\n|---|---|---|---|---|---|---|---|\n"
+            tabla += "\n".join(
+                f"| {f['span']} | {f['n']} | {f['mean']} | {f['p95']} | {f['max']} | {f['bytes'] / 1e6:.1f} MB | {f['tokens']} | {f['errors']} |"
+                for f in filas_spans
+            )
+            st.markdown(tabla)
+            if tracer.path:
+                st.caption(f"Exportando a `{tracer.path}` (una línea JSON por span).")
+        elif trazas:
+            st.caption("Trazas activas: aún no hay spans registrados.")
+
+        # Memoria del proceso: presupuesto compartido de imágenes/blobs y consumo por sesión
+        from archviz.memory import process_rss
+        uso = get_memory_budget().usage()
+        rss = process_rss()
+        st.progress(min(1.0, uso["resident_bytes"] / uso["max_bytes"]),
+                    text=f"🧠 Imágenes en RAM: {uso['resident_bytes'] / 1e6:.0f} / {uso['max_bytes'] / 1e6:.0f} MB"
+                         + (f" | RSS del proceso: {rss / 1e6:.0f} MB" if rss else ""))
+        st.caption(f"{uso['entries']} entradas, {uso['spilled']} fuera de RAM ({uso['spilled_bytes'] / 1e6:.0f} MB) | "
+                   f"volcados {uso['spills']}, descartes {uso['drops']}, recargas {uso['rehydrations']} | "
+                   f"esta sesión: {uso['sessions'].get(st.session_state.session_id, 0) / 1e6:.1f} MB en RAM, "
+                   f"{len(uso['sessions'])} sesiones con datos en RAM")
+
+# Registro del rerun completo (también la pantalla de acceso, que no carga google.genai ni PIL)
+get_timing_report().record(timer, kind="app" if st.session_state.get("authenticated") else "login")
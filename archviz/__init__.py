@@ -0,0 +1 @@
+# Núcleo reutilizable del Ultimate Archviz Generator (sin dependencia de Streamlit).
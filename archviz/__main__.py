@@ -0,0 +1,5 @@
+import sys
+
+from archviz.cli import main
+
+sys.exit(main())
@@ -0,0 +1,323 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import wait
+
+from archviz.jobs import JobRegistry, DONE, ERROR
+
+# ==========================================
+# RENDER POR LOTES SIN INTERFAZ (CLI)
+# ==========================================
+# python -m archviz manifest.jsonl --out renders/
+#
+# Cada fila del manifiesto (JSONL o CSV) es un render:
+#   id        identificador estable (por defecto, el número de fila)
+#   prompt    texto final para el motor, o bien
+#   command   comando para el motor de prompts (recetas locales o LLM)
+#   model     nano-pro | nano | imagen | veo, id del modelo o nombre de la app
+#   ratio     16:9, 9:16, 1:1, 4:3, 3:4           (por defecto 16:9)
+#   res       1080p | 4K                            (por defecto 1080p)
+#   veo_modo  inicial | inicio-fin | assets         (solo Veo)
+#   refs      rutas de imágenes (lista en JSONL, separadas por ";" en CSV)
+#   variants  imágenes por fila (por defecto 1)
+#
+# results.jsonl en la carpeta de salida es a la vez el manifiesto de resultados y
+# el punto de control: al relanzar, las filas ya completadas se saltan.
+
+RESULTS_FILE = "results.jsonl"
+
+
+class RateLimiter:
+    # Como máximo `per_minute` llamadas por minuto entre todos los hilos (intervalo mínimo)
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            espera = max(0.0, self._next - ahora)
+            self._next = max(ahora, self._next) + self.interval
+        if espera:
+            time.sleep(espera)
+
+
+def read_manifest(path):
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            filas = []
+            for fila in csv.DictReader(f):
+                fila = {k: v for k, v in fila.items() if v not in (None, "")}
+                if "refs" in fila:
+                    fila["refs"] = [r.strip() for r in fila["refs"].split(";") if r.strip()]
+                filas.append(fila)
+    else:
+        with open(path, encoding="utf-8") as f:
+            filas = [json.loads(linea) for linea in f if linea.strip()]
+    items = []
+    for n, fila in enumerate(filas, 1):
+        fila = dict(fila)
+        fila["id"] = str(fila.get("id") or n)
+        items.append(fila)
+    ids = [i["id"] for i in items]
+    if len(ids) != len(set(ids)):
+        raise ValueError("El manifiesto tiene ids repetidos: el punto de control no podría distinguirlos")
+    return items
+
+
+def load_checkpoint(out_dir):
+    # ids ya completados (la última línea de cada id manda)
+    estado = {}
+    path = os.path.join(out_dir, RESULTS_FILE)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    r = json.loads(linea)
+                except ValueError:
+                    continue  # línea truncada por una interrupción
+                estado[r["id"]] = r
+    return {k for k, r in estado.items() if r.get("status") == DONE}
+
+
+def resolve_model(name):
+    from archviz.render import MODEL_ALIASES, MODEL_MAP
+    name = (name or "nano-pro").strip()
+    if name in MODEL_ALIASES:
+        return MODEL_ALIASES[name]
+    if name in MODEL_MAP:
+        return MODEL_MAP[name]
+    if name in MODEL_MAP.values():
+        return name
+    raise ValueError(f"Modelo desconocido: {name}")
+
+
+def resolve_veo_modo(name):
+    from archviz.render import VEO_MODO_ALIASES, VEO_MODO_INICIAL, VEO_MODOS
+    if not name:
+        return VEO_MODO_INICIAL
+    if name in VEO_MODOS:
+        return name
+    if name in VEO_MODO_ALIASES:
+        return VEO_MODO_ALIASES[name]
+    raise ValueError(f"veo_modo desconocido: {name}")
+
+
+class BatchRunner:
+    def __init__(self, client, out_dir, library, api_key=None, max_images=4, max_videos=2,
+                 per_minute=0, llm_recipes=False, log=print):
+        from archviz.media import ReferenceStore
+        from archviz.media_store import MediaStore
+
+        self.client = client
+        self.out_dir = out_dir
+        self.library = library
+        self.api_key = api_key
+        self.llm_recipes = llm_recipes
+        self.log = log
+        self.registry = JobRegistry(limits={"image": max_images, "video": max_videos})
+        self.limiter = RateLimiter(per_minute)
+        self.refs = ReferenceStore()
+        self.images_dir = os.path.join(out_dir, "images")
+        # Sin retención: los videos de un lote se conservan
+        self.media_store = MediaStore(os.path.join(out_dir, "videos"), max_bytes=float("inf"), max_age_days=36500)
+        self._results_lock = threading.Lock()
+        self._prompt_lock = threading.Lock()
+        self._composer = None
+        self._index = None
+        os.makedirs(self.images_dir, exist_ok=True)
+
+    # --- PROMPT ---
+    def prompt_for(self, item):
+        if item.get("prompt"):
+            return item["prompt"], "manifest"
+        command = item.get("command")
+        if not command:
+            raise ValueError("La fila necesita 'prompt' o 'command'")
+        data, version, _ = self.library.snapshot()
+        if not self.llm_recipes:
+            from archviz.recipes import RecipeComposer
+            with self._prompt_lock:
+                if self._composer is None:
+                    self._composer = RecipeComposer(data)
+            seed = item.get("seed")
+            opciones = self._composer.compose(command, seed=int(seed) if seed not in (None, "") else None, n=1)
+            if opciones:
+                return opciones[0]["prompt"], "recipe"
+        from archviz.prompt_cache import PromptCache
+        from archviz.prompt_context import PromptContextIndex
+        from archviz.prompt_engine import improve_prompt
+        with self._prompt_lock:
+            if self._index is None:
+                self._index = (PromptContextIndex(data), PromptCache())
+        index, cache = self._index
+        self.limiter.acquire()
+        texto, _ = improve_prompt(self.client, index, command, version, cache)
+        if not texto:
+            raise ValueError("El motor de prompts devolvió una respuesta vacía")
+        return texto, "llm"
+
+    # --- UNA FILA COMPLETA (hilo del registro) ---
+    def process(self, job, item, model, config, t0, resumen):
+        # Prompt, referencias y render corren en el pool (límite por tipo y RateLimiter);
+        # la fila se escribe en results.jsonl en cuanto termina, con éxito o con error
+        from archviz.render import render_fingerprint, render_prompt
+        record = {"model": model}
+        try:
+            job.message = "Preparando prompt..."
+            prompt, origen = self.prompt_for(item)
+            refs = [self.refs.ingest_bytes(_read(p)) for p in item.get("refs", [])]
+            prompt_render = render_prompt(prompt)
+            record.update(prompt=prompt, prompt_source=origen,
+                          fingerprint=render_fingerprint(model, prompt_render, [r.hash for r in refs], **config))
+            record.update(status=DONE, outputs=self.render(job, item, model, prompt_render, refs, config))
+        except Exception as e:
+            self._finish(item, dict(record, status=ERROR, error=str(e)), t0, resumen)
+            raise
+        self._finish(item, record, t0, resumen)
+        return record["outputs"]
+
+    # --- RENDER DE UNA FILA (hilo del registro) ---
+    def render(self, job, item, model, prompt_render, refs, config):
+        from archviz.render import build_video_request, render_images
+        ratio, res, n = config["ratio"], config["res"], config["variants"]
+        self.limiter.acquire()
+        if "veo-" in model:
+            from archviz.render import generate_video
+            video_kwargs, aviso = build_video_request(model, prompt_render, ratio, res, config["veo_modo"], refs)
+            if aviso:
+                job.message = aviso
+            video_path = generate_video(self.client, video_kwargs, self.media_store, job, self.api_key)
+            if not video_path:
+                # Sin video (p. ej. filtro de seguridad): error para que se reintente al relanzar
+                raise ValueError("Veo no devolvió ningún video (posible filtro de seguridad)")
+            return [video_path]
+
+        parts = [r.as_part() for r in refs]
+        if "imagen-" in model:
+            imagenes = render_images(self.client, model, prompt_render, parts, ratio, res, n, job)
+        else:
+            # Nano Banana: una llamada por variante
+            imagenes = []
+            for k in range(n):
+                if k:
+                    self.limiter.acquire()
+                imagenes += render_images(self.client, model, prompt_render, parts, ratio, res, 1, job)
+        if not imagenes:
+            raise ValueError("El modelo no devolvió ninguna imagen (posible filtro de seguridad)")
+        salidas = []
+        for k, img in enumerate(imagenes):
+            path = os.path.join(self.images_dir, f"{item['id']}_{k + 1}.png")
+            tmp = path + ".tmp"
+            img.save(tmp, format="PNG")
+            os.replace(tmp, path)
+            salidas.append(path)
+        return salidas
+
+    def write_result(self, record):
+        # Una línea por fila terminada, volcada a disco antes de seguir (punto de control)
+        with self._results_lock:
+            with open(os.path.join(self.out_dir, RESULTS_FILE), "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run(self, items, done_ids=()):
+        pendientes = [i for i in items if i["id"] not in done_ids]
+        self.log(f"{len(items)} filas, {len(items) - len(pendientes)} ya completadas, {len(pendientes)} pendientes")
+        trabajos = []
+        resumen = {"done": 0, "error": 0, "skipped": len(items) - len(pendientes)}
+        try:
+            for item in pendientes:
+                t0 = time.time()
+                try:
+                    model = resolve_model(item.get("model"))
+                    config = {
+                        "ratio": item.get("ratio", "16:9"),
+                        "res": item.get("res", "1080p"),
+                        "variants": int(item.get("variants", 1)),
+                        "veo_modo": resolve_veo_modo(item.get("veo_modo")) if "veo-" in model else None,
+                    }
+                except Exception as e:
+                    self._finish(item, {"status": ERROR, "error": str(e)}, t0, resumen)
+                    continue
+                trabajos.append(self.registry.submit(
+                    lambda job, item=item, model=model, config=config, t0=t0: self.process(
+                        job, item, model, config, t0, resumen),
+                    kind="video" if "veo-" in model else "image",
+                    label=item["id"],
+                ))
+            # Cada trabajo escribe su fila al terminar: aquí solo se espera al lote
+            wait([job.future for job in trabajos])
+        except KeyboardInterrupt:
+            # Lo que ya terminó está en results.jsonl; lo pendiente se repite al relanzar
+            for job in trabajos:
+                self.registry.cancel(job.id)
+            self.log("Interrumpido: relanza el mismo comando para continuar.")
+            raise
+        return resumen
+
+    def _finish(self, item, record, t0, resumen):
+        record = dict(record, id=item["id"], elapsed_s=round(time.time() - t0, 1))
+        self.write_result(record)
+        with self._results_lock:
+            resumen["done" if record["status"] == DONE else "error"] += 1
+        detalle = ", ".join(str(o) for o in record.get("outputs") or [] if o) or record.get("error") or ""
+        self.log(f"[{record['status']}] {item['id']}: {detalle}")
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m archviz", description="Render por lotes desde un manifiesto JSONL/CSV.")
+    parser.add_argument("manifest", help="Archivo .jsonl o .csv con una fila por render")
+    parser.add_argument("--out", default="renders", help="Carpeta de salida (imágenes, videos y results.jsonl)")
+    parser.add_argument("--data", default="data", help="Carpeta de la biblioteca JSON (para filas con 'command')")
+    parser.add_argument("--max-images", type=int, default=4, help="Renders de imagen simultáneos")
+    parser.add_argument("--max-videos", type=int, default=2, help="Renders de video simultáneos")
+    parser.add_argument("--rpm", type=int, default=0, help="Máximo de llamadas a la API por minuto (0 = sin límite)")
+    parser.add_argument("--llm-recipes", action="store_true", help="Recetas también por el LLM (no el compositor local)")
+    parser.add_argument("--restart", action="store_true", help="Ignora el punto de control y rehace todas las filas")
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        parser.error("Falta la variable de entorno GOOGLE_API_KEY")
+
+    from google import genai
+    from archviz.library import JsonLibrary
+
+    items = read_manifest(args.manifest)
+    os.makedirs(args.out, exist_ok=True)
+    done_ids = set() if args.restart else load_checkpoint(args.out)
+    library = JsonLibrary(args.data)
+    library.reload()
+
+    runner = BatchRunner(genai.Client(api_key=api_key), args.out, library, api_key=api_key,
+                         max_images=args.max_images, max_videos=args.max_videos,
+                         per_minute=args.rpm, llm_recipes=args.llm_recipes)
+    try:
+        resumen = runner.run(items, done_ids)
+    except KeyboardInterrupt:
+        # Los hilos del pool no son daemon: sin _exit el proceso esperaría a los
+        # renders en curso (minutos con Veo). results.jsonl ya está en disco.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(130)
+    print(f"Completadas {resumen['done']}, con error {resumen['error']}, saltadas {resumen['skipped']}. "
+          f"Resultados en {os.path.join(args.out, RESULTS_FILE)}")
+    return 1 if resumen["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+import os
+
+# Raíz del proyecto (junto a app.py, data/ y static/): las cachés no dependen del
+# directorio desde el que se lance streamlit
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directorio raíz para cachés y archivos generados (configurable por entorno)
+DEFAULT_CACHE_DIR = os.environ.get("ARCHVIZ_CACHE_DIR", os.path.join(PROJECT_DIR, ".cache", "archviz"))
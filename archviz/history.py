@@ -0,0 +1,117 @@
+import os
+import time
+import uuid
+
+import PIL.Image
+
+from archviz.config import DEFAULT_CACHE_DIR
+from archviz.media import THUMB_EXT, image_hash, thumbnail_bytes
+from archviz.media_store import MediaStore
+from archviz.memory import MemoryBudget, image_nbytes
+from archviz.timing import span
+
+# ==========================================
+# HISTORIAL EN DISCO
+# ==========================================
+# Cada resultado se guarda una vez como PNG bajo su hash de contenido. La sesión solo
+# conserva metadatos; miniatura e imagen completa se cargan bajo demanda dentro del
+# presupuesto de memoria del proceso (al salir de RAM se releen del propio disco).
+# La carpeta tiene la misma retención por antigüedad y tamaño que los videos.
+
+HISTORY_THUMB_EDGE = 768
+HISTORY_MAX_GB = 20
+HISTORY_MAX_DAYS = 30
+
+
+class HistoryStore:
+    def __init__(self, root=None, budget=None, max_bytes=HISTORY_MAX_GB * 1024 ** 3, max_age_days=HISTORY_MAX_DAYS):
+        self.root = os.path.join(root or DEFAULT_CACHE_DIR, "history")
+        self.budget = budget if budget is not None else MemoryBudget(root)
+        self.files = MediaStore(self.root, max_bytes=max_bytes, max_age_days=max_age_days)
+
+    def path(self, digest):
+        return os.path.join(self.root, f"{digest}.png")
+
+    def thumb_path(self, digest):
+        return os.path.join(self.root, f"{digest}_thumb.{THUMB_EXT}")
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def add_image(self, img, prompt, owner=None, **meta):
+        digest = image_hash(img)
+        if not self.exists(digest):
+            # PNG de descarga: se codifica una sola vez (escritura atómica)
+            tmp = self.path(digest) + f".{uuid.uuid4().hex[:6]}.tmp"
+            with span("encode.png", size=img.size) as sp:
+                img.save(tmp, format="PNG")
+                sp.set(bytes=os.path.getsize(tmp))
+            os.replace(tmp, self.path(digest))
+
+        self.thumbnail(digest, img, owner=owner)
+        self.enforce_retention(keep=(self.path(digest), self.thumb_path(digest)))
+        return self.entry(digest, img.size, prompt, **meta)
+
+    def enforce_retention(self, keep=()):
+        removed = self.files.enforce_retention(keep=keep)
+        for path in removed:
+            digest = os.path.basename(path).split("_")[0].split(".")[0]
+            if path == self.path(digest):
+                # Sin PNG la miniatura ya no sirve (la sesión muestra "no encontrada")
+                try:
+                    os.remove(self.thumb_path(digest))
+                except OSError:
+                    pass
+            self.budget.discard(f"history:{digest}")
+            self.budget.discard(f"thumb:{digest}")
+        return removed
+
+    def entry(self, digest, size, prompt, **meta):
+        # Registro de sesión para una imagen que ya está en disco
+        return dict({
+            "id": uuid.uuid4().hex[:10],
+            "type": "image",
+            "hash": digest,
+            "size": tuple(size),
+            "file_path": None,
+            "prompt": prompt,
+            "created": time.time(),
+        }, **meta)
+
+    def _read_thumb(self, digest):
+        with open(self.thumb_path(digest), "rb") as f:
+            return f.read()
+
+    def thumbnail(self, digest, img=None, owner=None):
+        key = f"thumb:{digest}"
+        data = self.budget.get(key, owner=owner)
+        if data is not None:
+            return data
+        try:
+            data = self._read_thumb(digest)
+        except OSError:
+            with span("encode.thumbnail") as sp:
+                data = thumbnail_bytes(img if img is not None else self.load(digest), HISTORY_THUMB_EDGE)
+                sp.set(bytes=len(data))
+            with open(self.thumb_path(digest), "wb") as f:
+                f.write(data)
+        # Ya está en disco: si sale de RAM no hace falta volcarla
+        return self.budget.put(key, data, len(data), owner=owner, load=lambda _: self._read_thumb(digest))
+
+    def png_bytes(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def _read_image(self, digest):
+        img = PIL.Image.open(self.path(digest))
+        img.load()
+        return img
+
+    def load(self, digest):
+        # Imagen completa bajo demanda; se queda en RAM mientras quepa (4K, Ref... seguidos)
+        key = f"history:{digest}"
+        img = self.budget.get(key)
+        if img is None:
+            img = self._read_image(digest)
+            self.budget.put(key, img, image_nbytes(img), load=lambda _: self._read_image(digest))
+        return img
@@ -0,0 +1,159 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# MOTOR DE TRABAJOS EN SEGUNDO PLANO
+# ==========================================
+# Registro de trabajos compartido por el proceso. Los límites por tipo de trabajo
+# (video, imagen...) fijan cuántos renders corren a la vez (cuota de la API);
+# el resto espera en cola. Cada tipo tiene su propio pool: una cola larga de
+# videos no ocupa los hilos que necesitan las imágenes.
+# Un trabajo con clave terminado con éxito sigue registrado hasta que una sesión
+# lo recoge (collect): un segundo clic que llega justo después del final se une
+# al resultado en lugar de pagar otra llamada. Un trabajo con clave (huella de la petición) que ya
+# está en cola o en curso no se repite: quien lo pide otra vez se une a él.
+
+QUEUED, RUNNING, DONE, ERROR, CANCELLED = "queued", "running", "done", "error", "cancelled"
+
+STATUS_LABELS = {
+    QUEUED: "⏳ En cola",
+    RUNNING: "⚙️ Procesando",
+    DONE: "✅ Listo",
+    ERROR: "❌ Error",
+    CANCELLED: "✖ Cancelado",
+}
+
+
+class Job:
+    def __init__(self, kind, label, owner=None, meta=None, key=None):
+        self.id = uuid.uuid4().hex[:10]
+        self.key = key
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.message = "En cola"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.operation = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.attached = 0
+        self.collected = False
+
+    @property
+    def is_active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def is_pending(self):
+        # Activo, o terminado con éxito sin que ninguna sesión lo haya recogido
+        return self.is_active or (self.status == DONE and not self.collected)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobRegistry:
+    def __init__(self, limits=None, keep_seconds=6 * 3600):
+        self.limits = dict(limits or {"video": 2})
+        self.keep_seconds = keep_seconds
+        self._executors = {kind: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"archviz-{kind}")
+                           for kind, n in self.limits.items()}
+        self._jobs = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, kind, label, owner=None, meta=None, key=None):
+        # fn(job) corre en un hilo del pool y devuelve el resultado del trabajo.
+        # Con key: si hay un trabajo activo con la misma clave se devuelve ese.
+        if kind not in self._executors:
+            raise ValueError(f"Tipo de trabajo sin límite configurado: {kind}")
+        if key is not None:
+            with self._lock:
+                job = self._inflight.get(key)
+                if job is not None and job.is_pending:
+                    job.attached += 1
+                    return job
+        job = Job(kind, label, owner=owner, meta=meta, key=key)
+
+        def run():
+            with self._lock:
+                if job.status == CANCELLED:
+                    return
+                job.status = RUNNING
+                job.started = time.time()
+                job.message = "Iniciando..."
+            try:
+                job.result = fn(job)
+                job.status = DONE
+                job.message = "Completado"
+            except Exception as e:
+                job.error = str(e)
+                job.status = ERROR
+                job.message = f"Error: {e}"
+            finally:
+                job.finished = time.time()
+                if key is not None and job.status != DONE:
+                    # Un error libera la clave: reintentar envía una petición nueva
+                    with self._lock:
+                        if self._inflight.get(key) is job:
+                            del self._inflight[key]
+
+        with self._lock:
+            # Comprobación repetida bajo el mismo lock que el registro: dos envíos
+            # simultáneos con la misma clave no pueden crear dos trabajos
+            if key is not None:
+                previo = self._inflight.get(key)
+                if previo is not None and previo.is_pending:
+                    previo.attached += 1
+                    return previo
+                self._inflight[key] = job
+            self._prune()
+            self._jobs[job.id] = job
+            job.future = self._executors[kind].submit(run)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def collect(self, job_id):
+        # La sesión ya tiene el resultado: la clave queda libre para una petición nueva
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.collected = True
+            if job.key is not None and self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            return job
+
+    def cancel(self, job_id):
+        # Solo se pueden cancelar trabajos que aún no han empezado
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.future.cancel()
+            if job.key is not None and self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            job.status = CANCELLED
+            job.message = "Cancelado"
+            job.finished = time.time()
+            return True
+
+    def _prune(self):
+        limite = time.time() - self.keep_seconds
+        for job_id in [k for k, j in self._jobs.items() if j.finished and j.finished < limite]:
+            job = self._jobs.pop(job_id)
+            if job.key is not None and self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import threading
+
+# ==========================================
+# BIBLIOTECA JSON COMPILADA (COMPARTIDA, SOLO LECTURA)
+# ==========================================
+# Una sola copia por proceso para todas las sesiones. Cada archivo de data/
+# guarda mtime, tamaño y hash: al recargar solo se vuelven a parsear los que
+# han cambiado, y un archivo inválido conserva su última versión buena.
+# Cada recarga publica un diccionario nuevo; los ya publicados no se modifican.
+
+
+def _file_hash(raw):
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class JsonLibrary:
+    def __init__(self, folder="data"):
+        self.folder = folder
+        self.files = {}
+        self.data = None
+        self.version = None
+        self.message = "Cargando JSONs..."
+        self.stats = {"reloads": 0, "parsed": 0, "skipped": 0}
+        self._published = (None, None, self.message)
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        # Lectura atómica de los tres valores publicados juntos
+        return self._published
+
+    def reload(self):
+        with self._lock:
+            self.stats["reloads"] += 1
+            if not os.path.isdir(self.folder):
+                self.files.clear()
+                return self._publish({}, "⚠️ Carpeta 'data' no encontrada.")
+            names = sorted(f for f in os.listdir(self.folder) if f.endswith(".json"))
+            if not names:
+                self.files.clear()
+                return self._publish({}, "⚠️ Carpeta 'data' vacía.")
+
+            errores = []
+            cambios = 0
+            for filename in names:
+                try:
+                    cambios += self._refresh_file(filename)
+                except (OSError, ValueError) as e:
+                    errores.append(f"{filename}: {e}")
+            # Archivos borrados de data/
+            for filename in set(self.files) - set(names):
+                del self.files[filename]
+                cambios += 1
+
+            if cambios or self.data is None:
+                data = {f[:-len(".json")]: entry["data"] for f, entry in sorted(self.files.items())}
+            else:
+                data = self.data
+            if errores:
+                msg = "⚠️ JSONs con errores (se mantiene la última versión válida): " + "; ".join(errores)
+            else:
+                msg = f"✅ Biblioteca ArchViz cargada ({len(names)} archivos)."
+            return self._publish(data, msg)
+
+    def _refresh_file(self, filename):
+        path = os.path.join(self.folder, filename)
+        st = os.stat(path)
+        entry = self.files.get(filename)
+        if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            self.stats["skipped"] += 1
+            return 0
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = _file_hash(raw)
+        if entry and entry["hash"] == digest:
+            # Tocado pero sin cambios de contenido: no se vuelve a parsear
+            entry["mtime"], entry["size"] = st.st_mtime_ns, st.st_size
+            self.stats["skipped"] += 1
+            return 0
+        data = json.loads(raw.decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("la raíz debe ser un objeto JSON")
+        self.files[filename] = {"mtime": st.st_mtime_ns, "size": st.st_size, "hash": digest, "data": data}
+        self.stats["parsed"] += 1
+        return 1
+
+    def _publish(self, data, msg):
+        if data is not self.data:
+            self.data = data
+            # Versión derivada de los hashes por archivo: sin volver a serializar la biblioteca
+            firma = ",".join(f"{f}:{e['hash']}" for f, e in sorted(self.files.items()))
+            self.version = _file_hash(firma.encode("utf-8"))
+        self.message = msg
+        self._published = (self.data or None, self.version, msg)
+        return self._published
@@ -0,0 +1,288 @@
+import re
+import time
+from collections import deque
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+import PIL.ImageFilter
+from google.genai import types
+
+from archviz.media import JPEG_QUALITY
+from archviz.timing import span
+
+# ==========================================
+# MARCAS DE COLOR EN REFERENCIAS ("IMPROVE EDIT")
+# ==========================================
+# El usuario pinta formas RED/GREEN/BLUE/YELLOW sobre una referencia. Aquí se
+# localizan en local (NumPy, sin llamadas): caja, área y centro de cada forma,
+# descritos en porcentajes del encuadre para que la instrucción de edición no
+# dependa de que el modelo adivine la zona. Opcionalmente se envía el original
+# sin trazos más una máscara binaria en lugar de la imagen pintada.
+
+# Colores de marcador (los de Prompt_For_Edits.json): tinta saturada, no un sofá rojo
+MARK_COLORS = ("RED", "GREEN", "BLUE", "YELLOW")
+MARK_WORDS = re.compile(r"\b(" + "|".join(MARK_COLORS) + r")\b")
+# En cualquier caja solo junto a una palabra de marcado ("remove red marked shapes",
+# "the blue outline", "zonas marcadas en rojo"): un "red brick" no dispara el análisis
+MARK_PHRASES = re.compile(
+    r"\b(red|green|blue|yellow)(?:[\s-]+\w+)?[\s-]+(?:mark\w*|shapes?|strokes?|outlines?|circle[sd]?|highlight\w*|areas?|zones?|regions?)\b",
+    re.IGNORECASE)
+MARK_PHRASES_ES = re.compile(
+    r"\b(?:marca\w*|trazos?|zonas?|formas?|contornos?|c[ií]rculos?)(?:\s+\w+){0,2}?\s+(roj|verde|azul|amarill)\w*",
+    re.IGNORECASE)
+_ES_COLORS = {"roj": "RED", "verde": "GREEN", "azul": "BLUE", "amarill": "YELLOW"}
+ANY_COLOR_WORD = re.compile(r"\b(?:red|green|blue|yellow|roj\w*|verdes?|azul\w*|amarill\w*)\b", re.IGNORECASE)
+
+ANALYSIS_MAX_EDGE = 1536  # lado máximo analizado
+GRID_CELLS = 64           # celdas en el lado largo para separar formas y rellenar contornos
+MIN_REGION_PCT = 0.01     # % del encuadre; por debajo, ruido o píxeles sueltos
+OUTLINE_FILL = 0.35       # trazo / caja por debajo de esto = contorno (la zona es su interior)
+CLEAN_FILL_EDGE = 768     # resolución del relleno al quitar los trazos
+
+
+def colors_in(prompt):
+    # Solo se buscan los colores que la instrucción nombra: en mayúsculas (como escribe el
+    # agente de edición) o en cualquier caja junto a "marked", "shape", "stroke"...
+    prompt = prompt or ""
+    nombrados = set(MARK_WORDS.findall(prompt))
+    nombrados.update(c.upper() for c in MARK_PHRASES.findall(prompt))
+    nombrados.update(_ES_COLORS[c.lower()] for c in MARK_PHRASES_ES.findall(prompt))
+    return tuple(c for c in MARK_COLORS if c in nombrados)
+
+
+def mentions_color(prompt):
+    # Nombra un color aunque no como marca (para avisar de que no se analizó nada)
+    return bool(ANY_COLOR_WORD.search(prompt or ""))
+
+
+def _classify(arr, color):
+    r, g, b = arr[..., 0], arr[..., 1], arr[..., 2]
+    if color == "RED":
+        return (r >= 170) & (g <= 90) & (b <= 90)
+    if color == "GREEN":
+        return (g >= 150) & (r <= 100) & (b <= 110)
+    if color == "BLUE":
+        return (b >= 150) & (r <= 90) & (g <= 130)
+    return (r >= 180) & (g >= 180) & (b <= 90)  # YELLOW
+
+
+def _label(cells):
+    # Componentes 8-conexas en la rejilla gruesa (pocos miles de celdas)
+    labels = np.zeros(cells.shape, dtype=np.int32)
+    h, w = cells.shape
+    n = 0
+    for y, x in zip(*np.nonzero(cells)):
+        if labels[y, x]:
+            continue
+        n += 1
+        labels[y, x] = n
+        cola = deque([(y, x)])
+        while cola:
+            cy, cx = cola.popleft()
+            for ny in range(max(cy - 1, 0), min(cy + 2, h)):
+                for nx in range(max(cx - 1, 0), min(cx + 2, w)):
+                    if cells[ny, nx] and not labels[ny, nx]:
+                        labels[ny, nx] = n
+                        cola.append((ny, nx))
+    return labels, n
+
+
+def _grow(mask, limit=None):
+    # Un paso de dilatación 4-conexa, opcionalmente dentro de `limit`
+    d = mask.copy()
+    d[1:] |= mask[:-1]
+    d[:-1] |= mask[1:]
+    d[:, 1:] |= mask[:, :-1]
+    d[:, :-1] |= mask[:, 1:]
+    return d if limit is None else d & limit
+
+
+def _outside(cells):
+    # Celdas libres alcanzables desde el borde; el resto queda encerrado por trazos
+    libres = ~cells
+    fuera = np.zeros(cells.shape, dtype=bool)
+    fuera[[0, -1], :] = libres[[0, -1], :]
+    fuera[:, [0, -1]] |= libres[:, [0, -1]]
+    while True:
+        siguiente = _grow(fuera, libres)
+        if (siguiente == fuera).all():
+            return fuera
+        fuera = siguiente
+
+
+def _position(cx, cy):
+    v = "top" if cy < 1 / 3 else "bottom" if cy > 2 / 3 else "middle"
+    h = "left" if cx < 1 / 3 else "right" if cx > 2 / 3 else "center"
+    return "center" if (v, h) == ("middle", "center") else f"{v} {h}"
+
+
+class MarkAnalysis:
+    def __init__(self, size, regions, region_cells, cell, ms):
+        self.size = size            # tamaño analizado (px, tras el muestreo)
+        self.regions = regions
+        self.region_cells = region_cells  # zona a editar (rejilla gruesa)
+        self.cell = cell            # lado de la celda en píxeles muestreados
+        self.ms = ms
+
+    def mask_image(self):
+        # Máscara 1 bit a la resolución del muestreo: blanco = zona marcada
+        w, h = self.size
+        grande = np.repeat(np.repeat(self.region_cells, self.cell, axis=0), self.cell, axis=1)[:h, :w]
+        return PIL.Image.fromarray(grande.astype(np.uint8) * 255).convert("1")
+
+
+def find_marks(img, colors=MARK_COLORS):
+    t0 = time.perf_counter()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    step = max(1, -(-max(img.size) // ANALYSIS_MAX_EDGE))
+    if step > 1:
+        # Vecino más cercano: el color del trazo no se mezcla con el fondo
+        img = img.resize((-(-img.size[0] // step), -(-img.size[1] // step)), PIL.Image.Resampling.NEAREST)
+    arr = np.asarray(img)
+    h, w = arr.shape[:2]
+    cell = max(1, -(-max(h, w) // GRID_CELLS))
+    gh, gw = -(-h // cell), -(-w // cell)
+    total = h * w
+
+    regions = []
+    region_cells = np.zeros((gh, gw), dtype=bool)
+    for color in colors:
+        painted = _classify(arr, color)
+        if not painted.any():
+            continue
+        padded = np.zeros((gh * cell, gw * cell), dtype=bool)
+        padded[:h, :w] = painted
+        cells = padded.reshape(gh, cell, gw, cell).any(axis=(1, 3))
+        labels, n = _label(cells)
+        encerradas = ~cells & ~_outside(cells)
+        ys, xs = np.nonzero(painted)
+        px_labels = labels[ys // cell, xs // cell]
+        for k in range(1, n + 1):
+            sel = px_labels == k
+            area = int(sel.sum())
+            if area * 100 / total < MIN_REGION_PCT:
+                continue
+            ky, kx = ys[sel], xs[sel]
+            x0, x1, y0, y1 = int(kx.min()), int(kx.max()) + 1, int(ky.min()), int(ky.max()) + 1
+            fill = area / ((x1 - x0) * (y1 - y0))
+            zona = labels == k
+            if fill < OUTLINE_FILL:
+                # Contorno: la zona es lo que encierra; si no está cerrado, su caja
+                caja = np.zeros_like(zona)
+                caja[y0 // cell:(y1 - 1) // cell + 1, x0 // cell:(x1 - 1) // cell + 1] = True
+                dentro = encerradas & caja
+                zona |= dentro if dentro.any() else caja
+            region_cells |= zona
+            regions.append({
+                "color": color,
+                "box": (x0 / w, y0 / h, x1 / w, y1 / h),
+                "centroid": (float(kx.mean()) / w, float(ky.mean()) / h),
+                "area_pct": round((float(zona.sum()) * cell * cell if fill < OUTLINE_FILL else area) * 100 / total, 1),
+                "shape": "outline" if fill < OUTLINE_FILL else "filled",
+            })
+    regions.sort(key=lambda r: (MARK_COLORS.index(r["color"]), r["box"][1], r["box"][0]))
+    return MarkAnalysis((w, h), regions, region_cells, cell, round((time.perf_counter() - t0) * 1000, 1))
+
+
+def describe(regions, label):
+    lineas = []
+    por_color = {}
+    for r in regions:
+        por_color[r["color"]] = por_color.get(r["color"], 0) + 1
+        n = por_color[r["color"]]
+        x0, y0, x1, y1 = (round(v * 100) for v in r["box"])
+        cx, cy = r["centroid"]
+        forma = "the area enclosed by the" if r["shape"] == "outline" else "the area painted with the"
+        lineas.append(
+            f"{r['color']} mark {n} in {label}: {forma} {r['color']} stroke, spanning {x0}-{x1}% from the left and "
+            f"{y0}-{y1}% from the top (centre at {round(cx * 100)}%, {round(cy * 100)}%; about {r['area_pct']}% of the frame, "
+            f"{_position(cx, cy)})."
+        )
+    return lineas
+
+
+def clean_image(img, marks, colors=MARK_COLORS):
+    # Quita los trazos: cada píxel pintado toma la media de su entorno sin pintar. Solo se trabaja
+    # alrededor de las marcas; el relleno se calcula a baja resolución (es un promedio amplio)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if not marks.regions:
+        return img
+    margen = max(img.size) // 10
+    x0 = max(0, int(min(r["box"][0] for r in marks.regions) * img.width) - margen)
+    y0 = max(0, int(min(r["box"][1] for r in marks.regions) * img.height) - margen)
+    x1 = min(img.width, int(max(r["box"][2] for r in marks.regions) * img.width) + margen)
+    y1 = min(img.height, int(max(r["box"][3] for r in marks.regions) * img.height) + margen)
+    zona = img.crop((x0, y0, x1, y1))
+    arr = np.asarray(zona)
+    painted = np.zeros(arr.shape[:2], dtype=bool)
+    for color in colors:
+        painted |= _classify(arr, color)
+    # Incluye el borde suavizado del trazo
+    painted = _grow(_grow(painted))
+
+    step = max(1, -(-max(zona.size) // CLEAN_FILL_EDGE))
+    small = (-(-zona.width // step), -(-zona.height // step))
+    libre = PIL.Image.fromarray((~painted).astype(np.uint8) * 255).resize(small, PIL.Image.Resampling.BOX)
+    libre = libre.point(lambda v: 255 if v == 255 else 0)  # celdas con algo de trazo no aportan color
+    fondo = PIL.Image.composite(zona.resize(small, PIL.Image.Resampling.BOX), PIL.Image.new("RGB", small), libre)
+    libres = np.asarray(libre) == 255
+    relleno = np.asarray(fondo, dtype=np.float32).copy()
+    pendiente = ~libres
+    for radio in (2, 8, 32, max(small)):
+        num = np.asarray(fondo.filter(PIL.ImageFilter.BoxBlur(radio)), dtype=np.float32)
+        den = np.asarray(libre.filter(PIL.ImageFilter.BoxBlur(radio)), dtype=np.float32)
+        listo = pendiente & (den >= 8)
+        relleno[listo] = num[listo] * 255 / den[listo][:, None]
+        pendiente &= ~listo
+        if not pendiente.any():
+            break
+    relleno = PIL.Image.fromarray(np.clip(relleno, 0, 255).astype(np.uint8)).resize(zona.size, PIL.Image.Resampling.BILINEAR)
+
+    resultado = arr.copy()
+    resultado[painted] = np.asarray(relleno)[painted]
+    limpia = img.copy()
+    limpia.paste(PIL.Image.fromarray(resultado), (x0, y0))
+    return limpia
+
+
+def _part(img, format):
+    buf = BytesIO()
+    if format == "PNG":
+        img.save(buf, format="PNG", optimize=True)
+    else:
+        img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+    return types.Part.from_bytes(data=buf.getvalue(), mime_type=f"image/{format.lower()}")
+
+
+def prepare_edit(refs, prompt, clean=False):
+    # refs: ReferenceImage. Devuelve (prompt con las zonas, partes para el modelo, resumen por referencia)
+    colors = colors_in(prompt)
+    if not colors or not refs:
+        return prompt, [r.as_part() for r in refs], []
+    partes, lineas, resumen = [], [], []
+    with span("masks.analyze", refs=len(refs)) as sp:
+        for ref in refs:
+            img = ref.image
+            marks = find_marks(img, colors)
+            resumen.append({"ref": ref.hash, "regions": len(marks.regions), "ms": marks.ms})
+            if not marks.regions:
+                partes.append(ref.as_part())
+                continue
+            n = len(partes) + 1
+            if clean:
+                partes += [_part(clean_image(img, marks, colors), "JPEG"), _part(marks.mask_image(), "PNG")]
+                lineas.append(f"Image {n} is the clean original of a marked reference and image {n + 1} is its binary "
+                              f"mask in the same layout (white = the marked regions to edit, black = keep unchanged).")
+                lineas += describe(marks.regions, f"image {n}")
+            else:
+                partes.append(ref.as_part())
+                lineas += describe(marks.regions, f"image {n}")
+        sp.set(regions=sum(r["regions"] for r in resumen))
+    if not lineas:
+        return prompt, partes, resumen
+    cierre = ("Apply each colour's edit only inside its region, keep everything outside the regions unchanged"
+              + ("." if clean else ", and remove every marker stroke from the final image."))
+    return f"{prompt}\n\nMarked regions (measured on the reference):\n" + "\n".join(lineas) + f"\n{cierre}", partes, resumen
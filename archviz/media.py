@@ -0,0 +1,214 @@
+import hashlib
+import threading
+import weakref
+from io import BytesIO
+
+import PIL.features
+import PIL.Image
+import PIL.ImageOps
+from google.genai import types
+
+from archviz.memory import MemoryBudget, image_nbytes
+from archviz.timing import span
+
+# ==========================================
+# INGESTA DE REFERENCIAS (DIRECCIONADA POR CONTENIDO)
+# ==========================================
+# Cada imagen se identifica por el hash de su contenido, se decodifica una sola vez,
+# se reduce al mayor tamaño que aceptan los modelos y guarda sus bytes codificados
+# por destino para reutilizarlos en cada render. Imagen y bytes viven en el
+# presupuesto de memoria del proceso: si está lleno se vuelcan a disco y se
+# recuperan al volver a usarlos.
+
+# Lado máximo útil por destino: por encima de esto el modelo reescala igualmente
+REF_MAX_EDGE = {
+    "nano": 3072,
+    "veo": 1920,
+}
+DECODE_MAX_EDGE = max(REF_MAX_EDGE.values())
+JPEG_QUALITY = 92
+
+# Miniaturas de las galerías: WebP (JPEG si Pillow no trae WebP), ~2x el ancho de la columna
+THUMB_FORMAT = "WEBP" if PIL.features.check("webp") else "JPEG"
+THUMB_EXT = THUMB_FORMAT.lower().replace("jpeg", "jpg")
+REF_THUMB_EDGE = 384
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def image_hash(img):
+    h = hashlib.sha256(f"{img.mode}{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()[:16]
+
+
+def fit_to_edge(img, edge):
+    if max(img.size) <= edge:
+        return img
+    img = img.copy()
+    img.thumbnail((edge, edge), PIL.Image.Resampling.LANCZOS)
+    return img
+
+
+# --- VOLCADO A DISCO (presupuesto de memoria) ---
+# Imagen decodificada: píxeles en bruto, sin recodificar (volcar y recuperar es una copia)
+def _dump_image(img, path):
+    with open(path, "wb") as f:
+        f.write(img.tobytes())
+
+
+def _image_loader(mode, size):
+    def load(path):
+        with open(path, "rb") as f:
+            return PIL.Image.frombytes(mode, size, f.read())
+    return load
+
+
+def _dump_encoded(value, path):
+    with open(path, "wb") as f:
+        f.write(value[0])
+
+
+def _encoded_loader(mime):
+    def load(path):
+        with open(path, "rb") as f:
+            return f.read(), mime
+    return load
+
+
+def _dump_bytes(value, path):
+    with open(path, "wb") as f:
+        f.write(value)
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _discard_reference(budget, key):
+    budget.discard(key)
+    for suffix in (*REF_MAX_EDGE, "thumb"):
+        budget.discard(f"{key}:{suffix}")
+
+
+class ReferenceImage:
+    def __init__(self, digest, image, source_format, budget, owner=None):
+        self.hash = digest
+        self.size = image.size
+        self.source_format = source_format
+        self.budget = budget
+        self._key = f"ref:{digest}"
+        self._lock = threading.Lock()
+        budget.put(self._key, image, image_nbytes(image), owner=owner,
+                   dump=_dump_image, load=_image_loader(image.mode, image.size))
+        # Cuando ninguna sesión la usa, sus entradas salen del presupuesto
+        self._finalizer = weakref.finalize(self, _discard_reference, budget, self._key)
+
+    @property
+    def image(self):
+        return self.budget.get(self._key)
+
+    def touch(self, owner):
+        # Registra a la sesión como usuaria sin forzar la carga desde disco
+        if self._key in self.budget:
+            self.budget.get(self._key, owner=owner)
+
+    def encoded(self, target):
+        # (bytes, mime) para el destino; se codifica una vez y se reutiliza
+        key = f"{self._key}:{target}"
+        with self._lock:
+            cached = self.budget.get(key)
+            if cached is None:
+                with span("encode.reference", target=target) as sp:
+                    img = fit_to_edge(self.image, REF_MAX_EDGE[target])
+                    buf = BytesIO()
+                    if target == "nano" and self.source_format == "PNG":
+                        # Capturas y planos con trazos de color: sin pérdidas
+                        img.save(buf, format="PNG")
+                        mime = "image/png"
+                    else:
+                        img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+                        mime = "image/jpeg"
+                    cached = (buf.getvalue(), mime)
+                    self.budget.put(key, cached, len(cached[0]), dump=_dump_encoded, load=_encoded_loader(mime))
+                    sp.set(bytes=len(cached[0]))
+            return cached
+
+    def thumbnail(self, owner=None):
+        # Vista previa para la galería: se codifica una vez por hash de contenido
+        key = f"{self._key}:thumb"
+        with self._lock:
+            data = self.budget.get(key, owner=owner)
+            if data is None:
+                with span("encode.thumbnail", target="ref") as sp:
+                    data = thumbnail_bytes(self.image, REF_THUMB_EDGE)
+                    sp.set(bytes=len(data))
+                self.budget.put(key, data, len(data), owner=owner, dump=_dump_bytes, load=_read_bytes)
+            return data
+
+    def as_veo(self):
+        data, mime = self.encoded("veo")
+        return types.Image(image_bytes=data, mime_type=mime)
+
+    def as_part(self):
+        data, mime = self.encoded("nano")
+        return types.Part.from_bytes(data=data, mime_type=mime)
+
+
+class ReferenceStore:
+    # Índice compartido entre sesiones: una entrada vive mientras alguna sesión la use
+    def __init__(self, budget=None):
+        self.budget = budget if budget is not None else MemoryBudget()
+        self._items = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def _lookup(self, digest):
+        with self._lock:
+            return self._items.get(digest)
+
+    def _register(self, ref):
+        with self._lock:
+            existing = self._items.setdefault(ref.hash, ref)
+        if existing is not ref:
+            # Otra sesión la registró a la vez: comparten la misma entrada del presupuesto
+            ref._finalizer.detach()
+        return existing
+
+    def ingest_bytes(self, data, owner=None):
+        digest = content_hash(data)
+        ref = self._lookup(digest)
+        if ref is not None:
+            ref.touch(owner)
+            return ref
+
+        with span("decode.reference", bytes=len(data)):
+            img = PIL.Image.open(BytesIO(data))
+            source_format = img.format
+            # JPEG: decodifica directamente a escala reducida (1/2, 1/4, 1/8)
+            img.draft("RGB", (DECODE_MAX_EDGE, DECODE_MAX_EDGE))
+            img = PIL.ImageOps.exif_transpose(img)
+            img = fit_to_edge(img.convert("RGB"), DECODE_MAX_EDGE)
+        return self._register(ReferenceImage(digest, img, source_format, self.budget, owner))
+
+    def ingest_image(self, img, owner=None):
+        digest = image_hash(img)
+        ref = self._lookup(digest)
+        if ref is not None:
+            ref.touch(owner)
+            return ref
+        img = fit_to_edge(img.convert("RGB"), DECODE_MAX_EDGE)
+        return self._register(ReferenceImage(digest, img, "PNG", self.budget, owner))
+
+    def __len__(self):
+        return len(self._items)
+
+
+# --- MINIATURAS ---
+def thumbnail_bytes(img, edge, quality=80):
+    thumb = fit_to_edge(img.convert("RGB"), edge)
+    buf = BytesIO()
+    thumb.save(buf, format=THUMB_FORMAT, quality=quality)
+    return buf.getvalue()
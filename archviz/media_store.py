@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+import uuid
+
+# ==========================================
+# ALMACÉN DE VIDEOS GENERADOS
+# ==========================================
+# Descargas por bloques directamente a disco, nombres sin colisiones y una política
+# de retención por antigüedad y tamaño total para acotar disco y memoria del servidor.
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MediaStore:
+    def __init__(self, root, url_prefix=None, max_bytes=5 * 1024 ** 3, max_age_days=7):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def new_path(self, prefix="archviz_video", ext="mp4"):
+        # O_EXCL garantiza que dos renders simultáneos nunca comparten archivo.
+        # uuid4 completo: con static serving el nombre es lo único que protege la URL
+        while True:
+            path = os.path.join(self.root, f"{prefix}_{int(time.time())}_{uuid.uuid4().hex}.{ext}")
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                continue
+
+    def save_stream(self, chunks, prefix="archviz_video", ext="mp4"):
+        path = self.new_path(prefix, ext)
+        tmp = path + ".part"
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            for p in (tmp, path):
+                if os.path.exists(p):
+                    os.remove(p)
+            raise
+        self.enforce_retention(keep=(path,))
+        return path
+
+    def download(self, url, headers=None, prefix="archviz_video", ext="mp4"):
+        import httpx
+
+        with httpx.stream("GET", url, headers=headers, follow_redirects=True, timeout=120) as response:
+            response.raise_for_status()
+            return self.save_stream(response.iter_bytes(CHUNK_SIZE), prefix, ext)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def url_for(self, path):
+        # URL servida por Streamlit desde disco (static serving), sin pasar por RAM
+        if not self.url_prefix or not path:
+            return None
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.root):
+            return None
+        return f"{self.url_prefix}/{os.path.basename(path)}"
+
+    def usage(self):
+        files = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            # .part / .tmp: escrituras en curso, nunca cuentan ni se borran
+            if name.endswith((".part", ".tmp")) or not os.path.isfile(path):
+                continue
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+        return files
+
+    def enforce_retention(self, keep=()):
+        removed = []
+        with self._lock:
+            files = sorted(self.usage())
+            limite = time.time() - self.max_age
+            total = sum(size for _, size, _ in files)
+            for mtime, size, path in files:
+                if path in keep:
+                    continue
+                if mtime >= limite and total <= self.max_bytes:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed.append(path)
+        return removed
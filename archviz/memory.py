@@ -0,0 +1,233 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+
+from archviz.config import DEFAULT_CACHE_DIR
+
+# ==========================================
+# PRESUPUESTO DE MEMORIA DEL PROCESO (IMÁGENES Y BLOBS)
+# ==========================================
+# Un único almacén clave -> valor para todas las sesiones con un tope de RAM.
+# Al superarlo, las entradas menos usadas salen de memoria: las que tienen
+# dump() se escriben a disco y las que no se vuelven a generar desde su origen
+# con load() (p. ej. un PNG del historial que ya está en disco).
+# Cada entrada recuerda qué sesiones la usan para poder medir el consumo por sesión.
+# Las lecturas y escrituras a disco se hacen fuera del lock: una sesión que
+# recarga una imagen de 28 MB no bloquea a las demás.
+
+DEFAULT_BUDGET_MB = 1024
+
+
+def _clean_stale(base):
+    # Volcados de procesos que ya no existen
+    for name in os.listdir(base):
+        try:
+            os.kill(int(name.split("-")[0]), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+        except (ValueError, OSError):
+            pass
+
+
+def image_nbytes(img):
+    # PIL guarda 4 bytes por píxel en los modos de varias bandas
+    return img.width * img.height * (1 if img.mode in ("1", "L", "P") else 4)
+
+
+class _Entry:
+    __slots__ = ("value", "nbytes", "owners", "dump", "load", "path", "spilling")
+
+    def __init__(self, value, nbytes, dump, load):
+        self.value = value
+        self.nbytes = nbytes
+        self.owners = set()
+        self.dump = dump
+        self.load = load
+        self.path = None
+        # Valor que se está escribiendo a disco (sigue disponible mientras tanto)
+        self.spilling = None
+
+
+class MemoryBudget:
+    def __init__(self, root=None, max_bytes=DEFAULT_BUDGET_MB * 1024 * 1024):
+        # Subcarpeta propia por instancia; se borra al cerrar el proceso
+        base = os.path.join(root or DEFAULT_CACHE_DIR, "spill")
+        os.makedirs(base, exist_ok=True)
+        _clean_stale(base)
+        self.root = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=base)
+        weakref.finalize(self, shutil.rmtree, self.root, True)
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self.stats = {"spills": 0, "drops": 0, "rehydrations": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _spill_path(self, key):
+        # Sufijo único: una entrada descartada y vuelta a crear no comparte archivo
+        name = key.replace(os.sep, "_").replace(":", "_")
+        return os.path.join(self.root, f"{name}.{uuid.uuid4().hex[:6]}")
+
+    def put(self, key, value, nbytes, owner=None, dump=None, load=None):
+        # dump(value, path) escribe el valor a disco; load(path) lo recupera.
+        # Sin dump, load(None) lo regenera desde su origen.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._forget(key, entry)
+            entry = _Entry(value, nbytes, dump, load)
+            if owner is not None:
+                entry.owners.add(owner)
+            self._entries[key] = entry
+            self.resident_bytes += nbytes
+            volcados = self._enforce(keep=key)
+        self._write_spills(volcados)
+        return value
+
+    def get(self, key, owner=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            if owner is not None:
+                entry.owners.add(owner)
+            if entry.value is not None:
+                return entry.value
+            value, path = entry.spilling, entry.path
+        if value is None:
+            try:
+                value = entry.load(path)
+            except OSError:
+                with self._lock:
+                    if self._entries.get(key) is not entry:
+                        return None  # descartada mientras se leía
+                raise
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return value
+            if entry.value is not None:
+                # Otra sesión la recargó a la vez
+                return entry.value
+            entry.value = value
+            self.resident_bytes += entry.nbytes
+            self.stats["rehydrations"] += 1
+            volcados = self._enforce(keep=key)
+        self._write_spills(volcados)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._forget(key, entry)
+
+    def release(self, owner):
+        # La sesión deja de contar como usuaria (las entradas siguen para otras sesiones)
+        with self._lock:
+            for entry in self._entries.values():
+                entry.owners.discard(owner)
+
+    def release_inactive(self, is_active):
+        # Sesiones terminadas (is_active(owner) falso): dejan de contar en el consumo
+        with self._lock:
+            owners = set().union(*(entry.owners for entry in self._entries.values()))
+            inactivas = {owner for owner in owners if not is_active(owner)}
+            if inactivas:
+                for entry in self._entries.values():
+                    entry.owners -= inactivas
+        return inactivas
+
+    def _forget(self, key, entry):
+        if entry.value is not None:
+            self.resident_bytes -= entry.nbytes
+        if entry.path:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _enforce(self, keep=None):
+        # Bajo el lock: decide qué sale de RAM. Devuelve los volcados pendientes,
+        # que se escriben con _write_spills() ya fuera del lock.
+        volcados = []
+        for key in list(self._entries):
+            if self.resident_bytes <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if key == keep or entry.value is None:
+                continue
+            if entry.dump is not None:
+                if entry.path is None and entry.spilling is None:
+                    # Solo se escribe la primera vez: el valor no cambia
+                    entry.spilling = entry.value
+                    volcados.append((key, entry))
+                self.stats["spills"] += 1
+            else:
+                self.stats["drops"] += 1
+            entry.value = None
+            self.resident_bytes -= entry.nbytes
+        return volcados
+
+    def _write_spills(self, volcados):
+        for key, entry in volcados:
+            valor = entry.spilling
+            path = self._spill_path(key)
+            try:
+                entry.dump(valor, path)
+                escrito = True
+            except OSError:
+                escrito = False
+            with self._lock:
+                entry.spilling = None
+                vigente = self._entries.get(key) is entry
+                if escrito and vigente:
+                    entry.path = path
+                elif escrito:
+                    # Descartada mientras se escribía
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                elif vigente and entry.value is None:
+                    # Sin disco: vuelve a RAM antes que perder el valor
+                    entry.value = valor
+                    self.resident_bytes += entry.nbytes
+
+    def usage(self):
+        with self._lock:
+            sesiones = {}
+            spilled = 0
+            spilled_bytes = 0
+            for entry in self._entries.values():
+                if entry.value is None:
+                    spilled += 1
+                    spilled_bytes += entry.nbytes
+                    continue
+                for owner in entry.owners:
+                    sesiones[owner] = sesiones.get(owner, 0) + entry.nbytes
+            return {
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "entries": len(self._entries),
+                "spilled": spilled,
+                "spilled_bytes": spilled_bytes,
+                "sessions": sesiones,
+                **self.stats,
+            }
+
+
+def process_rss():
+    # RSS actual en bytes (Linux); None si no se puede leer
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
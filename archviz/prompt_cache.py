@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from archviz.config import DEFAULT_CACHE_DIR
+
+# ==========================================
+# CACHÉ DE PROMPTS MEJORADOS (MEMORIA LRU + DISCO)
+# ==========================================
+# Clave = comando normalizado + hash de la biblioteca JSON + modelo.
+# Nivel 1: LRU en memoria compartida por todas las sesiones.
+# Nivel 2: un archivo JSON por entrada, sobrevive a reinicios de Streamlit.
+
+
+def normalize_command(command):
+    return re.sub(r"\s+", " ", (command or "").strip()).lower()
+
+
+class PromptCache:
+    def __init__(self, cache_dir=None, max_memory=256, max_disk=2000, max_disk_bytes=20 * 1024 * 1024):
+        self.cache_dir = os.path.join(cache_dir or DEFAULT_CACHE_DIR, "prompts")
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.max_disk_bytes = max_disk_bytes
+        self.library = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, command, lib_hash, model):
+        raw = f"{model}\n{lib_hash}\n{normalize_command(command)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def set_library(self, lib_hash):
+        # Si la biblioteca cambió, las entradas de la versión anterior dejan de servir
+        with self._lock:
+            if lib_hash == self.library:
+                return
+            self.library = lib_hash
+            for key in [k for k, v in self._memory.items() if v["library"] != lib_hash]:
+                del self._memory[key]
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        if json.load(f).get("library") != lib_hash:
+                            os.remove(path)
+                except (OSError, ValueError):
+                    continue
+
+    def get(self, command, lib_hash, model):
+        key = self.key(command, lib_hash, model)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry["text"], "memoria"
+
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                os.utime(path)  # mtime = último acceso, para el desalojo LRU en disco
+            except (OSError, ValueError):
+                self.stats["misses"] += 1
+                return None, None
+
+            self.stats["disk_hits"] += 1
+            self._remember(key, entry)
+            return entry["text"], "disco"
+
+    def put(self, command, lib_hash, model, text):
+        key = self.key(command, lib_hash, model)
+        entry = {"library": lib_hash, "model": model, "command": normalize_command(command),
+                 "text": text, "created": time.time()}
+        with self._lock:
+            self._remember(key, entry)
+            tmp = self._path(key) + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp, self._path(key))
+            except OSError:
+                return
+            self._evict_disk()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+
+        files.sort()
+        while files and (len(files) > self.max_disk or total > self.max_disk_bytes):
+            _, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for name in os.listdir(self.cache_dir):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def summary(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return dict(self.stats, entries=len(self._memory),
+                    hit_rate=round(100 * hits / total, 1) if total else 0.0)
@@ -0,0 +1,171 @@
+import json
+import re
+
+# ==========================================
+# ÍNDICE DE RELEVANCIA DE LA BIBLIOTECA JSON
+# ==========================================
+# En lugar de volcar toda la biblioteca en cada llamada a "Procesar Idea",
+# se indexa una sola vez y se envían solo las secciones que el comando necesita.
+
+PARAMS = "Parameters_Ultimate_AI_Image_Prompt_Generator"
+RECIPES = (PARAMS, "geminiGemsPromptRecipes")
+SHARED = RECIPES + ("sharedParameters",)
+UGC_SHARED = [SHARED + (k,) for k in ("cameraImperfections", "humanFactor", "livedInClutter")]
+
+# Disparadores del glosario -> rutas de la biblioteca que requieren.
+# Las rutas que no existan en la biblioteca cargada se ignoran.
+TRIGGER_SECTIONS = [
+    (r"\barchitectural\s+(?:recipe|formula)\b|^\s*(?:inspired\s+)?architectural\b", [
+        RECIPES + ("exteriorArchitecture",), SHARED,
+        ("Instructions", "categories", "formulas", "Architectural"),
+    ]),
+    (r"\binterior\s+design\s+(?:recipe|formula)\b|^\s*(?:inspired\s+)?interior\s+design\b", [
+        RECIPES + ("interiorDesign",), SHARED,
+        ("Instructions", "categories", "formulas", "Interior Design"),
+    ]),
+    (r"\bnatural\s+(?:architectural|interior)\b|\bnaturali[sz]e\b|\bugc\b", UGC_SHARED + [
+        ("Instructions", "keywords", "Naturalize / UGC"),
+        ("Instructions", "categories", "formulas", "Natural Architectural"),
+        ("Instructions", "categories", "formulas", "Natural Interior Design"),
+        ("Instructions", "categories", "actions", "Aesthetic Shift"),
+    ]),
+    (r"\bimprove\s+(?:for\s+)?edits?\s*:", [
+        ("Prompt_For_Edits",),
+    ]),
+    (r"\bmidjourney\b", [("Midjourney_Prompt_Optimization",)]),
+    (r"\bnano\s*banana\b|\bgemini\b", [("Nano_Banana_Optimization",)]),
+    (r"\bplatform\s*:", [("Instructions", "keywords", "Platform")]),
+    (r"\bmultiple\s*:", [("Instructions", "keywords", "Multiple")]),
+]
+
+# Sin secciones de recetas ("Improve:" genérico) se usa el vocabulario compartido.
+DEFAULT_SECTIONS = [SHARED, RECIPES + ("usageNotes",)]
+
+# Plataformas conocidas por si "Platform:" no nombra ninguna.
+PLATFORM_SECTIONS = [("Midjourney_Prompt_Optimization",), ("Nano_Banana_Optimization",)]
+
+MIN_TERM_LEN = 3
+
+
+def estimate_tokens(text):
+    # Aproximación estándar (~4 caracteres por token); suficiente para comparar tamaños
+    return max(1, len(text) // 4) if text else 0
+
+
+def compact_json(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _get_path(data, path):
+    node = data
+    for key in path:
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return node
+
+
+def _set_path(target, path, value):
+    node = target
+    for key in path[:-1]:
+        node = node.setdefault(key, {})
+    node[path[-1]] = value
+
+
+def _keyword_terms(key):
+    # "Brainstorm / Brainstorming" -> ["Brainstorm", "Brainstorming"]
+    return [t.strip() for t in re.split(r"[/+]", key) if t.strip()]
+
+
+class PromptContextIndex:
+    def __init__(self, data):
+        self.data = data or {}
+        self.full_tokens = estimate_tokens(
+            json.dumps(self.data, indent=2, ensure_ascii=False)) if self.data else 0
+        self._triggers = [(re.compile(p, re.IGNORECASE), paths) for p, paths in TRIGGER_SECTIONS]
+
+        # término en minúsculas -> rutas de las secciones que lo contienen
+        self._term_paths = {}
+        self._walk(self.data, ())
+        terms = sorted(self._term_paths, key=len, reverse=True)
+        self._term_re = re.compile(
+            r"(?<!\w)(" + "|".join(re.escape(t) for t in terms) + r")(?!\w)",
+            re.IGNORECASE) if terms else None
+
+    def _add_term(self, term, path):
+        term = term.strip().lower()
+        if len(term) >= MIN_TERM_LEN:
+            self._term_paths.setdefault(term, set()).add(path)
+
+    def _walk(self, node, path):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                child = path + (key,)
+                if path == ("Instructions", "keywords"):
+                    for term in _keyword_terms(key):
+                        self._add_term(term, child)
+                self._walk(value, child)
+        elif isinstance(node, list) and node and all(isinstance(v, str) for v in node):
+            # Cada lista de valores (cameraAngle, lighting, ...) es una sección indexable
+            for value in node:
+                self._add_term(value, path)
+        elif isinstance(node, list):
+            for value in node:
+                if isinstance(value, (dict, list)):
+                    self._walk(value, path)
+
+    def select(self, command):
+        paths = []
+        reasons = []
+        text = command or ""
+
+        for regex, trigger_paths in self._triggers:
+            match = regex.search(text)
+            if match:
+                reasons.append(match.group(0).strip())
+                paths.extend(trigger_paths)
+
+        if re.search(r"\bplatform\s*:", text, re.IGNORECASE) and not any(
+                p in paths for p in PLATFORM_SECTIONS):
+            paths.extend(PLATFORM_SECTIONS)
+
+        if self._term_re:
+            for match in self._term_re.finditer(text):
+                term = match.group(1).lower()
+                for path in sorted(self._term_paths.get(term, ())):
+                    paths.append(path)
+                reasons.append(match.group(1))
+
+        # Sin vocabulario de recetas ni agente de edición: se añade el vocabulario base
+        if not any(SHARED[:len(p)] == p or p[:1] == ("Prompt_For_Edits",) for p in paths
+                   if _get_path(self.data, p) is not None):
+            paths.extend(DEFAULT_SECTIONS)
+
+        # Quita duplicados y rutas ya cubiertas por una sección padre
+        unique = []
+        for path in sorted(set(paths), key=len):
+            if any(path[:len(p)] == p for p in unique):
+                continue
+            if _get_path(self.data, path) is not None:
+                unique.append(path)
+
+        context = {}
+        for path in unique:
+            _set_path(context, path, _get_path(self.data, path))
+        return context, unique, list(dict.fromkeys(reasons))
+
+    def build_context(self, command):
+        if not self.data:
+            return "No JSON data.", {"tokens": 0, "full_tokens": 0, "saved_pct": 0, "sections": []}
+        context, paths, reasons = self.select(command)
+        text = compact_json(context)
+        tokens = estimate_tokens(text)
+        saved = 100 * (1 - tokens / self.full_tokens) if self.full_tokens else 0
+        stats = {
+            "tokens": tokens,
+            "full_tokens": self.full_tokens,
+            "saved_pct": round(saved, 1),
+            "sections": [".".join(p[-2:]) for p in paths],
+            "matches": reasons,
+        }
+        return text, stats
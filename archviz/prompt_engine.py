@@ -0,0 +1,133 @@
+import time
+
+from archviz.prompt_context import estimate_tokens
+from archviz.timing import span
+
+# ==========================================
+# MOTOR DE PROMPTS ("PROCESAR IDEA")
+# ==========================================
+
+PROMPT_MODEL = "gemini-2.5-flash"
+
+SYSTEM_PROMPT = """
+You are 'PromptAssistantGEM', an advanced CLI for ArchViz Prompt Engineering.
+I have loaded the relevant sections of a library of styles/materials in JSON:
+{json_context}
+
+YOUR RULES BASED ON USER GLOSSARY:
+1. 'Improve:': Convert simple input into high-quality detailed prompt using JSON terms.
+2. 'Architectural Recipe': Must include Camera Angle, Image Type, Style, Building Type, Inspiration, Focal Point, Materials, Lighting, Mood.
+3. 'Interior Design Recipe': Must include Camera Angle, Room Type, Style, Brand, Focal Point, Textures, Lighting.
+4. 'Platform:': Optimize terminology for the specified AI.
+5. 'Multiple:': If requested, provide options.
+6. 'Improve edit:': Translate shape-based commands using colors (Red, Blue, etc.) into strict instructions for image editing.
+
+TASK: Analyze the USER COMMAND and output ONLY the final optimized prompt text ready for rendering.
+
+USER COMMAND: {command}
+"""
+
+
+def build_system_prompt(json_context, command):
+    return SYSTEM_PROMPT.format(json_context=json_context, command=command)
+
+
+def _elapsed_ms(t_inicio):
+    return round((time.perf_counter() - t_inicio) * 1000, 1)
+
+
+def _cached(cache, command, lib_hash, model, t_inicio):
+    if cache is None:
+        return None
+    with span("prompt.cache_lookup") as sp:
+        cache.set_library(lib_hash)
+        texto, origen = cache.get(command, lib_hash, model)
+        sp.set(hit=bool(texto))
+    if texto:
+        return texto, {"cache": origen, "elapsed_ms": _elapsed_ms(t_inicio)}
+    return None
+
+
+def _build(index, command):
+    # Solo las secciones relevantes para el comando, en JSON compacto
+    with span("prompt.build") as sp:
+        json_context, stats = index.build_context(command)
+        system_prompt = build_system_prompt(json_context, command)
+        sp.set(bytes=len(system_prompt.encode("utf-8")), tokens=estimate_tokens(system_prompt))
+    return system_prompt, stats
+
+
+def improve_prompt(client, index, command, lib_hash=None, cache=None, model=PROMPT_MODEL):
+    # Devuelve (texto, stats); stats indica si vino de caché o el ahorro de contexto
+    t_inicio = time.perf_counter()
+    hit = _cached(cache, command, lib_hash, model, t_inicio)
+    if hit:
+        return hit
+
+    system_prompt, stats = _build(index, command)
+    with span("api.generate_content", model=model) as sp:
+        res = client.models.generate_content(
+            model=model,
+            contents=system_prompt
+        )
+        usage = getattr(res, "usage_metadata", None)
+        stats["prompt_tokens"] = getattr(usage, "prompt_token_count", None)
+        sp.set(tokens=stats["prompt_tokens"], bytes=len(res.text.encode("utf-8")) if res.text else 0)
+    stats["elapsed_ms"] = _elapsed_ms(t_inicio)
+
+    texto = res.text.strip() if res.text else ""
+    if texto and cache is not None:
+        cache.put(command, lib_hash, model, texto)
+    return texto, stats
+
+
+def stream_prompt(client, index, command, lib_hash=None, cache=None, model=PROMPT_MODEL,
+                  on_text=None, cancel=None):
+    # Igual que improve_prompt, pero llama a on_text(texto_acumulado) con cada fragmento.
+    # cancel: callable o threading.Event; se consulta entre fragmentos.
+    # Una cancelación (o una excepción lanzada desde on_text) cierra el stream HTTP
+    # y el texto parcial no se guarda en caché.
+    t_inicio = time.perf_counter()
+    hit = _cached(cache, command, lib_hash, model, t_inicio)
+    if hit:
+        if on_text:
+            on_text(hit[0])
+        return hit
+
+    system_prompt, stats = _build(index, command)
+    is_cancelled = getattr(cancel, "is_set", cancel) or (lambda: False)
+    partes = []
+    stats["ttft_ms"] = None
+    stats["cancelled"] = False
+    with span("api.generate_content_stream", model=model) as sp:
+        stream = client.models.generate_content_stream(
+            model=model,
+            contents=system_prompt
+        )
+        try:
+            for chunk in stream:
+                if is_cancelled():
+                    stats["cancelled"] = True
+                    break
+                usage = getattr(chunk, "usage_metadata", None)
+                if usage is not None and getattr(usage, "prompt_token_count", None):
+                    stats["prompt_tokens"] = usage.prompt_token_count
+                if not chunk.text:
+                    continue
+                if stats["ttft_ms"] is None:
+                    stats["ttft_ms"] = _elapsed_ms(t_inicio)
+                partes.append(chunk.text)
+                if on_text:
+                    on_text("".join(partes))
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+        texto = "".join(partes).strip()
+        sp.set(tokens=stats.get("prompt_tokens"), bytes=len(texto.encode("utf-8")),
+               ttft_ms=stats["ttft_ms"], cancelled=stats["cancelled"])
+    stats["elapsed_ms"] = _elapsed_ms(t_inicio)
+
+    if texto and cache is not None and not stats["cancelled"]:
+        cache.put(command, lib_hash, model, texto)
+    return texto, stats
@@ -0,0 +1,185 @@
+import hashlib
+import random
+import re
+
+from archviz.prompt_cache import normalize_command
+from archviz.prompt_context import PARAMS
+
+# ==========================================
+# COMPOSITOR LOCAL DE RECETAS (SIN LLM)
+# ==========================================
+# "Architectural / Interior Design Recipe" son fórmulas de campos fijos cuyos
+# valores ya están en la biblioteca. Se componen en local: los valores que el
+# comando ya menciona se fijan y el resto se eligen con una semilla, de modo que
+# el mismo comando y la misma semilla dan siempre la misma receta.
+
+CATEGORIES = {
+    "architectural": ("Architectural", "exteriorArchitecture"),
+    "interior design": ("Interior Design", "interiorDesign"),
+}
+
+# Comandos que necesitan razonar sobre texto libre o imágenes: siempre al LLM
+LLM_ONLY = re.compile(r"\b(?:platform|describe|reference|brainstorm(?:ing)?|inspir(?:ed|ation)|improve\s+edit|change)\s*:"
+                      r"|^\s*inspired\b", re.I)
+HEADER = re.compile(r"^\s*(natural\s+)?(architectural|interior\s+design)(?:\s+(?:recipe|formula))?\s*:?\s*", re.I)
+MULTIPLE = re.compile(r"\bmultiple\s*:\s*(\d+)\s*\.?", re.I)
+NATURALIZE = re.compile(r"\b(?:ugc|naturali[sz]e|more\s+real|less\s+3d)\b", re.I)
+
+# Valores de estética casual/UGC dentro de las listas compartidas
+NATURAL_HINT = re.compile(r"smartphone|polaroid|snapshot|ugc|disposable|candid|amateur|selfie|dashcam|"
+                          r"security camera|pov|flash|uneven|overexposed|fluorescent|mixed temperature", re.I)
+NATURAL_FILTERED = ("imageType", "cameraAngle", "lighting")
+
+# Términos de las fórmulas "Natural ..." que no coinciden por nombre con una lista
+ALIASES = {
+    "candid camera angle": "cameraAngle",
+    "point of view angle": "cameraAngle",
+    "casual photography style": "imageType",
+    "lived-in details": "livedInClutter",
+    "tactile textures": "texturesOrMaterials",
+    "imperfect natural lighting": "lighting",
+    "natural indoor lighting": "lighting",
+    "organic mood": "mood",
+    "everyday/cozy mood": "mood",
+}
+
+# Por si Instructions.json no trae las fórmulas
+DEFAULT_FORMULAS = {
+    "Architectural": "Architectural + Camera Angle + Image Type + Architectural Style + Building Type + Type of Architecture"
+                     " + Architectural Inspiration + Focal Point + Textures or Materials + Details + Color Palette"
+                     " + Lighting + Location + Time of Day + Mood",
+    "Interior Design": "Interior Design + Camera Angle + Image Type + Style + Room Type + Inspiration + Focal Point"
+                       " + Color Palette + Textures or Materials + Brand + Details + Lighting + Location + Time of Day + Mood",
+}
+
+MAX_OPTIONS = 500
+
+
+def _words(key):
+    # "texturesOrMaterials" -> "textures or materials"
+    return re.sub(r"(?<=[a-z])(?=[A-Z])", " ", key).lower()
+
+
+def _term(term):
+    return re.sub(r"\s*\(.*?\)\s*", " ", term).strip()
+
+
+class RecipeComposer:
+    def __init__(self, data):
+        recipes = ((data or {}).get(PARAMS) or {}).get("geminiGemsPromptRecipes") or {}
+        self.shared = recipes.get("sharedParameters") or {}
+        self.categories = {k: recipes.get(section) or {} for k, (_, section) in CATEGORIES.items()}
+        formulas = ((((data or {}).get("Instructions") or {}).get("categories") or {}).get("formulas")) or {}
+        self.formulas = {}
+        for name in ("Architectural", "Interior Design", "Natural Architectural", "Natural Interior Design"):
+            formula = formulas.get(name) or DEFAULT_FORMULAS.get(name)
+            if formula:
+                self.formulas[name] = self._compile(name, formula)
+        # Patrones por lista (del valor más largo al más corto) para fijar los que el comando menciona
+        self._patterns = {}
+
+    def _lists(self, category):
+        listas = {k: v for k, v in self.shared.items() if isinstance(v, list)}
+        listas.update({k: v for k, v in self.categories.get(category, {}).items() if isinstance(v, list)})
+        return listas
+
+    def _compile(self, name, formula):
+        category = "interior design" if "interior" in name.lower() else "architectural"
+        listas = self._lists(category)
+        por_nombre = {_words(k): k for k in listas}
+        por_nombre.update({w.rstrip("s"): k for w, k in list(por_nombre.items())})
+        campos = []
+        for term in formula.split("+")[1:]:
+            label = _term(term)
+            clave = label.lower()
+            key = ALIASES.get(clave) or por_nombre.get(clave) or por_nombre.get(clave.rstrip("s"))
+            if key is None:
+                # "Imperfect Natural Lighting" -> "lighting": el sufijo más largo que sea una lista
+                palabras = clave.split()
+                for i in range(1, len(palabras)):
+                    key = por_nombre.get(" ".join(palabras[i:]))
+                    if key:
+                        break
+            if key in listas:
+                campos.append((label, key))
+        return {"category": category, "fields": campos}
+
+    def parse(self, command):
+        # None si el comando no es una receta que se pueda componer en local
+        if not command or LLM_ONLY.search(command):
+            return None
+        multiple = MULTIPLE.search(command)
+        n = min(int(multiple.group(1)), MAX_OPTIONS) if multiple else 1
+        # "Multiple: 3 Architectural Recipe ..." también es una receta
+        cuerpo = MULTIPLE.sub("", command)
+        m = HEADER.match(cuerpo)
+        if not m:
+            return None
+        category = re.sub(r"\s+", " ", m.group(2).lower())
+        natural = bool(m.group(1)) or bool(NATURALIZE.search(command))
+        subject = cuerpo[m.end():]
+        subject = re.sub(r"\s+", " ", subject).strip(" .,;:")
+        prefix = CATEGORIES[category][0]
+        name = ("Natural " if natural else "") + prefix
+        if name not in self.formulas:
+            return None
+        return {"formula": name, "category": category, "natural": natural, "n": max(1, n), "subject": subject}
+
+    def _pattern(self, category, key, values):
+        if (category, key) not in self._patterns:
+            ordenados = sorted((v for v in values if isinstance(v, str)), key=len, reverse=True)
+            self._patterns[(category, key)] = [
+                (v, re.compile(r"(?<!\w)" + re.escape(v) + r"(?!\w)", re.I)) for v in ordenados]
+        return self._patterns[(category, key)]
+
+    def _pool(self, key, values, natural):
+        if key not in NATURAL_FILTERED:
+            return list(values)
+        casual = [v for v in values if NATURAL_HINT.search(v)]
+        if natural:
+            return casual or list(values)
+        return [v for v in values if v not in casual] or list(values)
+
+    def default_seed(self, command):
+        return int(hashlib.sha256(normalize_command(command).encode("utf-8")).hexdigest()[:8], 16)
+
+    def compose(self, command, seed=None, n=None):
+        # Devuelve una lista de opciones {"prompt", "fields", "seed"}; vacía si no aplica
+        spec = self.parse(command)
+        if spec is None:
+            return []
+        n = min(n or spec["n"], MAX_OPTIONS)
+        seed = self.default_seed(command) if seed is None else seed
+        rng = random.Random(seed)
+        formula = self.formulas[spec["formula"]]
+        listas = self._lists(formula["category"])
+
+        campos = list(formula["fields"])
+        if spec["natural"] and "cameraImperfections" in listas:
+            campos.append(("Camera Imperfections", "cameraImperfections"))
+
+        # Valor fijado por el comando, o una permutación con semilla para repartir
+        # valores distintos entre las opciones antes de repetir
+        elecciones = []
+        for label, key in campos:
+            fijo = next((v for v, pat in self._pattern(formula["category"], key, listas[key]) if pat.search(spec["subject"])), None)
+            if fijo:
+                elecciones.append((label, [fijo]))
+            else:
+                pool = self._pool(key, listas[key], spec["natural"])
+                elecciones.append((label, rng.sample(pool, len(pool))))
+
+        prefix = spec["formula"]
+        opciones = []
+        for i in range(n):
+            fields = {label: valores[i % len(valores)] for label, valores in elecciones}
+            cuerpo = ", ".join(f"{label}: {valor}" for label, valor in fields.items())
+            cabecera = f"{prefix}: {spec['subject']}" if spec["subject"] else prefix
+            opciones.append({"prompt": f"{cabecera}. {cuerpo}.", "fields": fields, "seed": seed})
+        return opciones
+
+
+def format_options(opciones):
+    if len(opciones) == 1:
+        return opciones[0]["prompt"]
+    return "\n\n".join(f"Option {i}: {o['prompt']}" for i, o in enumerate(opciones, 1))
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import random
+import time
+from io import BytesIO
+
+import PIL.Image
+from google.genai import types
+
+from archviz.timing import span
+
+# ==========================================
+# GENERACIÓN (SIN STREAMLIT)
+# ==========================================
+
+# Backoff adaptativo para Veo: primeras consultas rápidas, luego cada vez más espaciadas
+VEO_POLL_INITIAL = 5
+VEO_POLL_FACTOR = 1.5
+VEO_POLL_MAX = 30
+
+
+# Motores de render: nombre visible -> modelo (compartido por app.py y la CLI)
+MODEL_MAP = {
+    "Nano Banana Pro (Gemini 3 Pro Image)": "gemini-3-pro-image-preview",
+    "Nano Banana (Gemini 2.5 Flash Image)": "gemini-2.5-flash-image",
+    "Imagen 4.0 (Generativo)": "imagen-4.0-generate-001",
+    "Veo 3.1 (Video Generativo)": "veo-3.1-generate-preview",
+}
+MODEL_ALIASES = {
+    "nano-pro": "gemini-3-pro-image-preview",
+    "nano": "gemini-2.5-flash-image",
+    "imagen": "imagen-4.0-generate-001",
+    "veo": "veo-3.1-generate-preview",
+}
+
+RENDER_PREFIX = "High quality architectural visualization."
+
+
+def render_prompt(prompt):
+    # Texto exacto que se envía al motor de render
+    return f"{RENDER_PREFIX} {prompt}"
+
+
+# Render progresivo (Nano Banana 4K): boceto rápido en Flash a tamaño por defecto y,
+# solo si se aprueba, el final en Pro a 4K con el boceto como primera referencia
+DRAFT_MODEL = "gemini-2.5-flash-image"
+DRAFT_RES = "1080p"
+FINAL_MODEL = "gemini-3-pro-image-preview"
+FINAL_RES = "4K"
+FINAL_PREFIX = ("The first image is the approved draft of this render: keep its composition, camera angle, "
+                "framing and layout, and render it at final quality.")
+
+
+def final_prompt(prompt_render):
+    return f"{FINAL_PREFIX} {prompt_render}"
+
+
+VEO_MODO_INICIAL = "Frame Inicial (Usa 1ra foto)"
+VEO_MODO_INICIO_FIN = "Inicio y Fin (Usa 1ra y 2da foto)"
+VEO_MODO_ASSETS = "Referencias de Assets (Estilo/Sujeto)"
+VEO_MODOS = [VEO_MODO_INICIAL, VEO_MODO_INICIO_FIN, VEO_MODO_ASSETS]
+VEO_MODO_ALIASES = {"inicial": VEO_MODO_INICIAL, "inicio-fin": VEO_MODO_INICIO_FIN, "assets": VEO_MODO_ASSETS}
+
+
+def render_fingerprint(model, prompt, ref_hashes=(), **config):
+    # Huella de la petición facturable: mismo modelo, prompt, referencias (en orden) y ajustes
+    payload = json.dumps({"model": model, "prompt": prompt, "refs": list(ref_hashes), "config": config},
+                         sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+def veo_ratio_for(ratio, res):
+    # Regla de seguridad: Veo 3 en 4K solo acepta 16:9 nativo.
+    # Forzamos 16:9 si eligió 4K para evitar un 400 INVALID_ARGUMENT
+    return "16:9" if res == "4K" else ratio
+
+
+def build_video_request(model, prompt, ratio, res, veo_modo, refs):
+    # refs: ReferenceImage (archviz.media). Devuelve (kwargs para generate_videos, aviso o None)
+    aviso = None
+    video_kwargs = {
+        "model": model,
+        "prompt": prompt,
+    }
+    video_config = {"aspect_ratio": veo_ratio_for(ratio, res)}
+
+    if res == "4K":
+        video_config["resolution"] = "4k"
+
+    if refs:
+        if veo_modo == VEO_MODO_INICIAL:
+            video_kwargs["image"] = refs[0].as_veo()
+
+        elif veo_modo == VEO_MODO_INICIO_FIN:
+            video_kwargs["image"] = refs[0].as_veo()
+            if len(refs) > 1:
+                video_config["last_frame"] = refs[1].as_veo()
+            else:
+                aviso = "Seleccionaste Inicio y Fin, pero solo marcaste 1 foto. Se usará solo como inicio."
+
+        elif veo_modo == VEO_MODO_ASSETS:
+            video_config["reference_images"] = [
+                types.VideoGenerationReferenceImage(image=r.as_veo(), reference_type="asset")
+                for r in refs
+            ]
+
+    video_kwargs["config"] = types.GenerateVideosConfig(**video_config)
+    return video_kwargs, aviso
+
+
+def poll_operation(client, operation, job=None):
+    with span("veo.poll") as sp:
+        operation = _poll(client, operation, job, sp)
+    return operation
+
+
+def _poll(client, operation, job, sp):
+    delay = VEO_POLL_INITIAL
+    intentos = 0
+    while not operation.done:
+        intentos += 1
+        if job:
+            job.message = f"Procesando video con Veo3... (consulta {intentos}, próxima en {int(delay)}s)"
+        time.sleep(delay)
+        operation = client.operations.get(operation)
+        if job:
+            job.operation = operation
+        delay = min(delay * VEO_POLL_FACTOR, VEO_POLL_MAX)
+    sp.set(polls=intentos)
+    return operation
+
+
+def download_video(client, video, media_store, api_key=None):
+    with span("veo.download") as sp:
+        uri = getattr(video, "uri", None)
+        if uri and api_key and uri.startswith("http"):
+            # Descarga por bloques directa a disco: el MP4 nunca se carga entero en memoria
+            video_path = media_store.download(uri, headers={"x-goog-api-key": api_key})
+        else:
+            # Sin URI descargable (p. ej. bytes ya incluidos): camino del SDK
+            video_path = media_store.new_path()
+            client.files.download(file=video)
+            video.save(video_path)
+            media_store.enforce_retention(keep=(video_path,))
+        sp.set(bytes=os.path.getsize(video_path))
+    return video_path
+
+
+def generate_video(client, video_kwargs, media_store, job=None, api_key=None):
+    with span("api.generate_videos", model=video_kwargs.get("model")):
+        operation = client.models.generate_videos(**video_kwargs)
+    if job:
+        job.operation = operation
+    operation = poll_operation(client, operation, job)
+
+    if getattr(operation, "error", None):
+        raise RuntimeError(operation.error)
+
+    if operation.response and operation.response.generated_videos:
+        if job:
+            job.message = "Descargando el video generado..."
+        generated_video = operation.response.generated_videos[0]
+        return download_video(client, generated_video.video, media_store, api_key)
+    return None
+
+
+# --- REINTENTOS CON BACKOFF (429 / 5xx) ---
+RETRY_ATTEMPTS = 4
+RETRY_BASE = 2.0
+
+
+def is_retryable(error):
+    code = getattr(error, "code", None)
+    return code == 429 or (isinstance(code, int) and 500 <= code < 600)
+
+
+def with_retry(fn, *args, job=None, attempts=RETRY_ATTEMPTS, **kwargs):
+    for intento in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if intento == attempts - 1 or not is_retryable(e):
+                raise
+            delay = RETRY_BASE * (2 ** intento) + random.uniform(0, 1)
+            if job:
+                job.message = f"Reintentando tras error {e.code} en {delay:.0f}s..."
+            time.sleep(delay)
+
+
+# --- IMAGEN 4.0 ---
+def generate_imagen(client, model, prompt, ratio, number_of_images=1):
+    with span("api.generate_images", model=model, images=number_of_images):
+        response = client.models.generate_images(
+            model=model,
+            prompt=prompt,
+            config=types.GenerateImagesConfig(
+                number_of_images=number_of_images,
+                aspect_ratio=ratio
+            )
+        )
+    if response and response.generated_images:
+        with span("decode.generated_images") as sp:
+            imagenes = [g.image._pil_image for g in response.generated_images]
+            sp.set(bytes=sum(len(getattr(g.image, "image_bytes", None) or b"") for g in response.generated_images))
+        return imagenes
+    return []
+
+
+# --- NANO BANANA (FLASH / PRO) ---
+def nano_config(ratio, res):
+    image_cfg_kwargs = {"aspect_ratio": ratio}
+    if res == "4K":
+        image_cfg_kwargs["image_size"] = "4K"
+    return types.GenerateContentConfig(
+        response_modalities=["IMAGE"],
+        image_config=types.ImageConfig(**image_cfg_kwargs)
+    )
+
+
+def generate_nano(client, model, prompt, refs, ratio, res):
+    with span("api.generate_content", model=model, refs=len(refs)) as sp:
+        response = client.models.generate_content(
+            model=model,
+            contents=[prompt] + list(refs),
+            config=nano_config(ratio, res)
+        )
+        sp.set(bytes=sum(len(getattr(r, "inline_data", None) and r.inline_data.data or b"") for r in refs))
+    if response and response.parts:
+        for part in response.parts:
+            if part.inline_data:
+                with span("decode.inline_data", bytes=len(part.inline_data.data)):
+                    img = PIL.Image.open(BytesIO(part.inline_data.data))
+                    img.load()
+                return img
+    return None
+
+
+# --- IMAGEN O NANO BANANA CON REINTENTOS ---
+def render_images(client, model, prompt, refs, ratio, res, variants=1, job=None):
+    if "imagen-" in model:
+        # Imagen devuelve varias variantes en una sola llamada
+        return with_retry(generate_imagen, client, model, prompt, ratio, variants, job=job)
+    img = with_retry(generate_nano, client, model, prompt, refs, ratio, res, job=job)
+    return [img] if img is not None else []
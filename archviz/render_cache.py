@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from archviz.config import DEFAULT_CACHE_DIR
+
+# ==========================================
+# CACHÉ PERSISTENTE DE RESULTADOS DE RENDER
+# ==========================================
+# Huella de la petición -> dónde quedó el resultado (hashes del historial o ruta
+# del video). Solo se guardan referencias: los archivos ya viven en el historial
+# y en la carpeta de medios. Si alguno ya no existe, la entrada se descarta.
+
+
+class RenderCache:
+    def __init__(self, root=None, max_entries=5000):
+        self.root = os.path.join(root or DEFAULT_CACHE_DIR, "renders")
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, fingerprint):
+        return os.path.join(self.root, f"{fingerprint}.json")
+
+    def get(self, fingerprint, is_valid=None):
+        try:
+            with open(self._path(fingerprint), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        if is_valid is not None and not is_valid(record):
+            self.discard(fingerprint)
+            with self._lock:
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return record
+
+    def put(self, fingerprint, record):
+        record = dict(record, created=time.time())
+        tmp = f"{self._path(fingerprint)}.{uuid.uuid4().hex[:6]}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp, self._path(fingerprint))
+        self._prune()
+        return record
+
+    def discard(self, fingerprint):
+        try:
+            os.remove(self._path(fingerprint))
+        except OSError:
+            pass
+
+    def _prune(self):
+        with self._lock:
+            entradas = [e for e in os.scandir(self.root) if e.name.endswith(".json")]
+            if len(entradas) <= self.max_entries:
+                return
+            entradas.sort(key=lambda e: e.stat().st_mtime)
+            for e in entradas[:len(entradas) - self.max_entries]:
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
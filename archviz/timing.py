@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from archviz.config import DEFAULT_CACHE_DIR
+
+# ==========================================
+# TIEMPOS DE ARRANQUE Y RERUN
+# ==========================================
+# RerunTimer mide una ejecución del script por etapas; TimingReport acumula las
+# últimas ejecuciones del proceso para detectar regresiones.
+
+
+class RerunTimer:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t) * 1000
+
+    def total_ms(self):
+        return (time.perf_counter() - self.t0) * 1000
+
+
+def _percentile(values, pct):
+    ordenados = sorted(values)
+    return ordenados[min(len(ordenados) - 1, int(round(pct / 100 * (len(ordenados) - 1))))]
+
+
+class TimingReport:
+    def __init__(self, size=200):
+        self.reruns = deque(maxlen=size)
+        self.first = {}  # (kind, etapa) -> primera vez que se vio en el proceso (arranque en frío)
+        self._lock = threading.Lock()
+
+    def record(self, timer, kind="app"):
+        entry = dict(timer.stages, total=timer.total_ms(), kind=kind, at=time.time())
+        with self._lock:
+            self.reruns.append(entry)
+            for name, ms in entry.items():
+                if name not in ("kind", "at"):
+                    self.first.setdefault((kind, name), ms)
+        return entry
+
+    def summary(self, kind="app"):
+        with self._lock:
+            entries = [e for e in self.reruns if e["kind"] == kind]
+            first = {name: ms for (k, name), ms in self.first.items() if k == kind}
+        if not entries:
+            return []
+        names = ["total"] + sorted({k for e in entries for k in e} - {"total", "kind", "at"})
+        filas = []
+        for name in names:
+            values = [e[name] for e in entries if name in e]
+            filas.append({
+                "stage": name,
+                "last": round(values[-1], 1),
+                "mean": round(sum(values) / len(values), 1),
+                "p95": round(_percentile(values, 95), 1),
+                "first": round(first.get(name, 0.0), 1),
+                "n": len(values),
+            })
+        return filas
+
+
+# ==========================================
+# TRAZAS POR ETAPA (SPANS) + EXPORTACIÓN JSONL
+# ==========================================
+# Desactivado, span() devuelve un objeto nulo compartido: el coste es una llamada.
+# Activado, cada span guarda duración y atributos (bytes, tokens...) en memoria y,
+# si hay archivo, se añade como una línea JSON (solo append).
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            "name": self.name,
+            "ms": round((time.perf_counter() - self.t0) * 1000, 3),
+            "ts": round(self.ts, 3),
+            "thread": threading.current_thread().name,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if self.attrs:
+            record["attrs"] = self.attrs
+        self.tracer.emit(record)
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled=False, path=None, size=2000):
+        self.enabled = enabled
+        self.path = path
+        self.spans = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=None, path=None):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if path is not None:
+                self.path = path or None
+
+    def emit(self, record):
+        with self._lock:
+            self.spans.append(record)
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def summary(self):
+        with self._lock:
+            spans = list(self.spans)
+        grupos = {}
+        for s in spans:
+            grupos.setdefault(s["name"], []).append(s)
+        filas = []
+        for name, items in sorted(grupos.items()):
+            tiempos = [s["ms"] for s in items]
+            filas.append({
+                "span": name,
+                "n": len(items),
+                "mean": round(sum(tiempos) / len(tiempos), 1),
+                "p95": round(_percentile(tiempos, 95), 1),
+                "max": round(max(tiempos), 1),
+                "bytes": sum(s.get("attrs", {}).get("bytes", 0) for s in items),
+                "tokens": sum(s.get("attrs", {}).get("tokens", 0) or 0 for s in items),
+                "errors": sum(1 for s in items if "error" in s),
+            })
+        return filas
+
+
+def default_trace_path():
+    # Exportación desde la interfaz: siempre bajo la caché, un archivo por día
+    return os.path.join(DEFAULT_CACHE_DIR, "traces", f"trace-{time.strftime('%Y%m%d')}.jsonl")
+
+
+# Estado del proceso (todas las sesiones): ARCHVIZ_TRACE / ARCHVIZ_TRACE_FILE al
+# arrancar, o los botones del panel de diagnóstico
+tracer = Tracer(
+    enabled=os.environ.get("ARCHVIZ_TRACE", "") not in ("", "0"),
+    path=os.environ.get("ARCHVIZ_TRACE_FILE") or None,
+)
+
+
+def span(name, **attrs):
+    if not tracer.enabled:
+        return _NULL_SPAN
+    return _Span(tracer, name, attrs)
@@ -0,0 +1,160 @@
+import math
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import PIL.Image
+
+from archviz.config import DEFAULT_CACHE_DIR
+from archviz.media_store import MediaStore
+from archviz.timing import span
+
+# ==========================================
+# MOTOR DE REESCALADO POR BANDAS
+# ==========================================
+# La imagen se divide en bandas horizontales con solape suficiente para el kernel
+# LANCZOS; cada banda se reescala en paralelo y se vuelven a unir. El resultado es
+# idéntico al reescalado de la imagen completa.
+
+UPSCALE_TARGETS = {
+    "4K": 3840,
+    "6K": 6144,
+    "8K": 7680,
+}
+LANCZOS_SUPPORT = 3.0
+UPSCALE_MAX_GB = 5
+UPSCALE_MAX_DAYS = 7
+
+
+# Implementación original (referencia para benchmarks)
+def upscale_image(image, target_width=3840):
+    w_percent = (target_width / float(image.size[0]))
+    h_size = int((float(image.size[1]) * float(w_percent)))
+    img_resized = image.resize((target_width, h_size), PIL.Image.Resampling.LANCZOS)
+    return img_resized
+
+
+def _resize_band(args):
+    mode, size, data, box, out_size = args
+    band = PIL.Image.frombytes(mode, size, data)
+    return band.resize(out_size, PIL.Image.Resampling.LANCZOS, box=box).tobytes()
+
+
+def plan_bands(src_size, out_size, bands):
+    w, h = src_size
+    out_w, out_h = out_size
+    scale = h / out_h  # píxeles de origen por píxel de salida
+    margin = math.ceil(LANCZOS_SUPPORT * max(1.0, scale)) + 1
+    bounds = [round(i * out_h / bands) for i in range(bands + 1)]
+
+    plan = []
+    for oy0, oy1 in zip(bounds, bounds[1:]):
+        if oy1 <= oy0:
+            continue
+        sy0, sy1 = oy0 * scale, oy1 * scale
+        cy0 = max(0, math.floor(sy0) - margin)
+        cy1 = min(h, math.ceil(sy1) + margin)
+        plan.append(((0, cy0, w, cy1), (0, sy0 - cy0, w, sy1 - cy0), (out_w, oy1 - oy0), oy0))
+    return plan
+
+
+def upscale_tiled(image, target_width=3840, executor=None, bands=None):
+    w, h = image.size
+    out_size = (target_width, int(h * (target_width / float(w))))
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+
+    bands = bands or max(1, (os.cpu_count() or 1) * 2)
+    plan = plan_bands(image.size, out_size, bands)
+    tasks = []
+    for crop, box, band_size, _ in plan:
+        band = image.crop(crop)
+        tasks.append((band.mode, band.size, band.tobytes(), box, band_size))
+
+    results = executor.map(_resize_band, tasks) if executor else map(_resize_band, tasks)
+
+    out = PIL.Image.new(image.mode, out_size)
+    for (_, _, band_size, oy0), data in zip(plan, results):
+        out.paste(PIL.Image.frombytes(image.mode, band_size, data), (0, oy0))
+    return out
+
+
+def encode_png(image, fast=False):
+    buf = BytesIO()
+    if fast:
+        # Compresión mínima: archivos algo mayores, codificación varias veces más rápida
+        image.save(buf, format="PNG", compress_level=1)
+    else:
+        image.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def make_executor(kind="process", workers=None):
+    workers = workers or os.cpu_count() or 1
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="archviz-upscale")
+    # "spawn": el servidor de Streamlit tiene hilos activos y fork no es seguro
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class UpscaleEngine:
+    # Resultados memoizados en disco por hash de origen + destino + modo de codificación,
+    # con retención por antigüedad y tamaño (un PNG 8K ocupa decenas de MB)
+    def __init__(self, root=None, executor_kind=None, workers=None,
+                 max_bytes=UPSCALE_MAX_GB * 1024 ** 3, max_age_days=UPSCALE_MAX_DAYS):
+        self.root = os.path.join(root or DEFAULT_CACHE_DIR, "upscale")
+        self.files = MediaStore(self.root, max_bytes=max_bytes, max_age_days=max_age_days)
+        self.executor_kind = executor_kind or os.environ.get("ARCHVIZ_UPSCALE_EXECUTOR", "thread")
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = make_executor(self.executor_kind, self.workers)
+            return self._executor
+
+    def path(self, digest, target, fast=False):
+        return os.path.join(self.root, f"{digest}_{target}{'_fast' if fast else ''}.png")
+
+    def cached(self, digest, target, fast=False):
+        path = self.path(digest, target, fast)
+        return path if os.path.exists(path) else None
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def run(self, digest, load_image, target, fast=False, job=None):
+        path = self.path(digest, target, fast)
+        if os.path.exists(path):
+            return path
+        if job:
+            job.message = f"Reescalando a {target} por bandas..."
+        with span("upscale.resize", target=target, executor=self.executor_kind):
+            img = upscale_tiled(load_image(), UPSCALE_TARGETS[target], self._get_executor())
+        if job:
+            job.message = "Codificando PNG..."
+        with span("upscale.encode", fast=fast) as sp:
+            data = encode_png(img, fast)
+            sp.set(bytes=len(data))
+        tmp = f"{path}.{uuid.uuid4().hex[:6]}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.files.enforce_retention(keep=(path,))
+        return path
+
+    def submit(self, registry, digest, load_image, target, fast=False, owner=None):
+        # Un mismo reescalado pedido dos veces reutiliza el trabajo en curso
+        return registry.submit(
+            lambda job: self.run(digest, load_image, target, fast, job),
+            kind="upscale",
+            label=f"Reescalado {target}",
+            owner=owner,
+            key=("upscale", digest, target, fast),
+        )
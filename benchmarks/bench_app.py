@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Cachés y videos del benchmark en un directorio temporal (antes de importar archviz)
+_TMP = tempfile.mkdtemp(prefix="archviz-bench-")
+os.environ.setdefault("ARCHVIZ_CACHE_DIR", os.path.join(_TMP, "cache"))
+os.environ.setdefault("ARCHVIZ_MEDIA_DIR", os.path.join(_TMP, "videos"))
+
+import PIL.Image  # noqa: E402
+
+import fake_genai  # noqa: E402
+from archviz import render  # noqa: E402
+from archviz.history import HistoryStore  # noqa: E402
+from archviz.media import ReferenceStore  # noqa: E402
+from archviz.memory import MemoryBudget, image_nbytes  # noqa: E402
+from archviz.media_store import MediaStore  # noqa: E402
+from archviz.library import JsonLibrary  # noqa: E402
+from archviz.prompt_cache import PromptCache  # noqa: E402
+from archviz.prompt_context import PromptContextIndex  # noqa: E402
+from archviz.prompt_engine import build_system_prompt, improve_prompt, stream_prompt  # noqa: E402
+from archviz.recipes import RecipeComposer  # noqa: E402
+from archviz.upscale import encode_png, upscale_image, upscale_tiled  # noqa: E402
+
+# ==========================================
+# BENCHMARK OFFLINE DE LA APP (SIN LLAMADAS A LA API)
+# ==========================================
+# Uso: python benchmarks/bench_app.py --image-latency 2 --image-size 2816x1536 --renders 10 --json out.json
+# Mide construcción de prompts, codificación/decodificación, reescalado, renders contra
+# el cliente falso y una sesión completa de app.py (latencia de rerun y memoria).
+
+COMMANDS = [
+    "Architectural Recipe: brutalist museum by Tadao Ando at dusk",
+    "Interior Design Recipe: cozy scandinavian kitchen, Multiple: 3",
+    "Improve edit: foto de una sala, Remove RED marked shapes",
+    "Improve: a glass house in the forest. Platform: Midjourney",
+]
+
+
+def ms(t):
+    return round(t * 1000, 2)
+
+
+def cronometrar(fn, repeticiones=5):
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn()
+        tiempos.append(time.perf_counter() - t0)
+    return {"min_ms": ms(min(tiempos)), "mean_ms": ms(statistics.mean(tiempos))}, resultado
+
+
+def bench_prompt(client, repeat):
+    res = {}
+    library = JsonLibrary(os.path.join(ROOT, "data"))
+    res["library_load"], _ = cronometrar(lambda: JsonLibrary(library.folder).reload(), repeat)
+    library.reload()
+    res["library_reload_unchanged"], _ = cronometrar(library.reload, repeat)
+    data, lib_hash, _ = library.snapshot()
+    res["index_build"], index = cronometrar(lambda: PromptContextIndex(data), repeat)
+    res["prompt_build"], _ = cronometrar(
+        lambda: [build_system_prompt(index.build_context(c)[0], c) for c in COMMANDS], repeat)
+    res["prompt_build"]["per_command_ms"] = round(res["prompt_build"]["mean_ms"] / len(COMMANDS), 3)
+
+    cache = PromptCache()
+    cache.clear()
+    t0 = time.perf_counter()
+    improve_prompt(client, index, COMMANDS[0], lib_hash, cache)
+    res["improve_miss_ms"] = ms(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    improve_prompt(client, index, COMMANDS[0], lib_hash, cache)
+    res["improve_hit_ms"] = ms(time.perf_counter() - t0)
+    # Receta local: sin llamada al modelo
+    composer = RecipeComposer(data)
+    composer.compose(COMMANDS[0])
+    res["recipe_compose"], _ = cronometrar(lambda: composer.compose(COMMANDS[0], seed=1), repeat)
+    res["recipe_multiple_100"], _ = cronometrar(lambda: composer.compose(COMMANDS[0], seed=1, n=100), repeat)
+    # Streaming sin caché: lo que percibe el usuario es el primer token, no la respuesta completa
+    _, stats = stream_prompt(client, index, COMMANDS[1], lib_hash)
+    res["stream_ttft_ms"] = stats["ttft_ms"]
+    res["stream_total_ms"] = stats["elapsed_ms"]
+    return res
+
+
+def bench_media(cfg, repeat):
+    res = {}
+    phone = PIL.Image.effect_noise((4000, 3000), 32).convert("RGB")
+    buf = BytesIO()
+    phone.save(buf, format="JPEG", quality=95)
+    raw = buf.getvalue()
+    res["reference_bytes_mb"] = round(len(raw) / 1e6, 2)
+
+    def ingest_fresh():
+        return ReferenceStore().ingest_bytes(raw)
+
+    res["reference_ingest"], ref = cronometrar(ingest_fresh, repeat)
+    res["reference_encode_veo"], _ = cronometrar(ref.as_veo, 1)
+    res["reference_encode_cached"], _ = cronometrar(ref.as_veo, repeat)
+    # Peso por rerun de las galerías: miniatura frente a la imagen completa
+    res["reference_thumb_kb"] = round(len(ref.thumbnail()) / 1e3, 1)
+    res["reference_full_kb"] = round(len(ref.encoded("nano")[0]) / 1e3, 1)
+
+    # Presupuesto lleno: cada acceso alterna dos referencias entre RAM y disco
+    budget = MemoryBudget(max_bytes=image_nbytes(ref.image) + 1)
+    store = ReferenceStore(budget)
+    pareja = [store.ingest_bytes(raw), store.ingest_image(PIL.Image.effect_noise(ref.size, 8).convert("RGB"))]
+    turno = iter(range(10 ** 6))
+    res["reference_rehydrate"], _ = cronometrar(lambda: pareja[next(turno) % 2].image, repeat)
+    res["budget"] = {k: v for k, v in budget.usage().items() if k != "sessions"}
+
+    png = fake_genai.fake_png(cfg.image_size)
+    res["decode_inline_png"], img = cronometrar(lambda: PIL.Image.open(BytesIO(png)).convert("RGB"), repeat)
+    # Imágenes distintas: el historial deduplica por contenido y no volvería a codificar
+    history = HistoryStore()
+    imagenes = iter([PIL.Image.effect_noise(cfg.image_size, 16).convert("RGB") for _ in range(repeat)])
+    res["history_add_png"], registro = cronometrar(lambda: history.add_image(next(imagenes), "bench"), repeat)
+    res["history_thumb_kb"] = round(len(history.thumbnail(registro["hash"])) / 1e3, 1)
+    res["history_full_kb"] = round(os.path.getsize(history.path(registro["hash"])) / 1e3, 1)
+    return res
+
+
+def bench_upscale(cfg, repeat):
+    img = PIL.Image.open(BytesIO(fake_genai.fake_png(cfg.image_size))).convert("RGB")
+    res = {}
+    res["upscale_image_4k"], big = cronometrar(lambda: upscale_image(img, 3840), repeat)
+    res["upscale_tiled_4k"], _ = cronometrar(lambda: upscale_tiled(img, 3840), repeat)
+    res["encode_png_fast_4k"], _ = cronometrar(lambda: encode_png(big, fast=True), 1)
+    return res
+
+
+def bench_render(client, cfg):
+    res = {}
+    t0 = time.perf_counter()
+    render.render_images(client, "imagen-4.0-generate-001", "bench", [], "16:9", "1080p", 2)
+    res["imagen_2_variants_ms"] = ms(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    render.render_images(client, "gemini-2.5-flash-image", "bench", [], "16:9", "1080p", 1)
+    res["nano_banana_ms"] = ms(time.perf_counter() - t0)
+
+    store = MediaStore(os.environ["ARCHVIZ_MEDIA_DIR"])
+    kwargs, _ = render.build_video_request("veo-3.1-generate-preview", "bench", "16:9", "1080p", render.VEO_MODOS[0], [])
+    t0 = time.perf_counter()
+    path = render.generate_video(client, kwargs, store)
+    res["veo_total_ms"] = ms(time.perf_counter() - t0)
+    res["veo_file_mb"] = round(os.path.getsize(path) / 1e6, 2)
+    return res
+
+
+def rss_mb():
+    # RSS actual (Linux); en otros sistemas, el pico del proceso
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_session(cfg, renders):
+    # Sesión completa de app.py con AppTest: latencia de rerun según crece el historial
+    from streamlit.testing.v1 import AppTest
+
+    fake_genai.install(cfg)
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.secrets["PASSWORD_ACCESO"] = "bench"
+    at.secrets["GOOGLE_API_KEY"] = "bench"
+    at.session_state["authenticated"] = True
+    at.session_state["prompt_final"] = "bench house"
+
+    rss_inicio = rss_mb()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    at.run()
+    res = {"first_run_ms": ms(time.perf_counter() - t0), "reruns": []}
+
+    for n in range(1, renders + 1):
+        at.selectbox[0].select("Nano Banana (Gemini 2.5 Flash Image)")
+        [b for b in at.button if "Renderizar" in b.label][0].click()
+        at.run()
+        # Rerun "en frío" de interacción: re-ejecuta todo con el historial actual
+        t0 = time.perf_counter()
+        at.run()
+        # Lo que cuesta un rerun parcial: solo la zona del widget tocado (AppTest siempre ejecuta todo)
+        res["reruns"].append({"history": len(at.session_state["historial"]), "rerun_ms": ms(time.perf_counter() - t0),
+                              "fragments_ms": dict(at.session_state["tiempos_fragmento"])})
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    res["python_peak_mb"] = round(peak / 1e6, 2)
+    res["rss_growth_mb"] = round(rss_mb() - rss_inicio, 2)
+    res["exceptions"] = [e.value for e in at.exception]
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline de Ultimate Archviz Generator")
+    parser.add_argument("--text-latency", type=float, default=0.5)
+    parser.add_argument("--image-latency", type=float, default=0.2)
+    parser.add_argument("--video-latency", type=float, default=1.0)
+    parser.add_argument("--image-size", default="1408x768")
+    parser.add_argument("--video-mb", type=float, default=8)
+    parser.add_argument("--renders", type=int, default=5, help="Renders por sesión simulada")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip", default="", help="Secciones a omitir (prompt,media,upscale,render,session)")
+    parser.add_argument("--json", help="Escribe los resultados en este archivo")
+    args = parser.parse_args()
+
+    cfg = fake_genai.FakeConfig(
+        text_latency=args.text_latency, image_latency=args.image_latency, video_latency=args.video_latency,
+        image_size=tuple(int(v) for v in args.image_size.split("x")), video_mb=args.video_mb)
+    client = fake_genai.FakeClient(cfg)
+    render.VEO_POLL_INITIAL = min(render.VEO_POLL_INITIAL, max(0.05, args.video_latency / 4))
+
+    secciones = {
+        "prompt": lambda: bench_prompt(client, args.repeat),
+        "media": lambda: bench_media(cfg, args.repeat),
+        "upscale": lambda: bench_upscale(cfg, args.repeat),
+        "render": lambda: bench_render(client, cfg),
+        "session": lambda: bench_session(cfg, args.renders),
+    }
+    omitir = set(filter(None, args.skip.split(",")))
+    resultados = {"config": vars(cfg), "cpus": os.cpu_count()}
+    for nombre, fn in secciones.items():
+        if nombre in omitir:
+            continue
+        print(f"== {nombre} ==", flush=True)
+        resultados[nombre] = fn()
+        print(json.dumps(resultados[nombre], indent=2, ensure_ascii=False), flush=True)
+
+    resultados["api_calls"] = client.calls
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
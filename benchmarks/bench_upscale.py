@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+
+import PIL.Image
+import PIL.ImageChops
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archviz.upscale import UPSCALE_TARGETS, encode_png, make_executor, upscale_image, upscale_tiled
+
+# ==========================================
+# BENCHMARK: upscale_image original vs. motor por bandas
+# ==========================================
+
+
+def medir(fn, repeticiones):
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn()
+        tiempos.append(time.perf_counter() - t0)
+    return min(tiempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del reescalado 4K/6K/8K")
+    parser.add_argument("--size", default="1408x768", help="Tamaño de la imagen de origen (AxB)")
+    parser.add_argument("--targets", default="4K,8K")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    w, h = (int(v) for v in args.size.split("x"))
+    src = PIL.Image.effect_noise((w, h), 40).convert("RGB")
+    print(f"Origen {w}x{h} | CPUs: {os.cpu_count()}")
+
+    ejecutores = {"thread": make_executor("thread", args.workers), "process": make_executor("process", args.workers)}
+    ejecutores["process"].submit(int).result()  # arranque del pool fuera de la medición
+
+    for target in args.targets.split(","):
+        width = UPSCALE_TARGETS[target]
+        t_ref, ref = medir(lambda: upscale_image(src, width), args.repeat)
+        print(f"\n[{target}] upscale_image original: {t_ref * 1000:.0f} ms")
+        for nombre, ex in ejecutores.items():
+            t, out = medir(lambda: upscale_tiled(src, width, ex), args.repeat)
+            dif = max(hi for _, hi in PIL.ImageChops.difference(out, ref).getextrema())
+            print(f"[{target}] upscale_tiled ({nombre}): {t * 1000:.0f} ms  x{t_ref / t:.2f}  dif. máx={dif}")
+
+        t_opt, png_opt = medir(lambda: encode_png(ref, fast=False), 1)
+        t_fast, png_fast = medir(lambda: encode_png(ref, fast=True), 1)
+        print(f"[{target}] PNG optimize=True: {t_opt * 1000:.0f} ms ({len(png_opt) / 1e6:.1f} MB)")
+        print(f"[{target}] PNG rápido:        {t_fast * 1000:.0f} ms ({len(png_fast) / 1e6:.1f} MB)")
+
+    for ex in ejecutores.values():
+        ex.shutdown()
+
+
+if __name__ == "__main__":
+    main()
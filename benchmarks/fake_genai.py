@@ -0,0 +1,136 @@
+import itertools
+import threading
+import time
+from io import BytesIO
+
+import PIL.Image
+from google import genai
+from google.genai import types
+
+# ==========================================
+# CLIENTE GENAI LOCAL PARA BENCHMARKS
+# ==========================================
+# Sustituto de genai.Client con la misma forma de respuesta (tipos reales del SDK),
+# latencia y tamaños configurables. No hace llamadas de red ni gasta cuota.
+
+
+class FakeConfig:
+    def __init__(self, text_latency=0.5, image_latency=2.0, video_latency=5.0,
+                 image_size=(1408, 768), video_mb=8, text_words=120, stream_chunks=20):
+        self.text_latency = text_latency
+        self.image_latency = image_latency
+        self.video_latency = video_latency
+        self.image_size = tuple(image_size)
+        self.video_mb = video_mb
+        self.text_words = text_words
+        self.stream_chunks = stream_chunks
+
+
+_png_cache = {}
+_png_lock = threading.Lock()
+
+
+def fake_png(size):
+    # Ruido + degradado: se comprime como un render real, no como un color plano
+    with _png_lock:
+        if size not in _png_cache:
+            noise = PIL.Image.effect_noise(size, 24).convert("RGB")
+            grad = PIL.Image.linear_gradient("L").resize(size).convert("RGB")
+            buf = BytesIO()
+            PIL.Image.blend(noise, grad, 0.6).save(buf, format="PNG")
+            _png_cache[size] = buf.getvalue()
+        return _png_cache[size]
+
+
+def _text(words):
+    vocab = ["architectural", "visualization", "concrete", "golden", "hour", "minimalist",
+             "facade", "glass", "eye-level", "serene", "timber", "courtyard"]
+    return " ".join(itertools.islice(itertools.cycle(vocab), words))
+
+
+class _Models:
+    def __init__(self, client):
+        self.client = client
+
+    def generate_content(self, model, contents, config=None):
+        cfg = self.client.config
+        self.client.calls["generate_content"] += 1
+        if config is not None and "IMAGE" in (getattr(config, "response_modalities", None) or []):
+            time.sleep(cfg.image_latency)
+            part = types.Part(inline_data=types.Blob(data=fake_png(cfg.image_size), mime_type="image/png"))
+        else:
+            time.sleep(cfg.text_latency)
+            part = types.Part(text=_text(cfg.text_words))
+        prompt_tokens = len(str(contents)) // 4
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=prompt_tokens),
+        )
+
+    def generate_content_stream(self, model, contents, config=None):
+        cfg = self.client.config
+        self.client.calls["generate_content_stream"] += 1
+        words = _text(cfg.text_words).split(" ")
+        n = max(1, cfg.stream_chunks)
+        paso = max(1, len(words) // n)
+        for i in range(0, len(words), paso):
+            time.sleep(cfg.text_latency / n)
+            chunk = " ".join(words[i:i + paso]) + " "
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=chunk)]))])
+
+    def generate_images(self, model, prompt, config=None):
+        cfg = self.client.config
+        self.client.calls["generate_images"] += 1
+        time.sleep(cfg.image_latency)
+        n = getattr(config, "number_of_images", None) or 1
+        return types.GenerateImagesResponse(generated_images=[
+            types.GeneratedImage(image=types.Image(image_bytes=fake_png(cfg.image_size), mime_type="image/png"))
+            for _ in range(n)
+        ])
+
+    def generate_videos(self, model, prompt=None, image=None, config=None, **kwargs):
+        self.client.calls["generate_videos"] += 1
+        name = f"operations/fake-{time.time_ns()}"
+        self.client._operations[name] = time.time() + self.client.config.video_latency
+        return types.GenerateVideosOperation(name=name, done=False)
+
+
+class _Operations:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, operation):
+        self.client.calls["operations.get"] += 1
+        listo = time.time() >= self.client._operations.get(operation.name, 0)
+        if not listo:
+            return types.GenerateVideosOperation(name=operation.name, done=False)
+        video = types.Video(video_bytes=b"\0" * int(self.client.config.video_mb * 1024 * 1024), mime_type="video/mp4")
+        return types.GenerateVideosOperation(
+            name=operation.name, done=True,
+            response=types.GenerateVideosResponse(generated_videos=[types.GeneratedVideo(video=video)]))
+
+
+class _Files:
+    def __init__(self, client):
+        self.client = client
+
+    def download(self, file=None, **kwargs):
+        self.client.calls["files.download"] += 1
+        return file.video_bytes
+
+
+class FakeClient:
+    def __init__(self, config=None, **kwargs):
+        self.config = config or FakeConfig()
+        self.calls = {k: 0 for k in ("generate_content", "generate_content_stream", "generate_images",
+                                     "generate_videos", "operations.get", "files.download")}
+        self._operations = {}
+        self.models = _Models(self)
+        self.operations = _Operations(self)
+        self.files = _Files(self)
+
+
+def install(config=None):
+    # Sustituye genai.Client en el proceso (para ejecutar app.py con AppTest)
+    genai.Client = lambda *args, **kwargs: FakeClient(config)
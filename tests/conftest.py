@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Cachés de los tests en un directorio temporal (antes de importar archviz)
+_TMP = tempfile.mkdtemp(prefix="archviz-tests-")
+os.environ.setdefault("ARCHVIZ_CACHE_DIR", os.path.join(_TMP, "cache"))
+os.environ.setdefault("ARCHVIZ_MEDIA_DIR", os.path.join(_TMP, "videos"))
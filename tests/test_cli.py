@@ -0,0 +1,154 @@
+import json
+import os
+import time
+
+import pytest
+from google.genai import types
+
+import fake_genai
+from archviz import cli, render
+from archviz.cli import RESULTS_FILE, BatchRunner, load_checkpoint, read_manifest
+from archviz.jobs import DONE, ERROR
+from archviz.library import JsonLibrary
+
+
+@pytest.fixture(autouse=True)
+def poll_rapido(monkeypatch):
+    monkeypatch.setattr(render, "VEO_POLL_INITIAL", 0.02)
+    monkeypatch.setattr(render, "VEO_POLL_MAX", 0.05)
+
+
+def fake_client(**kwargs):
+    config = dict(text_latency=0, image_latency=0, video_latency=0, image_size=(64, 36), video_mb=0.01)
+    config.update(kwargs)
+    return fake_genai.FakeClient(fake_genai.FakeConfig(**config))
+
+
+def runner(tmp_path, client, **kwargs):
+    return BatchRunner(client, str(tmp_path), JsonLibrary(str(tmp_path / "data")), log=lambda *a: None, **kwargs)
+
+
+def resultados(tmp_path):
+    with open(tmp_path / RESULTS_FILE, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f]
+
+
+def escribir(path, texto):
+    path.write_text(texto, encoding="utf-8")
+    return str(path)
+
+
+# --- MANIFIESTO ---
+def test_read_manifest_jsonl_asigna_ids(tmp_path):
+    path = escribir(tmp_path / "m.jsonl", '{"prompt": "a"}\n\n{"id": "x", "prompt": "b"}\n')
+    assert [(i["id"], i["prompt"]) for i in read_manifest(path)] == [("1", "a"), ("x", "b")]
+
+
+def test_read_manifest_csv_refs_y_vacios(tmp_path):
+    path = escribir(tmp_path / "m.csv", "id,prompt,refs,ratio\nr1,casa,a.png; b.png,\n")
+    (item,) = read_manifest(path)
+    assert item["refs"] == ["a.png", "b.png"]
+    assert "ratio" not in item
+
+
+def test_read_manifest_rechaza_ids_repetidos(tmp_path):
+    path = escribir(tmp_path / "m.jsonl", '{"id": 1, "prompt": "a"}\n{"id": "1", "prompt": "b"}\n')
+    with pytest.raises(ValueError):
+        read_manifest(path)
+
+
+# --- PUNTO DE CONTROL ---
+def test_load_checkpoint_ultima_linea_manda(tmp_path):
+    escribir(tmp_path / RESULTS_FILE, "\n".join([
+        json.dumps({"id": "a", "status": ERROR}),
+        json.dumps({"id": "a", "status": DONE}),
+        json.dumps({"id": "b", "status": DONE}),
+        json.dumps({"id": "b", "status": ERROR}),
+        '{"id": "c", "stat',  # línea truncada por una interrupción
+    ]))
+    assert load_checkpoint(str(tmp_path)) == {"a"}
+
+
+def test_load_checkpoint_sin_archivo(tmp_path):
+    assert load_checkpoint(str(tmp_path)) == set()
+
+
+# --- EJECUCIÓN ---
+def test_run_escribe_imagenes_y_reanuda(tmp_path):
+    items = [{"id": "a", "prompt": "casa", "model": "nano"}, {"id": "b", "prompt": "museo", "model": "imagen", "variants": 2}]
+    resumen = runner(tmp_path, fake_client()).run(items)
+    assert resumen == {"done": 2, "error": 0, "skipped": 0}
+    filas = {r["id"]: r for r in resultados(tmp_path)}
+    assert len(filas["b"]["outputs"]) == 2
+    assert all(os.path.exists(p) for r in filas.values() for p in r["outputs"])
+
+    client = fake_client()
+    resumen = runner(tmp_path, client).run(items, load_checkpoint(str(tmp_path)))
+    assert resumen == {"done": 0, "error": 0, "skipped": 2}
+    assert client.calls["generate_content"] == client.calls["generate_images"] == 0
+
+
+def test_run_video_vacio_es_error_y_no_corta_el_lote(tmp_path, monkeypatch):
+    # Operación terminada sin videos (p. ej. filtro de seguridad)
+    monkeypatch.setattr(fake_genai._Operations, "get", lambda self, op: types.GenerateVideosOperation(
+        name=op.name, done=True, response=types.GenerateVideosResponse(generated_videos=[])))
+    items = [{"id": "v", "prompt": "vuelo", "model": "veo"}, {"id": "n", "prompt": "casa", "model": "nano"}]
+    resumen = runner(tmp_path, fake_client()).run(items)
+    assert resumen == {"done": 1, "error": 1, "skipped": 0}
+    filas = {r["id"]: r for r in resultados(tmp_path)}
+    assert filas["v"]["status"] == ERROR and "outputs" not in filas["v"]
+    assert filas["n"]["status"] == DONE
+    assert load_checkpoint(str(tmp_path)) == {"n"}
+
+
+def test_run_imagen_vacia_es_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(fake_genai._Models, "generate_images",
+                        lambda self, model, prompt, config=None: types.GenerateImagesResponse(generated_images=[]))
+    resumen = runner(tmp_path, fake_client()).run([{"id": "i", "prompt": "casa", "model": "imagen"}])
+    assert resumen["error"] == 1
+    assert resultados(tmp_path)[0]["status"] == ERROR
+
+
+def test_run_fila_invalida_no_corta_el_lote(tmp_path):
+    items = [{"id": "x", "prompt": "casa", "model": "nope"}, {"id": "y"}, {"id": "z", "prompt": "casa", "model": "nano"}]
+    resumen = runner(tmp_path, fake_client()).run(items)
+    assert resumen == {"done": 1, "error": 2, "skipped": 0}
+
+
+def test_run_escribe_cada_fila_al_terminar(tmp_path):
+    # El video lento va primero en el manifiesto: la imagen no debe esperarle
+    client = fake_client(video_latency=0.5)
+    items = [{"id": "v", "prompt": "vuelo", "model": "veo"}, {"id": "n", "prompt": "casa", "model": "nano"}]
+    runner(tmp_path, client).run(items)
+    assert [r["id"] for r in resultados(tmp_path)] == ["n", "v"]
+
+
+def test_run_prompts_en_paralelo_en_el_pool(tmp_path):
+    # Filas con 'command' por el LLM: el prompt se construye en los hilos del registro
+    client = fake_client(text_latency=0.3)
+    items = [{"id": str(i), "command": f"casa {i}", "model": "nano"} for i in range(4)]
+    t0 = time.monotonic()
+    resumen = runner(tmp_path, client, llm_recipes=True).run(items)
+    assert resumen == {"done": 4, "error": 0, "skipped": 0}
+    assert time.monotonic() - t0 < 0.9
+    assert {r["prompt_source"] for r in resultados(tmp_path)} == {"llm"}
+
+
+def test_interrupcion_al_enviar_conserva_lo_terminado(tmp_path, monkeypatch):
+    # Ctrl+C mientras aún se envían filas: la que ya terminó queda en results.jsonl
+    real = cli.resolve_model
+
+    def resolve(name):
+        if name == "stop":
+            fin = time.monotonic() + 5
+            while not (tmp_path / RESULTS_FILE).exists() and time.monotonic() < fin:
+                time.sleep(0.01)
+            raise KeyboardInterrupt
+        return real(name)
+
+    monkeypatch.setattr(cli, "resolve_model", resolve)
+    items = [{"id": "a", "prompt": "casa", "model": "nano"}, {"id": "b", "prompt": "casa", "model": "stop"},
+             {"id": "c", "prompt": "museo", "model": "nano"}]
+    with pytest.raises(KeyboardInterrupt):
+        runner(tmp_path, fake_client()).run(items)
+    assert load_checkpoint(str(tmp_path)) == {"a"}
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from archviz.jobs import CANCELLED, DONE, ERROR, JobRegistry
+
+
+def test_videos_en_cola_no_bloquean_imagenes():
+    registry = JobRegistry(limits={"video": 2, "image": 4, "upscale": 1})
+    soltar = threading.Event()
+    videos = [registry.submit(lambda job: soltar.wait(5), kind="video", label=f"v{i}") for i in range(8)]
+    t0 = time.monotonic()
+    imagen = registry.submit(lambda job: "ok", kind="image", label="img")
+    imagen.future.result(timeout=2)
+    assert imagen.status == DONE and time.monotonic() - t0 < 1
+    soltar.set()
+    for job in videos:
+        job.future.result(timeout=5)
+
+
+def test_limite_por_tipo():
+    registry = JobRegistry(limits={"video": 2})
+    lock = threading.Lock()
+    en_curso = []
+    maximo = []
+
+    def trabajo(job):
+        with lock:
+            en_curso.append(job.id)
+            maximo.append(len(en_curso))
+        time.sleep(0.05)
+        with lock:
+            en_curso.remove(job.id)
+
+    jobs = [registry.submit(trabajo, kind="video", label=str(i)) for i in range(6)]
+    for job in jobs:
+        job.future.result(timeout=5)
+    assert max(maximo) == 2
+
+
+def test_clave_une_trabajos_y_cancelar_en_cola():
+    registry = JobRegistry(limits={"video": 1})
+    soltar = threading.Event()
+    primero = registry.submit(lambda job: soltar.wait(5), kind="video", label="a", key="k")
+    assert registry.submit(lambda job: None, kind="video", label="a", key="k") is primero
+    assert primero.attached == 1
+    en_cola = registry.submit(lambda job: None, kind="video", label="b")
+    assert registry.cancel(en_cola.id) and en_cola.status == CANCELLED
+    soltar.set()
+    primero.future.result(timeout=5)
+    assert primero.status == DONE
+
+
+def test_error_del_trabajo():
+    registry = JobRegistry(limits={"image": 1})
+    job = registry.submit(lambda job: 1 / 0, kind="image", label="x")
+    job.future.result(timeout=5)
+    assert job.status == ERROR and "division" in job.error
+
+
+def test_clave_terminada_sigue_registrada_hasta_recoger():
+    registry = JobRegistry(limits={"image": 1})
+    llamadas = []
+    primero = registry.submit(lambda job: llamadas.append(1) or "img", kind="image", label="a", key="fp")
+    primero.future.result(timeout=5)
+    # Segundo clic tras el final pero antes de que la sesión recoja el resultado
+    assert registry.submit(lambda job: llamadas.append(1), kind="image", label="a", key="fp") is primero
+    assert len(llamadas) == 1
+    registry.collect(primero.id)
+    segundo = registry.submit(lambda job: llamadas.append(1), kind="image", label="a", key="fp")
+    assert segundo is not primero
+    segundo.future.result(timeout=5)
+    assert len(llamadas) == 2
+
+
+def test_error_libera_la_clave():
+    registry = JobRegistry(limits={"image": 1})
+    fallido = registry.submit(lambda job: 1 / 0, kind="image", label="x", key="fp")
+    fallido.future.result(timeout=5)
+    assert registry.submit(lambda job: "ok", kind="image", label="x", key="fp") is not fallido
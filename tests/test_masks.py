@@ -0,0 +1,50 @@
+import PIL.Image
+import PIL.ImageDraw
+import pytest
+
+from archviz.masks import colors_in, find_marks, mentions_color, prepare_edit
+from archviz.media import ReferenceStore
+from archviz.memory import MemoryBudget
+
+
+@pytest.mark.parametrize("prompt, esperado", [
+    ("Remove the RED shape", ("RED",)),
+    ("Improve edit: remove red marked shapes", ("RED",)),
+    ("replace the blue outline with glass", ("BLUE",)),
+    ("red-marked area", ("RED",)),
+    ("yellow dashed stroke", ("YELLOW",)),
+    ("zonas marcadas en rojo y la forma azul", ("RED", "BLUE")),
+    ("a red brick facade with green trees", ()),
+    ("", ()),
+])
+def test_colors_in(prompt, esperado):
+    assert colors_in(prompt) == esperado
+
+
+def test_mentions_color():
+    assert mentions_color("a red brick facade")
+    assert not mentions_color("a concrete museum")
+
+
+def marcada():
+    img = PIL.Image.new("RGB", (640, 360), "gray")
+    PIL.ImageDraw.Draw(img).rectangle((100, 80, 300, 200), outline=(255, 0, 0), width=6)
+    return img
+
+
+def test_find_marks_contorno():
+    (region,) = find_marks(marcada(), ("RED",)).regions
+    assert region["shape"] == "outline"
+    x0, y0, x1, y1 = region["box"]
+    assert abs(x0 - 100 / 640) < 0.03 and abs(x1 - 300 / 640) < 0.03
+    assert abs(y0 - 80 / 360) < 0.03 and abs(y1 - 200 / 360) < 0.03
+
+
+def test_prepare_edit_prompt_en_minusculas(tmp_path):
+    ref = ReferenceStore(MemoryBudget(str(tmp_path))).ingest_image(marcada())
+    prompt, partes, resumen = prepare_edit([ref], "remove red marked shapes")
+    assert resumen[0]["regions"] == 1 and len(partes) == 1
+    assert "RED mark 1 in image 1" in prompt
+
+    prompt, partes, _ = prepare_edit([ref], "remove red marked shapes", clean=True)
+    assert len(partes) == 2 and "binary mask" in prompt
@@ -0,0 +1,94 @@
+import threading
+
+from archviz.memory import MemoryBudget
+
+
+def guardar(valor, path):
+    with open(path, "wb") as f:
+        f.write(valor)
+
+
+def leer(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def sin_bloqueo(fn):
+    # fn() termina en menos de 1 s (no espera a la E/S de otro hilo)
+    hilo = threading.Thread(target=fn, daemon=True)
+    hilo.start()
+    hilo.join(1)
+    return not hilo.is_alive()
+
+
+def test_vuelca_y_recupera(tmp_path):
+    budget = MemoryBudget(str(tmp_path), max_bytes=10)
+    budget.put("a", b"a" * 8, 8, dump=guardar, load=leer)
+    budget.put("b", b"b" * 8, 8, dump=guardar, load=leer)
+    assert budget.usage()["spilled"] == 1
+    assert budget.get("a") == b"a" * 8
+    assert budget.stats["rehydrations"] == 1
+    assert budget.resident_bytes <= 10
+
+
+def test_sin_dump_se_regenera(tmp_path):
+    budget = MemoryBudget(str(tmp_path), max_bytes=10)
+    budget.put("a", b"a" * 8, 8, load=lambda _: b"a" * 8)
+    budget.put("b", b"b" * 8, 8)
+    assert budget.stats["drops"] == 1
+    assert budget.get("a") == b"a" * 8
+
+
+def test_release_inactive(tmp_path):
+    budget = MemoryBudget(str(tmp_path))
+    budget.put("a", b"a", 1, owner="s1")
+    budget.put("b", b"b", 1, owner="s2")
+    budget.get("b", owner="s1")
+    assert budget.release_inactive(lambda owner: owner == "s1") == {"s2"}
+    assert set(budget.usage()["sessions"]) == {"s1"}
+    assert budget.get("b") == b"b"
+
+
+def test_lectura_de_disco_fuera_del_lock(tmp_path):
+    budget = MemoryBudget(str(tmp_path), max_bytes=10)
+    leyendo, soltar = threading.Event(), threading.Event()
+
+    def lenta(path):
+        leyendo.set()
+        soltar.wait(5)
+        return leer(path)
+
+    budget.put("lenta", b"x" * 8, 8, dump=guardar, load=lenta)
+    budget.put("otra", b"y" * 8, 8, dump=guardar, load=leer)
+    hilo = threading.Thread(target=budget.get, args=("lenta",))
+    hilo.start()
+    assert leyendo.wait(5)
+    # Mientras una sesión lee de disco, las demás siguen usando el presupuesto
+    assert sin_bloqueo(lambda: budget.put("c", b"z", 1))
+    assert budget.get("c") == b"z"
+    soltar.set()
+    hilo.join(5)
+    assert budget.get("lenta") == b"x" * 8
+
+
+def test_descartar_durante_el_volcado(tmp_path):
+    budget = MemoryBudget(str(tmp_path), max_bytes=10)
+    escribiendo, soltar = threading.Event(), threading.Event()
+
+    def dump_lento(valor, path):
+        escribiendo.set()
+        soltar.wait(5)
+        guardar(valor, path)
+
+    budget.put("a", b"a" * 8, 8, dump=dump_lento, load=leer)
+    hilo = threading.Thread(target=budget.put, args=("b", b"b" * 8, 8))
+    hilo.start()
+    assert escribiendo.wait(5)
+    # Aún escribiéndose: se sirve desde memoria
+    assert sin_bloqueo(lambda: budget.get("a"))
+    assert budget.get("a") == b"a" * 8
+    budget.discard("a")
+    soltar.set()
+    hilo.join(5)
+    assert "a" not in budget
+    assert not list(tmp_path.joinpath("spill").glob("*/a.*"))
@@ -0,0 +1,29 @@
+from archviz.prompt_cache import PromptCache
+
+
+def test_lru_en_memoria_acotado(tmp_path):
+    cache = PromptCache(cache_dir=str(tmp_path), max_memory=2)
+    cache.put("a", "v1", "m", "texto a")
+    cache.put("b", "v1", "m", "texto b")
+    assert cache.get("a", "v1", "m") == ("texto a", "memoria")  # "a" pasa a ser la más reciente
+    cache.put("c", "v1", "m", "texto c")
+    assert cache.summary()["entries"] == 2 and cache.stats["evictions"] == 1
+    # "b" salió de memoria pero sigue en disco
+    assert cache.get("b", "v1", "m") == ("texto b", "disco")
+
+
+def test_disco_sobrevive_a_un_reinicio(tmp_path):
+    PromptCache(cache_dir=str(tmp_path)).put("Casa  en la PLAYA", "v1", "m", "prompt")
+    nueva = PromptCache(cache_dir=str(tmp_path))
+    assert nueva.get("casa en la playa", "v1", "m") == ("prompt", "disco")
+    assert nueva.get("casa en la playa", "v1", "m") == ("prompt", "memoria")
+
+
+def test_set_library_invalida_la_version_anterior(tmp_path):
+    cache = PromptCache(cache_dir=str(tmp_path))
+    cache.set_library("v1")
+    cache.put("a", "v1", "m", "viejo")
+    cache.set_library("v2")
+    assert cache.summary()["entries"] == 0
+    assert not list((tmp_path / "prompts").glob("*.json"))
+    assert PromptCache(cache_dir=str(tmp_path)).get("a", "v1", "m") == (None, None)
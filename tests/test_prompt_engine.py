@@ -0,0 +1,42 @@
+import threading
+
+import fake_genai
+from archviz.prompt_cache import PromptCache
+from archviz.prompt_context import PromptContextIndex
+from archviz.prompt_engine import PROMPT_MODEL, stream_prompt
+
+
+def test_stream_cancelado_cierra_y_no_guarda_en_cache(tmp_path, monkeypatch):
+    client = fake_genai.FakeClient(fake_genai.FakeConfig(text_latency=0, text_words=40, stream_chunks=8))
+    original = fake_genai._Models.generate_content_stream
+    cerrado = []
+
+    def stream(self, model, contents, config=None):
+        try:
+            yield from original(self, model, contents, config)
+        except GeneratorExit:
+            cerrado.append(True)
+            raise
+
+    monkeypatch.setattr(fake_genai._Models, "generate_content_stream", stream)
+    cache = PromptCache(cache_dir=str(tmp_path))
+    cancel = threading.Event()
+    textos = []
+
+    def on_text(texto):
+        textos.append(texto)
+        if len(textos) == 2:
+            cancel.set()
+
+    texto, stats = stream_prompt(client, PromptContextIndex({}), "casa en la playa", "lib", cache,
+                                 on_text=on_text, cancel=cancel)
+    assert stats["cancelled"] and stats["ttft_ms"] is not None
+    assert cerrado == [True]
+    assert texto == textos[-1].strip() and len(textos) == 2
+    assert cache.get("casa en la playa", "lib", PROMPT_MODEL)[0] is None
+    assert not list(tmp_path.glob("prompts/*.json"))
+
+    # Sin cancelar, el texto completo sí se guarda
+    completo, stats = stream_prompt(client, PromptContextIndex({}), "casa en la playa", "lib", cache)
+    assert not stats["cancelled"] and len(completo.split()) == 40
+    assert cache.get("casa en la playa", "lib", PROMPT_MODEL)[0] == completo
@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from archviz.library import JsonLibrary
+from archviz.recipes import RecipeComposer
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture(scope="module")
+def composer():
+    library = JsonLibrary(DATA)
+    library.reload()
+    return RecipeComposer(library.snapshot()[0])
+
+
+@pytest.mark.parametrize("command", [
+    "Multiple: 3 Architectural Recipe: a villa by the sea",
+    "Architectural Recipe: a villa by the sea. Multiple: 3",
+])
+def test_parse_multiple_antes_o_despues_de_la_cabecera(composer, command):
+    receta = composer.parse(command)
+    assert receta["formula"] == "Architectural" and receta["n"] == 3
+    assert receta["subject"] == "a villa by the sea"
+
+
+def test_parse_sin_cabecera_va_al_llm(composer):
+    assert composer.parse("a villa by the sea") is None
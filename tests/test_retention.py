@@ -0,0 +1,56 @@
+import os
+import time
+
+import PIL.Image
+
+from archviz.history import HistoryStore
+from archviz.media_store import MediaStore
+from archviz.memory import MemoryBudget
+from archviz.upscale import UpscaleEngine
+
+
+def imagen(color):
+    return PIL.Image.new("RGB", (320, 180), color)
+
+
+def envejecer(path, segundos):
+    t = time.time() - segundos
+    os.utime(path, (t, t))
+
+
+def test_historial_borra_lo_antiguo_con_su_miniatura(tmp_path):
+    budget = MemoryBudget(str(tmp_path))
+    store = HistoryStore(str(tmp_path), budget=budget, max_age_days=1)
+    viejo = store.add_image(imagen("red"), "a")["hash"]
+    store.load(viejo)
+    for path in (store.path(viejo), store.thumb_path(viejo)):
+        envejecer(path, 3 * 86400)
+    nuevo = store.add_image(imagen("blue"), "b")["hash"]
+    assert not store.exists(viejo) and not os.path.exists(store.thumb_path(viejo))
+    assert f"history:{viejo}" not in budget and f"thumb:{viejo}" not in budget
+    assert store.exists(nuevo) and os.path.exists(store.thumb_path(nuevo))
+
+
+def test_historial_tope_de_tamano_conserva_el_recien_guardado(tmp_path):
+    store = HistoryStore(str(tmp_path), budget=MemoryBudget(str(tmp_path)), max_bytes=1)
+    primero = store.add_image(imagen("red"), "a")["hash"]
+    segundo = store.add_image(imagen("green"), "b")["hash"]
+    assert not store.exists(primero)
+    assert store.exists(segundo) and os.path.exists(store.thumb_path(segundo))
+
+
+def test_reescalados_con_retencion(tmp_path):
+    engine = UpscaleEngine(str(tmp_path), max_bytes=1)
+    primero = engine.run("a" * 16, lambda: imagen("red"), "4K", fast=True)
+    segundo = engine.run("b" * 16, lambda: imagen("blue"), "4K", fast=True)
+    assert not os.path.exists(primero) and os.path.exists(segundo)
+    assert engine.cached("a" * 16, "4K", True) is None
+
+
+def test_videos_con_nombre_no_adivinable(tmp_path):
+    store = MediaStore(str(tmp_path), url_prefix="app/static/videos")
+    path = store.save_stream([b"mp4"])
+    aleatorio = os.path.basename(path).rsplit("_", 1)[1].split(".")[0]
+    assert len(aleatorio) == 32
+    assert store.read(path) == b"mp4"
+    assert store.url_for(path) == f"app/static/videos/{os.path.basename(path)}"